@@ -0,0 +1,149 @@
+﻿from __future__ import annotations
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.config import (
+    ADMIN_GROUP_ID,
+    ADMIN_IDS,
+    BOT_TOKEN,
+    FSM_STORAGE,
+    RECORD_MAX_MB,
+    RECORD_UPDATES_DIR,
+)
+from app.db import database as db
+from app.handlers import admin, user
+from app.middlewares.idempotency import IdempotencyMiddleware
+from app.middlewares.isolation import UserEventIsolation
+from app.middlewares.recording import UpdateRecorder
+from app.services import memory, metrics
+from app.services.fsm_storage import SQLiteStorage
+from app.services.health import PollingWatch
+from app.services.outbound import OutboundMiddleware, scheduler
+
+
+def create_bot() -> Bot:
+    bot = Bot(token=BOT_TOKEN)
+    bot.session.middleware(PollingWatch())
+    bot.session.middleware(OutboundMiddleware(scheduler))
+    # after the throttle, so only time spent on the API itself is measured
+    bot.session.middleware(metrics.ApiMetricsMiddleware())
+    return bot
+
+
+def create_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SQLiteStorage()
+
+
+def create_dispatcher() -> Dispatcher:
+    storage = create_storage()
+    idempotency = IdempotencyMiddleware()
+    isolation = UserEventIsolation()
+    dp = Dispatcher(storage=storage, events_isolation=isolation)
+    if RECORD_UPDATES_DIR:
+        recorder = UpdateRecorder(
+            RECORD_UPDATES_DIR, ADMIN_IDS, ADMIN_GROUP_ID, int(RECORD_MAX_MB * 1024 * 1024)
+        )
+        dp.update.outer_middleware(recorder)
+        dp.shutdown.register(recorder.close)
+    dp.update.outer_middleware(metrics.UpdateMetricsMiddleware())
+    dp.update.outer_middleware(idempotency)
+    handler_metrics = metrics.HandlerMetricsMiddleware()
+    for router in (user.router, admin.router):
+        router.message.middleware(handler_metrics)
+        router.callback_query.middleware(handler_metrics)
+    dp.include_router(user.router)
+    dp.include_router(admin.router)
+    setup_metrics(storage, idempotency)
+    track_memory(storage, idempotency, isolation)
+    return dp
+
+
+def track_memory(
+    storage: BaseStorage,
+    idempotency: IdempotencyMiddleware,
+    isolation: UserEventIsolation,
+) -> None:
+    if isinstance(storage, SQLiteStorage):
+        memory.track("fsm_hot_keys", lambda: storage.stats()["hot_keys"])
+        memory.track("fsm_dirty_keys", lambda: storage.stats()["dirty_keys"])
+    elif isinstance(storage, MemoryStorage):
+        memory.track("fsm_memory_keys", lambda: len(storage.storage))
+    memory.track("idempotency_recent_keys", lambda: len(idempotency.recent))
+    memory.track("user_locks", lambda: isolation.stats()["locks"])
+
+
+def setup_metrics(storage: BaseStorage, idempotency: IdempotencyMiddleware) -> None:
+    metrics.instrument_module(db)
+
+    @metrics.registry.collector
+    def outbound_stats() -> list[metrics.Family]:
+        stats = scheduler.stats()
+        return [
+            (
+                "shop_outbound_queue_depth",
+                "gauge",
+                "Requests waiting for an outbound slot.",
+                [({"priority": k}, v) for k, v in stats["queue_depth_by_priority"].items()],
+            ),
+            (
+                "shop_outbound_granted_total",
+                "counter",
+                "Outbound slots granted.",
+                [({"priority": k}, v) for k, v in stats["granted"].items()],
+            ),
+            (
+                "shop_outbound_wait_seconds_total",
+                "counter",
+                "Time spent waiting for an outbound slot.",
+                [({"priority": k}, v) for k, v in stats["wait_seconds_total"].items()],
+            ),
+            (
+                "shop_outbound_retry_after_total",
+                "counter",
+                "Flood-control responses from Telegram.",
+                [({}, stats["retry_after"])],
+            ),
+        ]
+
+    @metrics.registry.collector
+    def idempotency_stats() -> list[metrics.Family]:
+        return [
+            (
+                "shop_duplicate_updates_dropped_total",
+                "counter",
+                "Updates dropped as duplicates or double taps.",
+                [({}, idempotency.dropped)],
+            )
+        ]
+
+    @metrics.registry.collector
+    async def outbox_stats() -> list[metrics.Family]:
+        counts = await db.count_outbox_by_status()
+        return [
+            (
+                "shop_outbox_messages",
+                "gauge",
+                "Outbox rows by status.",
+                [({"status": k}, v) for k, v in counts.items()],
+            )
+        ]
+
+    if isinstance(storage, SQLiteStorage):
+
+        @metrics.registry.collector
+        def fsm_stats() -> list[metrics.Family]:
+            return [
+                (f"shop_fsm_{name}", "gauge", "SQLite FSM storage counter.", [({}, value)])
+                for name, value in storage.stats().items()
+            ]
+
+
+def used_update_types() -> list[str]:
+    return sorted(
+        set(user.router.resolve_used_update_types())
+        | set(admin.router.resolve_used_update_types())
+    )
@@ -40,14 +40,101 @@ def _parse_admin_ids(value: str) -> list[int]:
     return ids
 
 
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
 ADMIN_IDS = _parse_admin_ids(os.getenv("ADMIN_IDS", ""))
 try:
     ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID", "0") or 0)
 except ValueError:
     ADMIN_GROUP_ID = 0
 
-DB_PATH = BASE_DIR / "data" / "shop.db"
+DB_PATH = Path(os.getenv("DB_PATH", "") or BASE_DIR / "data" / "shop.db")
+# Seconds a connection waits for SQLite's write lock before "database is locked";
+# writers queue behind each other, so bursts need more than sqlite's default 5.
+DB_BUSY_TIMEOUT = _env_number("DB_BUSY_TIMEOUT", 30)
 LOG_PATH = BASE_DIR / "logs" / "bot.log"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper() or "INFO"
+# text | json (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower() or "text"
+# bot.log rolls over at this size or at midnight; old segments are kept gzipped
+LOG_MAX_MB = _env_number("LOG_MAX_MB", 10)
+LOG_BACKUP_COUNT = int(_env_number("LOG_BACKUP_COUNT", 14))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1").strip() != "0"
+
+# Telegram flood limits: ~30 messages/s overall, 20 messages/min per group.
+OUTBOUND_GLOBAL_RATE = _env_number("OUTBOUND_GLOBAL_RATE", 30)
+OUTBOUND_GROUP_RATE = _env_number("OUTBOUND_GROUP_RATE", 20)
+OUTBOUND_MAX_RETRIES = int(_env_number("OUTBOUND_MAX_RETRIES", 3))
+
+# polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower() or "polling"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(_env_number("WEBHOOK_PORT", 8080))
+WEBHOOK_SHUTDOWN_TIMEOUT = _env_number("WEBHOOK_SHUTDOWN_TIMEOUT", 30)
+
+# 1 = old behaviour: drop updates queued while the bot was down
+SKIP_PENDING_UPDATES = os.getenv("SKIP_PENDING_UPDATES", "0").strip() == "1"
+
+# 1 = single process; N > 1 = receiver process plus N worker processes
+WORKERS = max(1, int(_env_number("WORKERS", 1)))
+
+# Same button from the same user within this many seconds is a double tap.
+IDEMPOTENCY_TAP_WINDOW = _env_number("IDEMPOTENCY_TAP_WINDOW", 1.5)
+IDEMPOTENCY_PAYMENT_WINDOW = _env_number("IDEMPOTENCY_PAYMENT_WINDOW", 300)
+
+BROADCAST_CONCURRENCY = int(_env_number("BROADCAST_CONCURRENCY", 8))
+BROADCAST_PAGE_SIZE = int(_env_number("BROADCAST_PAGE_SIZE", 100))
+
+# sqlite | memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower() or "sqlite"
+FSM_STATE_TTL_HOURS = _env_number("FSM_STATE_TTL_HOURS", 72)
+FSM_FLUSH_INTERVAL = _env_number("FSM_FLUSH_INTERVAL", 1)
+
+OUTBOX_BATCH_SIZE = int(_env_number("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_MAX_ATTEMPTS = int(_env_number("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_POLL_INTERVAL = _env_number("OUTBOX_POLL_INTERVAL", 5)
+
+# Prometheus text on http://METRICS_HOST:METRICS_PORT/metrics, 0 = off.
+# With WORKERS > 1 worker i (1..WORKERS) listens on METRICS_PORT + i.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(_env_number("METRICS_PORT", 9108))
+
+# Event loop lag: a sample every LOOP_LAG_INTERVAL s; admins get an alert when
+# the average over LOOP_LAG_ALERT_SECONDS stays above LOOP_LAG_THRESHOLD_MS.
+LOOP_LAG_INTERVAL = _env_number("LOOP_LAG_INTERVAL", 0.25)
+LOOP_LAG_THRESHOLD_MS = _env_number("LOOP_LAG_THRESHOLD_MS", 100)
+LOOP_LAG_ALERT_SECONDS = _env_number("LOOP_LAG_ALERT_SECONDS", 30)
+LOOP_LAG_ALERT_COOLDOWN = _env_number("LOOP_LAG_ALERT_COOLDOWN", 600)
+# > 0 turns on asyncio debug mode and logs callbacks slower than this
+LOOP_SLOW_CALLBACK_MS = _env_number("LOOP_SLOW_CALLBACK_MS", 0)
+
+# > 0 starts tracemalloc at boot with this many frames per allocation, so
+# /mem compares against a startup baseline; tracing costs CPU and memory.
+TRACEMALLOC_FRAMES = int(_env_number("TRACEMALLOC_FRAMES", 0))
+
+# Opt-in capture of incoming updates for scripts/replay_updates.py: gzipped
+# JSONL files in this directory, ids, names and file_ids anonymized.
+RECORD_UPDATES_DIR = os.getenv("RECORD_UPDATES_DIR", "").strip()
+if RECORD_UPDATES_DIR and not Path(RECORD_UPDATES_DIR).is_absolute():
+    RECORD_UPDATES_DIR = str(BASE_DIR / RECORD_UPDATES_DIR)
+RECORD_MAX_MB = _env_number("RECORD_MAX_MB", 200)
+
+# /healthz and /readyz on the metrics port (and the webhook server): not ready
+# when the DB check takes longer than HEALTH_DB_TIMEOUT s, no getUpdates
+# succeeded for HEALTH_POLL_STALE s, or the outbound queue is longer.
+HEALTH_DB_TIMEOUT = _env_number("HEALTH_DB_TIMEOUT", 2)
+# a DB check result is reused for this many seconds, however often /readyz is hit
+HEALTH_DB_CACHE = _env_number("HEALTH_DB_CACHE", 5)
+HEALTH_POLL_STALE = _env_number("HEALTH_POLL_STALE", 90)
+HEALTH_MAX_OUTBOUND_QUEUE = int(_env_number("HEALTH_MAX_OUTBOUND_QUEUE", 1000))
 
 PAYMENT_DETAILS = (
     "Реквизиты для оплаты:\n"
@@ -197,6 +284,8 @@ class Buttons:
     ADMIN_REPORTS: str = "Отчет по оплатам"
     ADMIN_REQUESTS: str = "Заявки на оплату"
     ADMIN_STATS: str = "Статистика продаж"
+    ADMIN_OUTBOX: str = "Зависшие выдачи"
+    ADMIN_BROADCAST: str = "Рассылка"
     ADMIN_PANEL: str = "Админ-панель"
 
     CONFIRM: str = "✅ Подтвердить"
@@ -1,11 +1,13 @@
 ﻿from __future__ import annotations
 
+import json
 from typing import Any
 
 import aiosqlite
 
 from app.config import (
     AREAS,
+    DB_BUSY_TIMEOUT,
     DB_PATH,
     DEFAULT_CLASSES,
     DEFAULT_CITIES,
@@ -41,7 +43,8 @@ async def _table_columns(db: aiosqlite.Connection, table: str) -> list[str]:
 
 async def init_db() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute("PRAGMA journal_mode = WAL;")
         await db.execute("PRAGMA foreign_keys = ON;")
 
         if await _table_exists(db, "products") and not await _table_has_column(
@@ -49,6 +52,11 @@ async def init_db() -> None:
         ):
             await db.execute("ALTER TABLE products RENAME TO products_old")
 
+        if await _table_exists(db, "variants") and not await _table_has_column(
+            db, "variants", "id"
+        ):
+            await _migrate_variant_ids(db)
+
         await db.executescript(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -59,6 +67,7 @@ async def init_db() -> None:
                 last_city_id INTEGER,
                 last_area_id INTEGER,
                 support_blocked INTEGER NOT NULL DEFAULT 0,
+                bot_blocked INTEGER NOT NULL DEFAULT 0,
                 created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
             );
 
@@ -136,7 +145,8 @@ async def init_db() -> None:
             );
 
             CREATE TABLE IF NOT EXISTS variants (
-                name TEXT PRIMARY KEY,
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
                 sort_order INTEGER NOT NULL DEFAULT 0
             );
 
@@ -171,6 +181,173 @@ async def init_db() -> None:
                 key TEXT PRIMARY KEY,
                 value TEXT NOT NULL
             );
+
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                group_key TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                sent_at TEXT
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_outbox_status_due
+                ON outbox(status, next_attempt_at);
+
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_fsm_states_updated
+                ON fsm_states(updated_at);
+
+            CREATE INDEX IF NOT EXISTS idx_payments_status_created
+                ON payments(status, created_at, id);
+
+            CREATE INDEX IF NOT EXISTS idx_orders_user_status
+                ON orders(user_id, status, id);
+
+            CREATE INDEX IF NOT EXISTS idx_order_items_order
+                ON order_items(order_id);
+
+            CREATE INDEX IF NOT EXISTS idx_products_catalog
+                ON products(city_id, area_id, variant, class);
+
+            CREATE TABLE IF NOT EXISTS payment_status_counts (
+                status TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            );
+
+            INSERT OR IGNORE INTO payment_status_counts (status, count)
+                SELECT status, COUNT(*) FROM payments GROUP BY status;
+
+            CREATE TRIGGER IF NOT EXISTS trg_payments_count_insert
+            AFTER INSERT ON payments
+            BEGIN
+                INSERT INTO payment_status_counts (status, count) VALUES (NEW.status, 1)
+                ON CONFLICT(status) DO UPDATE SET count = count + 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_payments_count_update
+            AFTER UPDATE OF status ON payments
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                UPDATE payment_status_counts SET count = count - 1
+                WHERE status = OLD.status;
+                INSERT INTO payment_status_counts (status, count) VALUES (NEW.status, 1)
+                ON CONFLICT(status) DO UPDATE SET count = count + 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_payments_count_delete
+            AFTER DELETE ON payments
+            BEGIN
+                UPDATE payment_status_counts SET count = count - 1
+                WHERE status = OLD.status;
+            END;
+
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT,
+                photo_file_id TEXT,
+                status TEXT NOT NULL DEFAULT 'running',
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                delivered INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_by INTEGER NOT NULL,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                finished_at TEXT
+            );
+
+            -- orders here counts orders with a line in exactly this group, so
+            -- it does not add up across groups; sales_daily_orders counts each
+            -- order once per day and city (city_id 0: all cities).
+            CREATE TABLE IF NOT EXISTS sales_daily (
+                day TEXT NOT NULL,
+                city_id INTEGER NOT NULL,
+                area_id INTEGER NOT NULL,
+                variant TEXT NOT NULL,
+                class TEXT NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                items INTEGER NOT NULL DEFAULT 0,
+                revenue INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, city_id, area_id, variant, class)
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS sales_daily_orders (
+                day TEXT NOT NULL,
+                city_id INTEGER NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, city_id)
+            ) WITHOUT ROWID;
+
+            DROP TRIGGER IF EXISTS trg_orders_sales_paid;
+            CREATE TRIGGER trg_orders_sales_paid
+            AFTER UPDATE OF status ON orders
+            WHEN NEW.status = 'paid' AND OLD.status IS NOT 'paid'
+            BEGIN
+                INSERT INTO sales_daily (day, city_id, area_id, variant, class, orders, items, revenue)
+                SELECT date(NEW.created_at), p.city_id, p.area_id, p.variant, p.class,
+                       1, SUM(oi.quantity), SUM(oi.quantity * oi.price)
+                FROM order_items oi
+                JOIN products p ON p.id = oi.product_id
+                WHERE oi.order_id = NEW.id
+                GROUP BY p.city_id, p.area_id, p.variant, p.class
+                ON CONFLICT(day, city_id, area_id, variant, class) DO UPDATE SET
+                    orders = orders + excluded.orders,
+                    items = items + excluded.items,
+                    revenue = revenue + excluded.revenue;
+                INSERT INTO sales_daily_orders (day, city_id, orders)
+                VALUES (date(NEW.created_at), 0, 1)
+                ON CONFLICT(day, city_id) DO UPDATE SET orders = orders + 1;
+                INSERT INTO sales_daily_orders (day, city_id, orders)
+                SELECT DISTINCT date(NEW.created_at), p.city_id, 1
+                FROM order_items oi
+                JOIN products p ON p.id = oi.product_id
+                WHERE oi.order_id = NEW.id
+                ON CONFLICT(day, city_id) DO UPDATE SET orders = orders + 1;
+            END;
+
+            DROP TRIGGER IF EXISTS trg_orders_sales_unpaid;
+            CREATE TRIGGER trg_orders_sales_unpaid
+            AFTER UPDATE OF status ON orders
+            WHEN OLD.status = 'paid' AND NEW.status IS NOT 'paid'
+            BEGIN
+                INSERT INTO sales_daily (day, city_id, area_id, variant, class, orders, items, revenue)
+                SELECT date(OLD.created_at), p.city_id, p.area_id, p.variant, p.class,
+                       -1, -SUM(oi.quantity), -SUM(oi.quantity * oi.price)
+                FROM order_items oi
+                JOIN products p ON p.id = oi.product_id
+                WHERE oi.order_id = OLD.id
+                GROUP BY p.city_id, p.area_id, p.variant, p.class
+                ON CONFLICT(day, city_id, area_id, variant, class) DO UPDATE SET
+                    orders = orders + excluded.orders,
+                    items = items + excluded.items,
+                    revenue = revenue + excluded.revenue;
+                DELETE FROM sales_daily
+                WHERE day = date(OLD.created_at) AND orders <= 0;
+                INSERT INTO sales_daily_orders (day, city_id, orders)
+                VALUES (date(OLD.created_at), 0, -1)
+                ON CONFLICT(day, city_id) DO UPDATE SET orders = orders - 1;
+                INSERT INTO sales_daily_orders (day, city_id, orders)
+                SELECT DISTINCT date(OLD.created_at), p.city_id, -1
+                FROM order_items oi
+                JOIN products p ON p.id = oi.product_id
+                WHERE oi.order_id = OLD.id
+                ON CONFLICT(day, city_id) DO UPDATE SET orders = orders - 1;
+                DELETE FROM sales_daily_orders
+                WHERE day = date(OLD.created_at) AND orders <= 0;
+            END;
             """
         )
 
@@ -228,13 +405,119 @@ async def init_db() -> None:
                 await db.execute(
                     "ALTER TABLE users ADD COLUMN support_blocked INTEGER NOT NULL DEFAULT 0"
                 )
+            if not await _table_has_column(db, "users", "bot_blocked"):
+                await db.execute(
+                    "ALTER TABLE users ADD COLUMN bot_blocked INTEGER NOT NULL DEFAULT 0"
+                )
+            if not await _table_has_column(db, "users", "total_spent"):
+                await db.execute(
+                    "ALTER TABLE users ADD COLUMN total_spent INTEGER NOT NULL DEFAULT 0"
+                )
+                await db.execute("ALTER TABLE users ADD COLUMN last_paid_at TEXT")
+                await _rebuild_purchase_summaries(db)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_last_paid ON users(last_paid_at)"
+            )
 
         await _seed_variants_and_classes(db)
         await _seed_cities_and_areas(db)
         await _seed_products(db)
+
+        # First start after the rollups were added: backfill them from paid orders.
+        cur = await db.execute("SELECT 1 FROM sales_daily_orders LIMIT 1")
+        has_sales = await cur.fetchone()
+        await cur.close()
+        if not has_sales:
+            await _rebuild_sales_daily(db)
         await db.commit()
 
 
+async def _migrate_variant_ids(db: aiosqlite.Connection) -> None:
+    # Callback data carries variant ids, so they must survive VACUUM: copy
+    # the implicit rowids into a real column. Foreign keys are off so that
+    # dropping the old table does not cascade into classes.
+    await db.execute("PRAGMA foreign_keys = OFF;")
+    await db.executescript(
+        """
+        BEGIN;
+        CREATE TABLE variants_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            sort_order INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT INTO variants_new (id, name, sort_order)
+            SELECT rowid, name, sort_order FROM variants;
+        DROP TABLE variants;
+        ALTER TABLE variants_new RENAME TO variants;
+        COMMIT;
+        """
+    )
+    await db.execute("PRAGMA foreign_keys = ON;")
+
+
+async def _rebuild_purchase_summaries(db: aiosqlite.Connection) -> int:
+    cur = await db.execute(
+        """
+        UPDATE users
+        SET purchases_count = (
+                SELECT COUNT(*) FROM orders
+                WHERE user_id = users.tg_id AND status = 'paid'
+            ),
+            total_spent = (
+                SELECT COALESCE(SUM(total), 0) FROM orders
+                WHERE user_id = users.tg_id AND status = 'paid'
+            ),
+            last_paid_at = (
+                SELECT MAX(created_at) FROM orders
+                WHERE user_id = users.tg_id AND status = 'paid'
+            )
+        """
+    )
+    return int(cur.rowcount)
+
+
+async def _rebuild_sales_daily(db: aiosqlite.Connection) -> int:
+    await db.execute("DELETE FROM sales_daily")
+    cur = await db.execute(
+        """
+        INSERT INTO sales_daily (day, city_id, area_id, variant, class, orders, items, revenue)
+        SELECT date(o.created_at), p.city_id, p.area_id, p.variant, p.class,
+               COUNT(DISTINCT o.id), SUM(oi.quantity), SUM(oi.quantity * oi.price)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        JOIN products p ON p.id = oi.product_id
+        WHERE o.status = 'paid'
+        GROUP BY date(o.created_at), p.city_id, p.area_id, p.variant, p.class
+        """
+    )
+    count = int(cur.rowcount)
+    await db.execute("DELETE FROM sales_daily_orders")
+    await db.execute(
+        """
+        INSERT INTO sales_daily_orders (day, city_id, orders)
+        SELECT date(created_at), 0, COUNT(*)
+        FROM orders
+        WHERE status = 'paid'
+        GROUP BY date(created_at)
+        """
+    )
+    await db.execute(
+        """
+        INSERT INTO sales_daily_orders (day, city_id, orders)
+        SELECT day, city_id, COUNT(*)
+        FROM (
+            SELECT DISTINCT date(o.created_at) AS day, o.id, p.city_id
+            FROM orders o
+            JOIN order_items oi ON oi.order_id = o.id
+            JOIN products p ON p.id = oi.product_id
+            WHERE o.status = 'paid'
+        )
+        GROUP BY day, city_id
+        """
+    )
+    return count
+
+
 async def _seed_cities_and_areas(db: aiosqlite.Connection) -> None:
     cur = await db.execute("SELECT COUNT(*) FROM cities")
     count_row = await cur.fetchone()
@@ -363,8 +646,10 @@ async def _seed_products(db: aiosqlite.Connection) -> None:
         )
 
 
-async def _fetch_all(query: str, params: tuple[Any, ...] = ()) -> list[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
+async def _fetch_all(
+    query: str, params: tuple[Any, ...] | dict[str, Any] = ()
+) -> list[aiosqlite.Row]:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         db.row_factory = aiosqlite.Row
         cur = await db.execute(query, params)
         rows = await cur.fetchall()
@@ -372,8 +657,10 @@ async def _fetch_all(query: str, params: tuple[Any, ...] = ()) -> list[aiosqlite
         return rows
 
 
-async def _fetch_one(query: str, params: tuple[Any, ...] = ()) -> aiosqlite.Row | None:
-    async with aiosqlite.connect(DB_PATH) as db:
+async def _fetch_one(
+    query: str, params: tuple[Any, ...] | dict[str, Any] = ()
+) -> aiosqlite.Row | None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         db.row_factory = aiosqlite.Row
         cur = await db.execute(query, params)
         row = await cur.fetchone()
@@ -381,21 +668,22 @@ async def _fetch_one(query: str, params: tuple[Any, ...] = ()) -> aiosqlite.Row
         return row
 
 
-async def _execute(query: str, params: tuple[Any, ...] = ()) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+async def _execute(query: str, params: tuple[Any, ...] | dict[str, Any] = ()) -> None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         await db.execute(query, params)
         await db.commit()
 
 
 async def upsert_user(tg_id: int, username: str | None, first_name: str | None) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         await db.execute(
             """
             INSERT INTO users (tg_id, username, first_name)
             VALUES (?, ?, ?)
             ON CONFLICT(tg_id) DO UPDATE SET
                 username = excluded.username,
-                first_name = excluded.first_name
+                first_name = excluded.first_name,
+                bot_blocked = 0
             """,
             (tg_id, username, first_name),
         )
@@ -476,14 +764,21 @@ async def get_variant_photos() -> dict[str, str]:
 
 async def get_variants() -> list[aiosqlite.Row]:
     return await _fetch_all(
-        "SELECT name, sort_order FROM variants ORDER BY sort_order, name"
+        "SELECT id, name, sort_order FROM variants ORDER BY sort_order, name"
+    )
+
+
+async def get_variant_by_id(variant_id: int) -> aiosqlite.Row | None:
+    return await _fetch_one(
+        "SELECT id, name, sort_order FROM variants WHERE id = ?",
+        (variant_id,),
     )
 
 
 async def get_classes(variant: str) -> list[aiosqlite.Row]:
     return await _fetch_all(
         """
-        SELECT name, sort_order
+        SELECT id, name, sort_order
         FROM classes
         WHERE variant_name = ?
         ORDER BY sort_order, name
@@ -492,12 +787,19 @@ async def get_classes(variant: str) -> list[aiosqlite.Row]:
     )
 
 
+async def get_class_by_id(class_id: int) -> aiosqlite.Row | None:
+    return await _fetch_one(
+        "SELECT id, variant_name, name, sort_order FROM classes WHERE id = ?",
+        (class_id,),
+    )
+
+
 async def rename_area(area_id: int, new_name: str) -> None:
     await _execute("UPDATE areas SET name = ? WHERE id = ?", (new_name, area_id))
 
 
 async def rename_variant(old_name: str, new_name: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         await db.execute("BEGIN")
         await db.execute(
             "UPDATE variants SET name = ? WHERE name = ?",
@@ -515,6 +817,10 @@ async def rename_variant(old_name: str, new_name: str) -> None:
             "UPDATE variant_photos SET variant = ? WHERE variant = ?",
             (new_name, old_name),
         )
+        await db.execute(
+            "UPDATE sales_daily SET variant = ? WHERE variant = ?",
+            (new_name, old_name),
+        )
         await db.commit()
 
 
@@ -536,7 +842,7 @@ async def add_class(variant: str, class_name: str, sort_order: int = 0) -> None:
 
 
 async def rename_class(variant: str, old_name: str, new_name: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         await db.execute("BEGIN")
         await db.execute(
             """
@@ -550,6 +856,10 @@ async def rename_class(variant: str, old_name: str, new_name: str) -> None:
             "UPDATE products SET class = ? WHERE variant = ? AND class = ?",
             (new_name, variant, old_name),
         )
+        await db.execute(
+            "UPDATE sales_daily SET class = ? WHERE variant = ? AND class = ?",
+            (new_name, variant, old_name),
+        )
         await db.commit()
 
 
@@ -570,7 +880,7 @@ async def add_product(
         stock_value = 1
     else:
         stock_value = 1 if stock >= 1 else 0
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         cur = await db.execute(
             """
             INSERT INTO products (
@@ -595,6 +905,15 @@ async def add_product(
         return int(cur.lastrowid)
 
 
+PRODUCTS_FILTERED_SQL = """
+    SELECT id, title, description, price, photo_file_id, stock
+    FROM products
+    WHERE city_id = :city_id AND area_id = :area_id AND variant = :variant
+      AND class = :class_name AND is_active = 1 AND COALESCE(stock, 0) >= 1
+    ORDER BY id DESC
+"""
+
+
 async def get_products_filtered(
     *,
     city_id: int,
@@ -603,14 +922,13 @@ async def get_products_filtered(
     class_name: str,
 ) -> list[aiosqlite.Row]:
     return await _fetch_all(
-        """
-        SELECT id, title, description, price, photo_file_id, stock
-        FROM products
-        WHERE city_id = ? AND area_id = ? AND variant = ? AND class = ? AND is_active = 1
-          AND COALESCE(stock, 0) >= 1
-        ORDER BY id DESC
-        """,
-        (city_id, area_id, variant, class_name),
+        PRODUCTS_FILTERED_SQL,
+        {
+            "city_id": city_id,
+            "area_id": area_id,
+            "variant": variant,
+            "class_name": class_name,
+        },
     )
 
 
@@ -676,24 +994,18 @@ async def list_all_products(limit: int = 100) -> list[aiosqlite.Row]:
     )
 
 
+PAID_USERS_SQL = """
+    SELECT tg_id, username, first_name,
+           purchases_count AS orders_count, last_paid_at
+    FROM users
+    WHERE last_paid_at IS NOT NULL AND purchases_count > 0
+    ORDER BY last_paid_at DESC
+    LIMIT :limit
+"""
+
+
 async def list_paid_users(limit: int = 50) -> list[aiosqlite.Row]:
-    return await _fetch_all(
-        """
-        SELECT
-            o.user_id AS tg_id,
-            u.username,
-            u.first_name,
-            COUNT(*) AS orders_count,
-            MAX(o.created_at) AS last_paid_at
-        FROM orders o
-        LEFT JOIN users u ON u.tg_id = o.user_id
-        WHERE o.status = 'paid'
-        GROUP BY o.user_id, u.username, u.first_name
-        ORDER BY last_paid_at DESC
-        LIMIT ?
-        """,
-        (limit,),
-    )
+    return await _fetch_all(PAID_USERS_SQL, {"limit": limit})
 
 
 async def delete_product(product_id: int) -> None:
@@ -719,7 +1031,7 @@ async def restore_order_products(order_id: int) -> None:
 
 
 async def add_city(name: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         cur = await db.execute("INSERT INTO cities (name) VALUES (?)", (name,))
         city_id = int(cur.lastrowid)
         for area_name in AREAS:
@@ -732,7 +1044,7 @@ async def add_city(name: str) -> int:
 
 
 async def add_area(city_id: int, name: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         cur = await db.execute(
             "INSERT INTO areas (city_id, name) VALUES (?, ?)",
             (city_id, name),
@@ -774,17 +1086,17 @@ async def add_to_cart(user_id: int, product_id: int) -> bool:
     return True
 
 
+CART_ITEMS_SQL = """
+    SELECT p.id as product_id, p.title, p.price, ci.quantity
+    FROM cart_items ci
+    JOIN products p ON p.id = ci.product_id
+    WHERE ci.user_id = :user_id
+    ORDER BY p.title
+"""
+
+
 async def get_cart_items(user_id: int) -> list[aiosqlite.Row]:
-    return await _fetch_all(
-        """
-        SELECT p.id as product_id, p.title, p.price, ci.quantity
-        FROM cart_items ci
-        JOIN products p ON p.id = ci.product_id
-        WHERE ci.user_id = ?
-        ORDER BY p.title
-        """,
-        (user_id,),
-    )
+    return await _fetch_all(CART_ITEMS_SQL, {"user_id": user_id})
 
 
 async def clear_cart(user_id: int) -> None:
@@ -796,7 +1108,7 @@ async def create_order_from_cart(
     user_id: int,
     payment_photo_id: str,
 ) -> dict[str, int | str] | None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
         db.row_factory = aiosqlite.Row
         await db.execute("PRAGMA foreign_keys = ON;")
         await db.execute("BEGIN")
@@ -886,15 +1198,47 @@ async def create_order_from_cart(
         return {"order_id": order_id, "payment_id": payment_id, "total": total}
 
 
-async def list_pending_payments() -> list[aiosqlite.Row]:
-    return await _fetch_all(
-        """
-        SELECT id, order_id, user_id, total, status, photo_file_id, created_at
-        FROM payments
-        WHERE status = 'pending'
-        ORDER BY created_at ASC
-        """
+async def count_payments(status: str) -> int:
+    row = await _fetch_one(
+        "SELECT count FROM payment_status_counts WHERE status = ?", (status,)
     )
+    return int(row["count"]) if row else 0
+
+
+# {where} is empty or a keyset condition on :anchor_id; {order} is "" or "DESC".
+PENDING_PAYMENTS_PAGE_SQL = """
+    SELECT id, order_id, user_id, total, status, photo_file_id, created_at
+    FROM payments
+    WHERE status = 'pending' {where}
+    ORDER BY created_at {order}, id {order}
+    LIMIT :limit
+"""
+
+
+async def list_pending_payments_page(
+    after_id: int = 0, before_id: int = 0, limit: int = 10
+) -> tuple[list[aiosqlite.Row], bool, bool]:
+    anchor = "(SELECT created_at, id FROM payments WHERE id = :anchor_id)"
+    if before_id:
+        rows = await _fetch_all(
+            PENDING_PAYMENTS_PAGE_SQL.format(
+                where=f"AND (created_at, id) < {anchor}", order="DESC"
+            ),
+            {"anchor_id": before_id, "limit": limit + 1},
+        )
+        has_prev = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        has_next = True
+    else:
+        where = f"AND (created_at, id) > {anchor}" if after_id else ""
+        rows = await _fetch_all(
+            PENDING_PAYMENTS_PAGE_SQL.format(where=where, order=""),
+            {"anchor_id": after_id, "limit": limit + 1},
+        )
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = bool(after_id)
+    return rows, has_prev, has_next
 
 
 async def get_payment(payment_id: int) -> aiosqlite.Row | None:
@@ -919,17 +1263,334 @@ async def set_order_status(order_id: int, status: str) -> None:
     await _execute("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
 
 
-async def get_stats() -> dict[str, int]:
-    orders_total = await _fetch_one("SELECT COUNT(*) as c FROM orders")
-    orders_paid = await _fetch_one(
-        "SELECT COUNT(*) as c FROM orders WHERE status = 'paid'"
+async def confirm_payment(
+    payment_id: int, deliveries: list[tuple[str, dict[str, Any]]]
+) -> aiosqlite.Row | None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        db.row_factory = aiosqlite.Row
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute(
+            """
+            UPDATE payments
+            SET status = 'confirmed', processed_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'pending'
+            """,
+            (payment_id,),
+        )
+        if cur.rowcount == 0:
+            await db.execute("ROLLBACK")
+            return None
+
+        cur = await db.execute(
+            """
+            SELECT id, order_id, user_id, total, status, photo_file_id, created_at, processed_at
+            FROM payments
+            WHERE id = ?
+            """,
+            (payment_id,),
+        )
+        payment = await cur.fetchone()
+        await cur.close()
+
+        await db.execute(
+            "UPDATE orders SET status = 'paid' WHERE id = ?",
+            (int(payment["order_id"]),),
+        )
+        await db.execute(
+            """
+            UPDATE users
+            SET purchases_count = purchases_count + 1,
+                total_spent = total_spent + ?,
+                last_paid_at = MAX(
+                    COALESCE(last_paid_at, ''),
+                    (SELECT created_at FROM orders WHERE id = ?)
+                )
+            WHERE tg_id = ?
+            """,
+            (int(payment["total"]), int(payment["order_id"]), int(payment["user_id"])),
+        )
+        group_key = f"payment:{payment_id}"
+        await db.executemany(
+            """
+            INSERT OR IGNORE INTO outbox (idempotency_key, group_key, chat_id, kind, payload)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    f"{group_key}:{seq}",
+                    group_key,
+                    int(payment["user_id"]),
+                    kind,
+                    json.dumps(payload, ensure_ascii=False),
+                )
+                for seq, (kind, payload) in enumerate(deliveries)
+            ],
+        )
+        await db.commit()
+        return payment
+
+
+DUE_OUTBOX_SQL = """
+    SELECT id, idempotency_key, group_key, chat_id, kind, payload, attempts
+    FROM outbox
+    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+    ORDER BY id
+    LIMIT :limit
+"""
+
+
+async def get_due_outbox(limit: int = 50) -> list[aiosqlite.Row]:
+    return await _fetch_all(DUE_OUTBOX_SQL, {"limit": limit})
+
+
+async def mark_outbox_sent(outbox_ids: list[int]) -> None:
+    if not outbox_ids:
+        return
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.executemany(
+            """
+            UPDATE outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ?
+            """,
+            [(outbox_id,) for outbox_id in outbox_ids],
+        )
+        await db.commit()
+
+
+async def mark_outbox_failed(
+    outbox_id: int, group_key: str, attempts: int, error: str
+) -> None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute("BEGIN")
+        await db.execute(
+            """
+            UPDATE outbox
+            SET status = 'failed', attempts = ?, last_error = ?
+            WHERE id = ?
+            """,
+            (attempts, error, outbox_id),
+        )
+        # Stop the rest of the group as well: a retry resends them all in order.
+        await db.execute(
+            """
+            UPDATE outbox
+            SET status = 'failed', last_error = ?
+            WHERE group_key = ? AND status = 'pending' AND id > ?
+            """,
+            (f"held: outbox {outbox_id} failed", group_key, outbox_id),
+        )
+        await db.commit()
+
+
+async def reschedule_outbox(
+    outbox_id: int, group_key: str, attempts: int, delay_seconds: int, error: str
+) -> None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute("BEGIN")
+        await db.execute(
+            "UPDATE outbox SET attempts = ?, last_error = ? WHERE id = ?",
+            (attempts, error, outbox_id),
+        )
+        # Hold back the rest of the group too, so messages keep their order.
+        await db.execute(
+            """
+            UPDATE outbox
+            SET next_attempt_at = datetime('now', ?)
+            WHERE group_key = ? AND status = 'pending'
+            """,
+            (f"+{int(delay_seconds)} seconds", group_key),
+        )
+        await db.commit()
+
+
+async def list_stuck_outbox(
+    stale_minutes: int = 5, limit: int = 30
+) -> list[aiosqlite.Row]:
+    return await _fetch_all(
+        """
+        SELECT id, idempotency_key, chat_id, kind, status, attempts, last_error, created_at
+        FROM outbox
+        WHERE status = 'failed'
+           OR (status = 'pending' AND created_at <= datetime('now', ?))
+        ORDER BY id
+        LIMIT ?
+        """,
+        (f"-{int(stale_minutes)} minutes", limit),
     )
-    orders_pending = await _fetch_one(
-        "SELECT COUNT(*) as c FROM orders WHERE status = 'pending_review'"
+
+
+async def ping_db(timeout: float) -> None:
+    # In WAL mode a plain SELECT never waits, so also take the write lock:
+    # a writer stuck inside a transaction shows up here. Health caches the
+    # result, so this runs at most once per HEALTH_DB_CACHE seconds.
+    async with aiosqlite.connect(DB_PATH, timeout=timeout) as db:
+        await db.execute("SELECT 1")
+        await db.execute("BEGIN IMMEDIATE")
+        await db.execute("ROLLBACK")
+
+
+async def count_outbox_by_status() -> dict[str, int]:
+    rows = await _fetch_all("SELECT status, COUNT(*) AS cnt FROM outbox GROUP BY status")
+    return {str(row["status"]): int(row["cnt"]) for row in rows}
+
+
+async def retry_failed_outbox() -> int:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        cur = await db.execute(
+            """
+            UPDATE outbox
+            SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP
+            WHERE status = 'failed'
+               OR (status = 'pending' AND next_attempt_at > CURRENT_TIMESTAMP)
+            """
+        )
+        await db.commit()
+        return int(cur.rowcount)
+
+
+async def create_broadcast(
+    text: str | None, photo_file_id: str | None, created_by: int
+) -> int:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        cur = await db.execute(
+            """
+            INSERT INTO broadcasts (text, photo_file_id, created_by, total)
+            VALUES (?, ?, ?, (SELECT COUNT(*) FROM users WHERE bot_blocked = 0))
+            """,
+            (text, photo_file_id, created_by),
+        )
+        await db.commit()
+        return int(cur.lastrowid)
+
+
+async def get_broadcast(broadcast_id: int) -> aiosqlite.Row | None:
+    return await _fetch_one("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+
+
+async def get_next_broadcast() -> aiosqlite.Row | None:
+    return await _fetch_one(
+        "SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1"
+    )
+
+
+async def list_broadcasts(limit: int = 5) -> list[aiosqlite.Row]:
+    return await _fetch_all(
+        "SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?",
+        (limit,),
+    )
+
+
+async def count_reachable_users() -> int:
+    row = await _fetch_one("SELECT COUNT(*) AS c FROM users WHERE bot_blocked = 0")
+    return int(row["c"])
+
+
+async def get_broadcast_recipients(after_user_id: int, limit: int) -> list[int]:
+    rows = await _fetch_all(
+        """
+        SELECT tg_id
+        FROM users
+        WHERE tg_id > ? AND bot_blocked = 0
+        ORDER BY tg_id
+        LIMIT ?
+        """,
+        (after_user_id, limit),
     )
-    orders_rejected = await _fetch_one(
-        "SELECT COUNT(*) as c FROM orders WHERE status = 'rejected'"
+    return [int(row["tg_id"]) for row in rows]
+
+
+async def checkpoint_broadcast(
+    broadcast_id: int,
+    last_user_id: int,
+    delivered: int,
+    failed: int,
+    blocked_ids: list[int],
+) -> None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute(
+            """
+            UPDATE broadcasts
+            SET last_user_id = ?,
+                delivered = delivered + ?,
+                blocked = blocked + ?,
+                failed = failed + ?
+            WHERE id = ?
+            """,
+            (last_user_id, delivered, len(blocked_ids), failed, broadcast_id),
+        )
+        if blocked_ids:
+            await db.executemany(
+                "UPDATE users SET bot_blocked = 1 WHERE tg_id = ?",
+                [(user_id,) for user_id in blocked_ids],
+            )
+        await db.commit()
+
+
+async def finish_broadcast(broadcast_id: int, status: str = "done") -> bool:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        cur = await db.execute(
+            """
+            UPDATE broadcasts
+            SET status = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+            """,
+            (status, broadcast_id),
+        )
+        await db.commit()
+        return cur.rowcount > 0
+
+
+async def get_fsm_record(key: str) -> aiosqlite.Row | None:
+    return await _fetch_one(
+        "SELECT state, data, updated_at FROM fsm_states WHERE key = ?",
+        (key,),
     )
+
+
+async def save_fsm_records(
+    upserts: list[tuple[str, str | None, str, float]], deletes: list[str]
+) -> None:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        if upserts:
+            await db.executemany(
+                """
+                INSERT INTO fsm_states (key, state, data, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state,
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+        if deletes:
+            await db.executemany(
+                "DELETE FROM fsm_states WHERE key = ?",
+                [(key,) for key in deletes],
+            )
+        await db.commit()
+
+
+# FROM/WHERE part only, so a read-only check can plan the same lookup.
+EXPIRED_FSM_SQL = "FROM fsm_states WHERE updated_at < :before"
+
+
+async def delete_expired_fsm_records(before: float) -> int:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        cur = await db.execute(f"DELETE {EXPIRED_FSM_SQL}", {"before": before})
+        await db.commit()
+        return int(cur.rowcount)
+
+
+ORDERS_BY_STATUS_SQL = "SELECT COUNT(*) as c FROM orders WHERE status = :status"
+
+
+async def get_stats() -> dict[str, int]:
+    orders_total = await _fetch_one("SELECT COUNT(*) as c FROM orders")
+    orders_paid = await _fetch_one(ORDERS_BY_STATUS_SQL, {"status": "paid"})
+    orders_pending = await _fetch_one(ORDERS_BY_STATUS_SQL, {"status": "pending_review"})
+    orders_rejected = await _fetch_one(ORDERS_BY_STATUS_SQL, {"status": "rejected"})
     payments_pending = await _fetch_one(
         "SELECT COUNT(*) as c FROM payments WHERE status = 'pending'"
     )
@@ -943,6 +1604,76 @@ async def get_stats() -> dict[str, int]:
     }
 
 
+# Label and GROUP BY expressions of sales_daily per report dimension.
+SALES_DIMENSIONS = {
+    "city": ("COALESCE(c.name, '#' || s.city_id)", "s.city_id"),
+    "area": (
+        "COALESCE(c.name, '#' || s.city_id) || ' / ' || COALESCE(a.name, '#' || s.area_id)",
+        "s.area_id",
+    ),
+    "variant": ("s.variant", "s.variant"),
+    "class": ("s.variant || ' / ' || s.class", "s.variant, s.class"),
+}
+
+
+# Sales report rows (:since, :city_id, :limit); orders only per city, NULL otherwise.
+def sales_report_sql(by: str, city_id: int = 0) -> str:
+    label, group_by = SALES_DIMENSIONS[by]
+    where = "s.day >= :since" + (" AND s.city_id = :city_id" if city_id else "")
+    orders = "NULL"
+    if by == "city":
+        orders = (
+            "(SELECT COALESCE(SUM(o.orders), 0) FROM sales_daily_orders o"
+            " WHERE o.city_id = s.city_id AND o.day >= :since)"
+        )
+    return f"""
+        SELECT {label} AS label, MIN(s.city_id) AS city_id, {orders} AS orders,
+               SUM(s.items) AS items, SUM(s.revenue) AS revenue
+        FROM sales_daily s
+        LEFT JOIN cities c ON c.id = s.city_id
+        LEFT JOIN areas a ON a.id = s.area_id
+        WHERE {where}
+        GROUP BY {group_by}
+        ORDER BY revenue DESC
+        LIMIT :limit
+    """
+
+
+async def get_sales_report(
+    since: str, by: str, city_id: int = 0, limit: int = 30
+) -> tuple[list[aiosqlite.Row], aiosqlite.Row]:
+    params = {"since": since, "city_id": city_id, "limit": limit}
+    rows = await _fetch_all(sales_report_sql(by, city_id), params)
+    where = "s.day >= :since" + (" AND s.city_id = :city_id" if city_id else "")
+    totals = await _fetch_one(
+        f"""
+        SELECT (SELECT COALESCE(SUM(orders), 0) FROM sales_daily_orders
+                WHERE day >= :since AND city_id = :city_id) AS orders,
+               COALESCE(SUM(s.items), 0) AS items, COALESCE(SUM(s.revenue), 0) AS revenue
+        FROM sales_daily s
+        WHERE {where}
+        """,
+        params,
+    )
+    return rows, totals
+
+
+async def rebuild_sales_daily() -> int:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        count = await _rebuild_sales_daily(db)
+        await db.commit()
+        return count
+
+
+async def rebuild_purchase_summaries() -> int:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        count = await _rebuild_purchase_summaries(db)
+        await db.commit()
+        return count
+
+
 async def get_order_items(order_id: int) -> list[aiosqlite.Row]:
     return await _fetch_all(
         """
@@ -1046,17 +1777,61 @@ async def get_user_by_admin_reply(
     return int(row["user_tg_id"])
 
 
-async def get_user_purchase_history(user_id: int) -> list[aiosqlite.Row]:
-    return await _fetch_all(
-        """
+# {where} is empty or a keyset condition on :anchor_id; {order} is "" or "DESC".
+PAID_ORDER_IDS_PAGE_SQL = """
+    SELECT id FROM orders
+    WHERE user_id = :user_id AND status = 'paid' {where}
+    ORDER BY id {order}
+    LIMIT :limit
+"""
+
+
+async def get_user_purchase_history(
+    user_id: int, after_id: int = 0, before_id: int = 0, limit: int = 10
+) -> tuple[list[aiosqlite.Row], bool, bool]:
+    # Newest first; "prev" pages are newer orders, "next" pages older ones.
+    params = {"user_id": user_id, "anchor_id": after_id or before_id, "limit": limit + 1}
+    if after_id:
+        orders = await _fetch_all(
+            PAID_ORDER_IDS_PAGE_SQL.format(where="AND id > :anchor_id", order=""),
+            params,
+        )
+        has_prev = len(orders) > limit
+        orders = list(reversed(orders[:limit]))
+        has_next = True
+    else:
+        where = "AND id < :anchor_id" if before_id else ""
+        orders = await _fetch_all(
+            PAID_ORDER_IDS_PAGE_SQL.format(where=where, order="DESC"), params
+        )
+        has_next = len(orders) > limit
+        orders = orders[:limit]
+        has_prev = bool(before_id)
+    if not orders:
+        return [], has_prev, has_next
+    order_ids = tuple(int(row["id"]) for row in orders)
+    rows = await _fetch_all(
+        f"""
         SELECT o.id as order_id, o.total, o.created_at, o.status,
                p.title, oi.quantity, oi.price
         FROM orders o
         JOIN order_items oi ON oi.order_id = o.id
         JOIN products p ON p.id = oi.product_id
-        WHERE o.user_id = ? AND o.status = 'paid'
+        WHERE o.id IN ({", ".join("?" * len(order_ids))})
         ORDER BY o.id DESC, oi.id ASC
         """,
+        order_ids,
+    )
+    return rows, has_prev, has_next
+
+
+async def get_user_purchase_summary(user_id: int) -> aiosqlite.Row | None:
+    return await _fetch_one(
+        """
+        SELECT purchases_count AS orders_count, total_spent, last_paid_at
+        FROM users
+        WHERE tg_id = ?
+        """,
         (user_id,),
     )
 
@@ -1091,23 +1866,39 @@ async def set_setting(key: str, value: str) -> None:
     )
 
 
+async def bump_catalog_version() -> str:
+    async with aiosqlite.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT) as db:
+        await db.execute(
+            """
+            INSERT INTO settings (key, value) VALUES ('catalog_version', '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+            """
+        )
+        cur = await db.execute("SELECT value FROM settings WHERE key = 'catalog_version'")
+        row = await cur.fetchone()
+        await cur.close()
+        await db.commit()
+        return str(row[0])
+
+
+PAYMENTS_REPORT_SQL = """
+    SELECT p.id as payment_id,
+           p.order_id,
+           p.user_id,
+           p.total,
+           p.status as payment_status,
+           p.created_at as payment_created_at,
+           p.processed_at as payment_processed_at,
+           o.status as order_status,
+           o.created_at as order_created_at,
+           u.username,
+           u.first_name
+    FROM payments p
+    LEFT JOIN orders o ON o.id = p.order_id
+    LEFT JOIN users u ON u.tg_id = p.user_id
+    ORDER BY p.id DESC
+"""
+
+
 async def get_payments_report() -> list[aiosqlite.Row]:
-    return await _fetch_all(
-        """
-        SELECT p.id as payment_id,
-               p.order_id,
-               p.user_id,
-               p.total,
-               p.status as payment_status,
-               p.created_at as payment_created_at,
-               p.processed_at as payment_processed_at,
-               o.status as order_status,
-               o.created_at as order_created_at,
-               u.username,
-               u.first_name
-        FROM payments p
-        LEFT JOIN orders o ON o.id = p.order_id
-        LEFT JOIN users u ON u.tg_id = p.user_id
-        ORDER BY p.id DESC
-        """
-    )
+    return await _fetch_all(PAYMENTS_REPORT_SQL)
@@ -1,26 +1,46 @@
 ﻿from __future__ import annotations
 
 from aiogram import F, Router
+import asyncio
 import csv
+import tracemalloc
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaPhoto,
     KeyboardButton,
     Message,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
 )
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from app.config import ADMIN_GROUP_ID, ADMIN_IDS, BTN, LOG_PATH
+from app.config import ADMIN_GROUP_ID, ADMIN_IDS, BTN
 from app.db import database as db
+from app.services.broadcast import broadcast_summary, broadcaster
+from app.services.callbacks import (
+    AdminClassCb,
+    AdminVariantCb,
+    HistoryPageCb,
+    LogsCb,
+    PendingPageCb,
+    SalesCb,
+    catalog_ids,
+)
 from app.services.catalog import delivery_caption, format_price
+from app.services.logs import current_segment, log_excerpt
+from app.services.media import chunk_media, send_album
+from app.services.memory import memory_tracker, rss_bytes, sizes
+from app.services.outbound import Priority, priority
+from app.services.outbox import outbox
+from app.services.profiler import profiler
 
 router = Router()
 
@@ -55,6 +75,86 @@ async def _clear_inline_keyboard(callback: CallbackQuery) -> None:
         pass
 
 
+async def _send_requests_page(
+    message: Message, after_id: int = 0, before_id: int = 0
+) -> None:
+    payments, has_prev, has_next = await db.list_pending_payments_page(
+        after_id=after_id, before_id=before_id
+    )
+    if not payments and (after_id or before_id):
+        payments, has_prev, has_next = await db.list_pending_payments_page()
+    if not payments:
+        await message.answer("Нет заявок на подтверждение.")
+        return
+    total = await db.count_payments("pending")
+    media = []
+    lines = [f"Ожидают подтверждения: {total}"]
+    for payment in payments:
+        media.append(
+            InputMediaPhoto(
+                media=payment["photo_file_id"],
+                caption=(
+                    f"Заявка #{payment['id']}\n"
+                    f"Пользователь: {payment['user_id']}\n"
+                    f"Сумма: {format_price(payment['total'])}\n"
+                    f"Создана: {payment['created_at']}"
+                ),
+            )
+        )
+        lines.append(
+            f"#{payment['id']} | {payment['user_id']} | "
+            f"{format_price(payment['total'])} | {payment['created_at']}"
+        )
+    await send_album(message.bot, message.chat.id, chunk_media(media))
+    await message.answer(
+        "\n".join(lines), reply_markup=pending_page_kb(payments, has_prev, has_next)
+    )
+
+
+async def _mark_request_processed(
+    callback: CallbackQuery, payment_id: int, status: str, details: str = ""
+) -> None:
+    message = callback.message
+    try:
+        if message.photo:
+            await message.edit_caption(
+                (message.caption or "") + f"\n\nСтатус: {status}{details}",
+                reply_markup=None,
+            )
+            return
+        # Page summary: drop only this payment's buttons, keep the rest.
+        handled = {f"pay:confirm:{payment_id}", f"pay:reject:{payment_id}"}
+        rows = [
+            row
+            for row in (message.reply_markup.inline_keyboard if message.reply_markup else [])
+            if not any(button.callback_data in handled for button in row)
+        ]
+        await message.edit_text(
+            (message.text or "") + f"\n#{payment_id}: {status}",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=rows) if rows else None,
+        )
+    except Exception:
+        pass
+
+
+async def _picked_variant(
+    callback: CallbackQuery, callback_data: AdminVariantCb
+) -> str | None:
+    variant = await catalog_ids.variant(callback_data.id)
+    if variant is None:
+        await callback.answer("Вариант не найден", show_alert=True)
+    return variant
+
+
+async def _picked_class(
+    callback: CallbackQuery, callback_data: AdminClassCb
+) -> tuple[str, str] | None:
+    found = await catalog_ids.class_(callback_data.id)
+    if found is None:
+        await callback.answer("Классификация не найдена", show_alert=True)
+    return found
+
+
 async def _finalize_step_message(callback: CallbackQuery, text: str) -> None:
     try:
         await callback.message.edit_text(text, reply_markup=None)
@@ -179,6 +279,8 @@ class AdminStates(StatesGroup):
     product_owner_id = State()
     delete_product_id = State()
     payment_details_text = State()
+    broadcast_message = State()
+    broadcast_confirm = State()
 
 
 def _get_user_id(message_or_callback) -> int | None:
@@ -242,6 +344,12 @@ def admin_main_menu_kb() -> InlineKeyboardMarkup:
                     callback_data="admin:section:reports",
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    text=BTN.ADMIN_BROADCAST,
+                    callback_data="admin:section:broadcast",
+                )
+            ],
         ]
     )
 
@@ -434,7 +542,10 @@ def admin_reports_menu_kb() -> InlineKeyboardMarkup:
                 InlineKeyboardButton(
                     text=BTN.ADMIN_PAYMENT_DETAILS,
                     callback_data="admin:menu:payment_details",
-                )
+                ),
+                InlineKeyboardButton(
+                    text=BTN.ADMIN_OUTBOX, callback_data="admin:menu:outbox"
+                ),
             ],
             [
                 InlineKeyboardButton(
@@ -445,6 +556,100 @@ def admin_reports_menu_kb() -> InlineKeyboardMarkup:
     )
 
 
+def logs_menu_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Последние 200 записей", callback_data=LogsCb(limit=200))
+    builder.button(text="Последние 1000 записей", callback_data=LogsCb(limit=1000))
+    builder.button(text="Ошибки", callback_data=LogsCb(limit=500, level="ERROR"))
+    builder.button(
+        text="Предупреждения и ошибки", callback_data=LogsCb(limit=500, level="WARNING")
+    )
+    builder.button(
+        text="За последний час", callback_data=LogsCb(limit=10000, minutes=60)
+    )
+    builder.button(text="Текущий файл целиком", callback_data="admin:logs:file")
+    builder.button(text=BTN.BACK, callback_data="admin:section:reports")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def outbox_retry_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="Повторить отправку", callback_data="admin:outbox:retry"
+                )
+            ]
+        ]
+    )
+
+
+def pending_page_kb(
+    payments: list, has_prev: bool, has_next: bool
+) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for payment in payments:
+        builder.row(
+            InlineKeyboardButton(
+                text=f"{BTN.CONFIRM} #{payment['id']}",
+                callback_data=f"pay:confirm:{payment['id']}",
+            ),
+            InlineKeyboardButton(
+                text=f"{BTN.REJECT} #{payment['id']}",
+                callback_data=f"pay:reject:{payment['id']}",
+            ),
+        )
+    nav = []
+    if has_prev:
+        nav.append(
+            InlineKeyboardButton(
+                text="« Назад",
+                callback_data=PendingPageCb(before=int(payments[0]["id"])).pack(),
+            )
+        )
+    if has_next:
+        nav.append(
+            InlineKeyboardButton(
+                text="Дальше »",
+                callback_data=PendingPageCb(after=int(payments[-1]["id"])).pack(),
+            )
+        )
+    if nav:
+        builder.row(*nav)
+    return builder.as_markup()
+
+
+def broadcast_menu_kb(broadcasts: list) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Новая рассылка", callback_data="admin:broadcast:new")
+    for row in broadcasts:
+        if row["status"] == "running":
+            builder.button(
+                text=f"Остановить #{row['id']}",
+                callback_data=f"admin:broadcast:stop:{row['id']}",
+            )
+    builder.button(text=BTN.BACK, callback_data="admin:menu:main")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def broadcast_confirm_kb(total: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=f"Отправить всем ({total})",
+                    callback_data="admin:broadcast:send",
+                ),
+                InlineKeyboardButton(
+                    text="Отмена", callback_data="admin:broadcast:cancel"
+                ),
+            ]
+        ]
+    )
+
+
 def admin_panel_inline_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -474,39 +679,29 @@ def areas_pick_kb(
 
 
 def variants_pick_kb(variants: list[dict]) -> InlineKeyboardMarkup:
+    catalog_ids.remember_variants(variants)
     builder = InlineKeyboardBuilder()
     for variant in variants:
-        name = variant["name"]
-        builder.button(text=f"Категория: {name}", callback_data=f"admin:variant:{name}")
+        builder.button(
+            text=f"Категория: {variant['name']}",
+            callback_data=AdminVariantCb(id=int(variant["id"])),
+        )
     builder.adjust(2)
     return builder.as_markup()
 
 
 def classes_pick_kb(variant: str, classes: list[dict]) -> InlineKeyboardMarkup:
+    catalog_ids.remember_classes(variant, classes)
     builder = InlineKeyboardBuilder()
     for class_row in classes:
-        class_name = class_row["name"]
         builder.button(
-            text=class_name, callback_data=f"admin:class:{variant}:{class_name}"
+            text=class_row["name"],
+            callback_data=AdminClassCb(id=int(class_row["id"])),
         )
     builder.adjust(2)
     return builder.as_markup()
 
 
-def request_actions_kb(payment_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text=BTN.CONFIRM, callback_data=f"pay:confirm:{payment_id}"
-                ),
-                InlineKeyboardButton(
-                    text=BTN.REJECT, callback_data=f"pay:reject:{payment_id}"
-                ),
-            ]
-        ]
-    )
-
 def products_hide_kb(products: list[dict]) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for product in products:
@@ -562,6 +757,31 @@ def user_history_pick_kb(users: list[dict]) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def user_history_page_kb(
+    user_id: int, rows: list, has_prev: bool, has_next: bool
+) -> InlineKeyboardMarkup | None:
+    nav = []
+    if has_prev:
+        nav.append(
+            InlineKeyboardButton(
+                text="« Новее",
+                callback_data=HistoryPageCb(
+                    user=user_id, after=int(rows[0]["order_id"])
+                ).pack(),
+            )
+        )
+    if has_next:
+        nav.append(
+            InlineKeyboardButton(
+                text="Старше »",
+                callback_data=HistoryPageCb(
+                    user=user_id, before=int(rows[-1]["order_id"])
+                ).pack(),
+            )
+        )
+    return InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+
+
 @router.message(Command("admin"))
 async def admin_entry(message: Message) -> None:
     if not await is_admin(message):
@@ -988,47 +1208,365 @@ async def admin_menu_product_delete(callback: CallbackQuery, state: FSMContext)
     await callback.answer()
 
 
+async def _send_log_segment(message: Message) -> None:
+    path = current_segment()
+    if path is None:
+        await message.answer("Логи недоступны или файл пуст.")
+        return
+    try:
+        await message.bot.send_document(
+            message.chat.id,
+            document=FSInputFile(str(path)),
+            caption=f"Логи бота: {path.name}",
+        )
+    except Exception:
+        await message.answer("Логи недоступны или файл пуст.")
+
+
+LOGS_USAGE = (
+    "Логи: выберите вариант ниже или отправьте команду\n"
+    "/logs [N] [ERROR|WARNING|INFO] [logger=app.handlers] [since=30m|2h]\n"
+    "Например: /logs 500 ERROR since=2h"
+)
+
+
+def _logs_caption(
+    limit: int, level: str | None, logger: str | None, minutes: int
+) -> str:
+    parts = [f"до {limit} записей"]
+    if level:
+        parts.append(f"уровень {level}+")
+    if logger:
+        parts.append(f"logger {logger}*")
+    if minutes:
+        parts.append(f"за {minutes} мин")
+    return "Логи бота: " + ", ".join(parts)
+
+
+async def _send_log_excerpt(
+    message: Message,
+    limit: int,
+    level: str | None = None,
+    logger: str | None = None,
+    minutes: int = 0,
+) -> None:
+    since = datetime.now() - timedelta(minutes=minutes) if minutes else None
+    count, payload = await log_excerpt(limit, level, logger, since)
+    if not count:
+        await message.answer("В логах ничего не найдено.")
+        return
+    await message.bot.send_document(
+        message.chat.id,
+        document=BufferedInputFile(
+            payload, filename=f"bot-log-{datetime.now():%Y%m%d-%H%M}.txt.gz"
+        ),
+        caption=_logs_caption(limit, level, logger, minutes),
+    )
+
+
+def _parse_logs_args(args: str) -> tuple[int, str | None, str | None, int] | None:
+    limit, level, logger, minutes = 200, None, None, 0
+    for token in args.split():
+        lowered = token.lower()
+        if token.isdigit():
+            limit = max(1, min(int(token), 100000))
+        elif token.upper() in {"DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"}:
+            level = token.upper()
+        elif lowered.startswith("logger="):
+            logger = token.split("=", 1)[1] or None
+        else:
+            value = lowered.removeprefix("since=")
+            if len(value) < 2 or not value[:-1].isdigit() or value[-1] not in "mh":
+                return None
+            minutes = int(value[:-1]) * (60 if value[-1] == "h" else 1)
+    return limit, level, logger, minutes
+
+
 @router.callback_query(F.data == "admin:menu:logs")
 async def admin_menu_logs(callback: CallbackQuery) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
     await _clear_inline_keyboard(callback)
-    try:
-        await callback.bot.send_document(
-            callback.message.chat.id,
-            document=FSInputFile(str(LOG_PATH)),
-            caption="Логи бота",
-        )
-    except Exception:
-        await callback.message.answer("Логи недоступны или файл пуст.")
+    await callback.message.answer(LOGS_USAGE, reply_markup=logs_menu_kb())
+    await callback.answer()
+
+
+@router.callback_query(LogsCb.filter())
+async def admin_logs_excerpt(callback: CallbackQuery, callback_data: LogsCb) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await callback.answer("Собираю логи...")
+    await _send_log_excerpt(
+        callback.message,
+        callback_data.limit,
+        callback_data.level or None,
+        minutes=callback_data.minutes,
+    )
+
+
+@router.callback_query(F.data == "admin:logs:file")
+async def admin_logs_file(callback: CallbackQuery) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await _send_log_segment(callback.message)
     await callback.answer()
 
 
+@router.message(Command("logs"))
+async def admin_logs_command(message: Message, command: CommandObject) -> None:
+    if not await is_admin(message):
+        await message.answer("Доступ запрещен.")
+        return
+    parsed = _parse_logs_args(command.args or "")
+    if parsed is None:
+        await message.answer(LOGS_USAGE, reply_markup=logs_menu_kb())
+        return
+    await _send_log_excerpt(message, *parsed)
+
+
+PROFILE_MAX_SECONDS = 120
+_profile_tasks: set[asyncio.Task] = set()
+
+
+async def _run_profile(message: Message, seconds: int) -> None:
+    result = await profiler.profile(seconds)
+    busy = result.samples - result.idle
+    lines = [
+        f"Профиль за {result.seconds:.0f} с: {result.samples} выборок, "
+        f"занят {busy * 100 // max(1, result.samples)}% времени.",
+    ]
+    if busy:
+        lines.append("Наш код:")
+        lines.extend(
+            f"• {label} — {count * 100 // busy}%"
+            for label, count in result.top_app_frames(5)
+        )
+        lines.append("Самые горячие функции:")
+        lines.extend(
+            f"• {label} — {count * 100 // busy}%"
+            for label, count in result.top_functions(5)
+        )
+    await message.answer("\n".join(lines))
+    await message.bot.send_document(
+        message.chat.id,
+        document=BufferedInputFile(
+            result.collapsed(),
+            filename=f"profile-{datetime.now():%Y%m%d-%H%M%S}.collapsed.txt",
+        ),
+        caption="Стеки для flamegraph.pl или speedscope.app",
+    )
+
+
+@router.message(Command("profile"))
+async def admin_profile(message: Message, command: CommandObject) -> None:
+    if not await is_admin(message):
+        await message.answer("Доступ запрещен.")
+        return
+    args = (command.args or "").strip()
+    if args and not args.isdigit():
+        await message.answer(f"Использование: /profile [секунд, до {PROFILE_MAX_SECONDS}]")
+        return
+    if profiler.running:
+        await message.answer("Профилирование уже идёт.")
+        return
+    seconds = max(1, min(int(args or 10), PROFILE_MAX_SECONDS))
+    await message.answer(f"Снимаю профиль {seconds} с...")
+    # runs in the background so this admin's other updates are not held up
+    task = asyncio.create_task(_run_profile(message, seconds))
+    _profile_tasks.add(task)
+    task.add_done_callback(_profile_tasks.discard)
+
+
+MEM_USAGE = (
+    "/mem — память процесса, размеры кэшей и рост с момента замера\n"
+    "/mem start — включить tracemalloc и запомнить точку отсчёта\n"
+    "/mem reset — новая точка отсчёта\n"
+    "/mem stop — выключить tracemalloc"
+)
+
+
+def _kib(size: int) -> str:
+    return f"{size / 1024:,.1f} KiB".replace(",", " ")
+
+
+async def _memory_report() -> str:
+    rss = rss_bytes()
+    lines = [f"RSS: {_kib(rss) if rss is not None else 'н/д'}"]
+    if memory_tracker.tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"tracemalloc: сейчас {_kib(current)}, пик {_kib(peak)}")
+    lines.append("")
+    lines.append("Кэши и очереди (записей):")
+    lines.extend(f"• {name}: {value}" for name, value in sizes().items())
+    if not memory_tracker.tracing:
+        lines.append("")
+        lines.append("tracemalloc выключен, рост по строкам кода: /mem start")
+        return "\n".join(lines)
+    growth = await memory_tracker.top_growth()
+    lines.append("")
+    lines.append("Рост с точки отсчёта:")
+    if not growth:
+        lines.append("нет")
+    lines.extend(
+        f"• +{_kib(size)} ({count:+d}) {place}" for place, size, count in growth
+    )
+    return "\n".join(lines)
+
+
+@router.message(Command("mem"))
+async def admin_memory(message: Message, command: CommandObject) -> None:
+    if not await is_admin(message):
+        await message.answer("Доступ запрещен.")
+        return
+    action = (command.args or "").strip().lower()
+    if action == "start":
+        # take the baseline off the loop: it walks every live allocation
+        await asyncio.to_thread(memory_tracker.start, 1)
+        await message.answer("tracemalloc включен, точка отсчёта сохранена.")
+    elif action == "reset":
+        if not memory_tracker.tracing:
+            await message.answer("tracemalloc выключен: /mem start")
+            return
+        await asyncio.to_thread(memory_tracker.rebase)
+        await message.answer("Новая точка отсчёта сохранена.")
+    elif action == "stop":
+        memory_tracker.stop()
+        await message.answer("tracemalloc выключен.")
+    elif action:
+        await message.answer(MEM_USAGE)
+    else:
+        await message.answer(await _memory_report())
+
+
+SALES_PERIODS = {1: "Сегодня", 7: "7 дней", 30: "30 дней", 0: "Всё время"}
+SALES_BY = {
+    "city": "Города",
+    "area": "Местности",
+    "variant": "Варианты",
+    "class": "Классификации",
+}
+# longer periods go past what date() can hold; "all" covers them anyway
+SALES_MAX_DAYS = 3650
+SALES_USAGE = (
+    f"/sales [1..{SALES_MAX_DAYS}|all] [city|area|variant|class] — продажи за период\n"
+    "/sales rebuild — пересчитать сводку по оплаченным заказам"
+)
+
+
+def _parse_sales_args(args: str) -> tuple[int, str] | None:
+    days, by = 7, "city"
+    for token in args.split():
+        if token == "all":
+            days = 0
+        elif token.isdigit():
+            days = int(token)
+            if not 1 <= days <= SALES_MAX_DAYS:
+                return None
+        elif token in SALES_BY:
+            by = token
+        else:
+            return None
+    return days, by
+
+
+def sales_report_kb(days: int, by: str, city: int, rows: list) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        *(
+            InlineKeyboardButton(
+                text=f"• {title}" if period == days else title,
+                callback_data=SalesCb(days=period, by=by, city=city).pack(),
+            )
+            for period, title in SALES_PERIODS.items()
+        )
+    )
+    builder.row(
+        *(
+            InlineKeyboardButton(
+                text=f"• {title}" if dimension == by else title,
+                callback_data=SalesCb(days=days, by=dimension, city=city).pack(),
+            )
+            for dimension, title in SALES_BY.items()
+        )
+    )
+    if by == "city" and not city:
+        for row in rows[:5]:
+            builder.row(
+                InlineKeyboardButton(
+                    text=f"{row['label']} »",
+                    callback_data=SalesCb(
+                        days=days, by="area", city=int(row["city_id"])
+                    ).pack(),
+                )
+            )
+    if city:
+        builder.row(
+            InlineKeyboardButton(
+                text="Все города", callback_data=SalesCb(days=days, by=by).pack()
+            )
+        )
+    return builder.as_markup()
+
+
+async def _sales_report(
+    days: int, by: str, city: int = 0
+) -> tuple[str, InlineKeyboardMarkup]:
+    # sales_daily days are UTC dates, like orders.created_at
+    today = datetime.now(timezone.utc).date()
+    days = min(max(days, 0), SALES_MAX_DAYS)
+    since = (today - timedelta(days=days - 1)).isoformat() if days > 0 else ""
+    rows, totals = await db.get_sales_report(since, by, city)
+    period = SALES_PERIODS.get(days, f"{days} дн.")
+    header = f"Продажи: {period.lower()}, {SALES_BY[by].lower()}"
+    if city:
+        found = await db.get_city(city)
+        header += f", город {found['name'] if found else city}"
+    lines = [header]
+    if not rows:
+        lines.append("Продаж нет.")
+    for row in rows:
+        # Order counts are only exact per city: one order can span areas and variants.
+        orders = f"{row['orders']} зак., " if row["orders"] is not None else ""
+        lines.append(
+            f"• {row['label']}: {orders}{row['items']} шт., "
+            f"{format_price(int(row['revenue']))}"
+        )
+    lines.append(
+        f"Итого: {totals['orders']} зак., {totals['items']} шт., "
+        f"{format_price(int(totals['revenue']))}"
+    )
+    return "\n".join(lines), sales_report_kb(days, by, city, rows)
+
+
+async def _send_sales_report(message: Message, days: int = 7, by: str = "city") -> None:
+    text, markup = await _sales_report(days, by)
+    await message.answer(text, reply_markup=markup)
+
+
 @router.callback_query(F.data == "admin:menu:requests")
 async def admin_menu_requests(callback: CallbackQuery) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    payments = await db.list_pending_payments()
-    if not payments:
-        await callback.message.answer("Нет заявок на подтверждение.")
-        await callback.answer()
+    await _clear_inline_keyboard(callback)
+    await _send_requests_page(callback.message)
+    await callback.answer()
+
+
+@router.callback_query(PendingPageCb.filter())
+async def admin_requests_page(
+    callback: CallbackQuery, callback_data: PendingPageCb
+) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
         return
     await _clear_inline_keyboard(callback)
-    await callback.message.answer(f"Ожидают подтверждения: {len(payments)}")
-    for payment in payments:
-        text = (
-            f"Заявка #{payment['id']}\n"
-            f"Пользователь: {payment['user_id']}\n"
-            f"Сумма: {format_price(payment['total'])}\n"
-            f"Создана: {payment['created_at']}"
-        )
-        await callback.message.answer_photo(
-            payment["photo_file_id"],
-            caption=text,
-            reply_markup=request_actions_kb(int(payment["id"])),
-        )
+    await _send_requests_page(
+        callback.message, after_id=callback_data.after, before_id=callback_data.before
+    )
     await callback.answer()
 
 
@@ -1048,6 +1586,77 @@ async def admin_menu_stats(callback: CallbackQuery) -> None:
         f"Заявок в ожидании: {stats['payments_pending']}"
     )
     await callback.message.answer(text)
+    await _send_sales_report(callback.message)
+    await callback.answer()
+
+
+@router.callback_query(SalesCb.filter())
+async def admin_sales_report(callback: CallbackQuery, callback_data: SalesCb) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    if callback_data.by not in db.SALES_DIMENSIONS:
+        await callback.answer()
+        return
+    text, markup = await _sales_report(
+        callback_data.days, callback_data.by, callback_data.city
+    )
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except Exception:
+        pass
+    await callback.answer()
+
+
+@router.message(Command("sales"))
+async def admin_sales_command(message: Message, command: CommandObject) -> None:
+    if not await is_admin(message):
+        await message.answer("Доступ запрещен.")
+        return
+    args = (command.args or "").strip().lower()
+    if args == "rebuild":
+        await message.answer("Пересчитываю продажи...")
+        count = await db.rebuild_sales_daily()
+        await message.answer(f"Сводка продаж пересчитана, строк: {count}.")
+        return
+    parsed = _parse_sales_args(args)
+    if parsed is None:
+        await message.answer(SALES_USAGE)
+        return
+    await _send_sales_report(message, *parsed)
+
+
+@router.callback_query(F.data == "admin:menu:outbox")
+async def admin_menu_outbox(callback: CallbackQuery) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await _clear_inline_keyboard(callback)
+    rows = await db.list_stuck_outbox()
+    if not rows:
+        await callback.message.answer("Зависших выдач нет.")
+        await callback.answer()
+        return
+    lines = ["Зависшие выдачи:"]
+    for row in rows:
+        error = (row["last_error"] or "-")[:80]
+        lines.append(
+            f"#{row['id']} {row['idempotency_key']} -> {row['chat_id']} | "
+            f"{row['status']} | попыток: {row['attempts']} | {error}"
+        )
+    await callback.message.answer("\n".join(lines), reply_markup=outbox_retry_kb())
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin:outbox:retry")
+async def admin_outbox_retry(callback: CallbackQuery) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    count = await db.retry_failed_outbox()
+    outbox.notify()
+    await _clear_inline_keyboard(callback)
+    await callback.message.answer(f"Повторная отправка запланирована: {count}")
     await callback.answer()
 
 
@@ -1065,17 +1674,7 @@ async def admin_menu_payment_details(callback: CallbackQuery, state: FSMContext)
     await callback.answer()
 
 
-@router.callback_query(F.data == "admin:menu:reports")
-async def admin_menu_reports(callback: CallbackQuery) -> None:
-    if not await is_admin(callback):
-        await callback.answer("Доступ запрещен", show_alert=True)
-        return
-    rows = await db.get_payments_report()
-    if not rows:
-        await callback.message.answer("Нет данных для отчета.")
-        await callback.answer()
-        return
-    report_path = Path("data") / "payments_report.csv"
+def _write_payments_report(rows: list, report_path: Path) -> None:
     report_path.parent.mkdir(parents=True, exist_ok=True)
     with report_path.open("w", encoding="utf-8", newline="") as f:
         writer = csv.writer(f)
@@ -1110,14 +1709,32 @@ async def admin_menu_reports(callback: CallbackQuery) -> None:
                     row["order_created_at"],
                 ]
             )
+
+
+async def _send_payments_report(message: Message) -> None:
+    rows = await db.get_payments_report()
+    if not rows:
+        await message.answer("Нет данных для отчета.")
+        return
+    report_path = Path("data") / "payments_report.csv"
+    # csv writing is blocking file I/O, keep it off the event loop
+    await asyncio.to_thread(_write_payments_report, rows, report_path)
     try:
-        await callback.bot.send_document(
-            callback.message.chat.id,
+        await message.bot.send_document(
+            message.chat.id,
             document=FSInputFile(str(report_path)),
             caption="Отчет по оплатам (CSV)",
         )
     except Exception:
-        await callback.message.answer("Не удалось отправить отчет.")
+        await message.answer("Не удалось отправить отчет.")
+
+
+@router.callback_query(F.data == "admin:menu:reports")
+async def admin_menu_reports(callback: CallbackQuery) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await _send_payments_report(callback.message)
     await callback.answer()
 
 
@@ -1371,14 +1988,7 @@ async def admin_send_logs(message: Message) -> None:
     if not await is_admin(message):
         await message.answer("Доступ запрещен.")
         return
-    try:
-        await message.bot.send_document(
-            message.chat.id,
-            document=FSInputFile(str(LOG_PATH)),
-            caption="Логи бота",
-        )
-    except Exception:
-        await message.answer("Логи недоступны или файл пуст.")
+    await message.answer(LOGS_USAGE, reply_markup=logs_menu_kb())
 
 
 @router.message(F.text == BTN.ADMIN_PRODUCT_OWNER)
@@ -1453,50 +2063,95 @@ async def admin_user_history_pick(callback: CallbackQuery, state: FSMContext) ->
         await callback.answer("Доступ запрещен", show_alert=True)
         return
     user_id = int(callback.data.split(":", 2)[2])
-    rows = await db.get_user_purchase_history(user_id)
+    page = await _user_history_page(user_id)
     await _clear_inline_keyboard(callback)
-    if not rows:
+    if page is None:
         await callback.message.answer("Покупок не найдено.")
-        await state.clear()
-        await callback.answer()
-        return
-    lines = []
-    current_order = None
-    for row in rows:
-        order_id = int(row["order_id"])
-        if current_order != order_id:
-            lines.append(
-                f"\nЗаказ #{order_id} от {row['created_at']} (сумма {format_price(int(row['total']))})"
-            )
-            current_order = order_id
-        lines.append(f"- {row['title']} x{row['quantity']}")
-    await callback.message.answer("История покупок:" + "\n".join(lines))
+    else:
+        await callback.message.answer(page[0], reply_markup=page[1])
     await state.clear()
     await callback.answer()
 
 
+@router.callback_query(HistoryPageCb.filter())
+async def admin_user_history_page(
+    callback: CallbackQuery, callback_data: HistoryPageCb
+) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    page = await _user_history_page(
+        callback_data.user, after_id=callback_data.after, before_id=callback_data.before
+    )
+    if page is None:
+        await callback.answer("Покупок не найдено.", show_alert=True)
+        return
+    try:
+        await callback.message.edit_text(page[0], reply_markup=page[1])
+    except Exception:
+        pass
+    await callback.answer()
+
+
+HISTORY_ITEMS_PER_ORDER = 10
+MESSAGE_LIMIT = 4096
+
+
+async def _user_history_page(
+    user_id: int, after_id: int = 0, before_id: int = 0
+) -> tuple[str, InlineKeyboardMarkup | None] | None:
+    rows, has_prev, has_next = await db.get_user_purchase_history(
+        user_id, after_id=after_id, before_id=before_id
+    )
+    if not rows and (after_id or before_id):
+        rows, has_prev, has_next = await db.get_user_purchase_history(user_id)
+    if not rows:
+        return None
+    summary = await db.get_user_purchase_summary(user_id)
+    lines = [f"История покупок {user_id}:"]
+    if summary and summary["last_paid_at"]:
+        lines.append(
+            f"Заказов: {summary['orders_count']}, "
+            f"потрачено: {format_price(int(summary['total_spent']))}, "
+            f"последняя покупка: {summary['last_paid_at']}"
+        )
+    orders: dict[int, list] = {}
+    for row in rows:
+        orders.setdefault(int(row["order_id"]), []).append(row)
+    # Whole orders only: the ones that do not fit start the next page.
+    text = "\n".join(lines)
+    shown: list = []
+    for order_id, items in orders.items():
+        first = items[0]
+        block = [
+            f"\nЗаказ #{order_id} от {first['created_at']} "
+            f"(сумма {format_price(int(first['total']))})"
+        ]
+        block += [
+            f"- {row['title']} x{row['quantity']}"
+            for row in items[:HISTORY_ITEMS_PER_ORDER]
+        ]
+        if len(items) > HISTORY_ITEMS_PER_ORDER:
+            block.append("- ...")
+        candidate = text + "\n" + "\n".join(block)
+        if len(candidate) > MESSAGE_LIMIT:
+            if not shown:
+                # a single order with very long titles: cut it, it still has its page
+                text = candidate[: MESSAGE_LIMIT - 4] + "\n..."
+                shown = items
+            has_next = has_next or len(shown) < len(rows)
+            break
+        text = candidate
+        shown += items
+    return text, user_history_page_kb(user_id, shown, has_prev, has_next)
+
+
 @router.message(F.text == BTN.ADMIN_REQUESTS)
 async def admin_show_requests(message: Message) -> None:
     if not await is_admin(message):
         await message.answer("Доступ запрещен.")
         return
-    payments = await db.list_pending_payments()
-    if not payments:
-        await message.answer("Нет заявок на подтверждение.")
-        return
-    await message.answer(f"Ожидают подтверждения: {len(payments)}")
-    for payment in payments:
-        text = (
-            f"Заявка #{payment['id']}\n"
-            f"Пользователь: {payment['user_id']}\n"
-            f"Сумма: {format_price(payment['total'])}\n"
-            f"Создана: {payment['created_at']}"
-        )
-        await message.answer_photo(
-            payment["photo_file_id"],
-            caption=text,
-            reply_markup=request_actions_kb(int(payment["id"])),
-        )
+    await _send_requests_page(message)
 
 
 @router.message(F.text == BTN.ADMIN_STATS)
@@ -1514,6 +2169,7 @@ async def admin_stats(message: Message) -> None:
         f"Заявок в ожидании: {stats['payments_pending']}"
     )
     await message.answer(text)
+    await _send_sales_report(message)
 
 
 @router.message(F.text == BTN.ADMIN_PAYMENT_DETAILS)
@@ -1533,53 +2189,7 @@ async def admin_reports(message: Message) -> None:
     if not await is_admin(message):
         await message.answer("Доступ запрещен.")
         return
-    rows = await db.get_payments_report()
-    if not rows:
-        await message.answer("Нет данных для отчета.")
-        return
-    report_path = Path("data") / "payments_report.csv"
-    report_path.parent.mkdir(parents=True, exist_ok=True)
-    with report_path.open("w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                "payment_id",
-                "order_id",
-                "user_id",
-                "username",
-                "first_name",
-                "total",
-                "payment_status",
-                "order_status",
-                "payment_created_at",
-                "payment_processed_at",
-                "order_created_at",
-            ]
-        )
-        for row in rows:
-            writer.writerow(
-                [
-                    row["payment_id"],
-                    row["order_id"],
-                    row["user_id"],
-                    row["username"] or "",
-                    row["first_name"] or "",
-                    row["total"],
-                    row["payment_status"],
-                    row["order_status"],
-                    row["payment_created_at"],
-                    row["payment_processed_at"] or "",
-                    row["order_created_at"],
-                ]
-            )
-    try:
-        await message.bot.send_document(
-            message.chat.id,
-            document=FSInputFile(str(report_path)),
-            caption="Отчет по оплатам (CSV)",
-        )
-    except Exception:
-        await message.answer("Не удалось отправить отчет.")
+    await _send_payments_report(message)
 
 
 @router.callback_query(AdminStates.add_product_city, F.data.startswith("admin:city:"))
@@ -1737,13 +2347,16 @@ async def admin_add_product_area(callback: CallbackQuery, state: FSMContext) ->
     await callback.answer()
 
 
-@router.callback_query(AdminStates.add_product_variant, F.data.startswith("admin:variant:"))
-async def admin_add_product_variant(callback: CallbackQuery, state: FSMContext) -> None:
+@router.callback_query(AdminStates.add_product_variant, AdminVariantCb.filter())
+async def admin_add_product_variant(
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
+) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-
-    variant = callback.data.split(":", 2)[2]
+    variant = await _picked_variant(callback, callback_data)
+    if variant is None:
+        return
     await state.update_data(variant=variant)
 
     await state.set_state(AdminStates.add_product_class)
@@ -1755,13 +2368,17 @@ async def admin_add_product_variant(callback: CallbackQuery, state: FSMContext)
     await callback.answer()
 
 
-@router.callback_query(AdminStates.add_product_class, F.data.startswith("admin:class:"))
-async def admin_add_product_class(callback: CallbackQuery, state: FSMContext) -> None:
+@router.callback_query(AdminStates.add_product_class, AdminClassCb.filter())
+async def admin_add_product_class(
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminClassCb
+) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-
-    _, _, variant, class_name = callback.data.split(":", 3)
+    found = await _picked_class(callback, callback_data)
+    if found is None:
+        return
+    variant, class_name = found
     await state.update_data(class_name=class_name, variant=variant)
 
     await state.set_state(AdminStates.add_product_photo)
@@ -1770,16 +2387,16 @@ async def admin_add_product_class(callback: CallbackQuery, state: FSMContext) ->
     await callback.answer()
 
 
-@router.callback_query(
-    AdminStates.delete_variant_pick, F.data.startswith("admin:variant:")
-)
+@router.callback_query(AdminStates.delete_variant_pick, AdminVariantCb.filter())
 async def admin_delete_variant_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    variant = callback.data.split(":", 2)[2]
+    variant = await _picked_variant(callback, callback_data)
+    if variant is None:
+        return
     count = await db.count_products_by_variant(variant)
     if count > 0:
         await callback.message.answer(
@@ -1789,6 +2406,7 @@ async def admin_delete_variant_pick(
         await callback.answer()
         return
     await db.delete_variant(variant)
+    await catalog_ids.invalidate()
     await _clear_inline_keyboard(callback)
     await callback.message.answer("Вариант удалён.")
     await state.clear()
@@ -1817,16 +2435,16 @@ async def admin_add_variant_finish(message: Message, state: FSMContext) -> None:
     await state.clear()
 
 
-@router.callback_query(
-    AdminStates.add_class_variant, F.data.startswith("admin:variant:")
-)
+@router.callback_query(AdminStates.add_class_variant, AdminVariantCb.filter())
 async def admin_add_class_variant_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    variant = callback.data.split(":", 2)[2]
+    variant = await _picked_variant(callback, callback_data)
+    if variant is None:
+        return
     await state.update_data(variant=variant)
     await state.set_state(AdminStates.add_class_name)
     await _finalize_step_message(callback, f"Вариант выбран: {variant}")
@@ -1859,16 +2477,16 @@ async def admin_add_class_finish(message: Message, state: FSMContext) -> None:
     await state.clear()
 
 
-@router.callback_query(
-    AdminStates.delete_class_variant, F.data.startswith("admin:variant:")
-)
+@router.callback_query(AdminStates.delete_class_variant, AdminVariantCb.filter())
 async def admin_delete_class_variant_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    variant = callback.data.split(":", 2)[2]
+    variant = await _picked_variant(callback, callback_data)
+    if variant is None:
+        return
     await state.update_data(variant=variant)
     classes = await db.get_classes(variant)
     await state.set_state(AdminStates.delete_class_pick)
@@ -1885,16 +2503,17 @@ async def admin_delete_class_variant_pick(
     await callback.answer()
 
 
-@router.callback_query(
-    AdminStates.delete_class_pick, F.data.startswith("admin:class:")
-)
+@router.callback_query(AdminStates.delete_class_pick, AdminClassCb.filter())
 async def admin_delete_class_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminClassCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    _, _, variant, class_name = callback.data.split(":", 3)
+    found = await _picked_class(callback, callback_data)
+    if found is None:
+        return
+    variant, class_name = found
     count = await db.count_products_by_class(variant, class_name)
     if count > 0:
         await callback.message.answer(
@@ -1904,6 +2523,7 @@ async def admin_delete_class_pick(
         await callback.answer()
         return
     await db.delete_class(variant, class_name)
+    await catalog_ids.invalidate()
     await _clear_inline_keyboard(callback)
     await callback.message.answer("Классификация удалена.")
     await state.clear()
@@ -2037,6 +2657,45 @@ async def admin_add_product_stock(message: Message, state: FSMContext) -> None:
     await state.clear()
 
 
+def _delivery_messages(order_id: int, items: list) -> list[tuple[str, dict]]:
+    review_kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="Оставить отзыв",
+                    callback_data=f"review:{order_id}",
+                ),
+                InlineKeyboardButton(
+                    text="Написать в поддержку",
+                    callback_data="support:after",
+                ),
+            ]
+        ]
+    )
+    messages: list[tuple[str, dict]] = [("message", {"text": "Оплата подтверждена."})]
+    for item in items:
+        messages.append(
+            (
+                "photo",
+                {
+                    "photo": item["photo_file_id"],
+                    "caption": delivery_caption(item, int(item["quantity"])),
+                },
+            )
+        )
+    messages.append(("message", {"text": "ВАШ ДОСТУП: ..."}))
+    messages.append(
+        (
+            "message",
+            {
+                "text": "Хотите оставить отзыв или написать в поддержку?",
+                "reply_markup": review_kb.model_dump(exclude_none=True),
+            },
+        )
+    )
+    return messages
+
+
 @router.callback_query(F.data.startswith("pay:confirm:"))
 async def confirm_payment(callback: CallbackQuery) -> None:
     if not await is_admin(callback):
@@ -2049,41 +2708,15 @@ async def confirm_payment(callback: CallbackQuery) -> None:
         await callback.answer("Заявка уже обработана.", show_alert=True)
         return
 
-    await db.set_payment_status(payment_id, "confirmed")
-    await db.set_order_status(int(payment["order_id"]), "paid")
-    await db.increment_purchases(int(payment["user_id"]))
-
     user_id = int(payment["user_id"])
-    await callback.bot.send_message(user_id, "Оплата подтверждена.")
-
     items = await db.get_order_items(int(payment["order_id"]))
-    for item in items:
-        caption = delivery_caption(item, int(item["quantity"]))
-        await callback.bot.send_photo(
-            user_id,
-            photo=item["photo_file_id"],
-            caption=caption,
-        )
-
-    await callback.bot.send_message(user_id, "ВАШ ДОСТУП: ...")
-    await callback.bot.send_message(
-        user_id,
-        "Хотите оставить отзыв или написать в поддержку?",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="Оставить отзыв",
-                        callback_data=f"review:{int(payment['order_id'])}",
-                    ),
-                    InlineKeyboardButton(
-                        text="Написать в поддержку",
-                        callback_data="support:after",
-                    ),
-                ]
-            ]
-        ),
+    confirmed = await db.confirm_payment(
+        payment_id, _delivery_messages(int(payment["order_id"]), items)
     )
+    if not confirmed:
+        await callback.answer("Заявка уже обработана.", show_alert=True)
+        return
+    outbox.notify()
 
     if ADMIN_GROUP_ID:
         buyer = await db.get_user(user_id)
@@ -2104,15 +2737,12 @@ async def confirm_payment(callback: CallbackQuery) -> None:
             "Товары:\n"
             + "\n".join(items_lines)
         )
-        await callback.bot.send_message(ADMIN_GROUP_ID, sold_text)
+        with priority(Priority.ADMIN):
+            await callback.bot.send_message(ADMIN_GROUP_ID, sold_text)
 
-    try:
-        await callback.message.edit_caption(
-            (callback.message.caption or "") + f"\n\nСтатус: подтверждено\nПокупатель ID: {user_id}",
-            reply_markup=None,
-        )
-    except Exception:
-        pass
+    await _mark_request_processed(
+        callback, payment_id, "подтверждено", f"\nПокупатель ID: {user_id}"
+    )
 
     await callback.answer("Подтверждено")
 
@@ -2138,13 +2768,7 @@ async def reject_payment(callback: CallbackQuery) -> None:
         "Оплата отклонена. Если это ошибка, свяжитесь с поддержкой.",
     )
 
-    try:
-        await callback.message.edit_caption(
-            (callback.message.caption or "") + "\n\nСтатус: отклонено",
-            reply_markup=None,
-        )
-    except Exception:
-        pass
+    await _mark_request_processed(callback, payment_id, "отклонено")
 
     await callback.answer("Отклонено")
 
@@ -2220,14 +2844,16 @@ async def admin_rename_area_finish(message: Message, state: FSMContext) -> None:
     await state.clear()
 
 
-@router.callback_query(AdminStates.rename_variant_pick, F.data.startswith("admin:variant:"))
+@router.callback_query(AdminStates.rename_variant_pick, AdminVariantCb.filter())
 async def admin_rename_variant_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    old_name = callback.data.split(":", 2)[2]
+    old_name = await _picked_variant(callback, callback_data)
+    if old_name is None:
+        return
     await state.update_data(old_variant=old_name)
     await state.set_state(AdminStates.rename_variant_name)
     await _finalize_step_message(callback, f"Вариант выбран: {old_name}")
@@ -2256,18 +2882,21 @@ async def admin_rename_variant_finish(message: Message, state: FSMContext) -> No
         await state.clear()
         return
     await db.rename_variant(old_name, new_name)
+    await catalog_ids.invalidate()
     await message.answer("Вариант переименован.")
     await state.clear()
 
 
-@router.callback_query(AdminStates.rename_class_variant, F.data.startswith("admin:variant:"))
+@router.callback_query(AdminStates.rename_class_variant, AdminVariantCb.filter())
 async def admin_rename_class_variant_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    variant = callback.data.split(":", 2)[2]
+    variant = await _picked_variant(callback, callback_data)
+    if variant is None:
+        return
     await state.update_data(variant=variant)
     classes = await db.get_classes(variant)
     await state.set_state(AdminStates.rename_class_pick)
@@ -2284,14 +2913,17 @@ async def admin_rename_class_variant_pick(
     await callback.answer()
 
 
-@router.callback_query(AdminStates.rename_class_pick, F.data.startswith("admin:class:"))
+@router.callback_query(AdminStates.rename_class_pick, AdminClassCb.filter())
 async def admin_rename_class_pick(
-    callback: CallbackQuery, state: FSMContext
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminClassCb
 ) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    _, _, variant, class_name = callback.data.split(":", 3)
+    found = await _picked_class(callback, callback_data)
+    if found is None:
+        return
+    variant, class_name = found
     await state.update_data(variant=variant, old_class=class_name)
     await state.set_state(AdminStates.rename_class_name)
     await _finalize_step_message(callback, f"Классификация выбрана: {class_name}")
@@ -2321,6 +2953,7 @@ async def admin_rename_class_finish(message: Message, state: FSMContext) -> None
         await state.clear()
         return
     await db.rename_class(variant, old_class, new_name)
+    await catalog_ids.invalidate()
     await message.answer("Классификация переименована.")
     await state.clear()
 
@@ -2456,12 +3089,16 @@ async def admin_product_hide_pick(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-@router.callback_query(AdminStates.variant_photo_pick, F.data.startswith("admin:variant:"))
-async def admin_variant_photo_pick(callback: CallbackQuery, state: FSMContext) -> None:
+@router.callback_query(AdminStates.variant_photo_pick, AdminVariantCb.filter())
+async def admin_variant_photo_pick(
+    callback: CallbackQuery, state: FSMContext, callback_data: AdminVariantCb
+) -> None:
     if not await is_admin(callback):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    variant = callback.data.split(":", 2)[2]
+    variant = await _picked_variant(callback, callback_data)
+    if variant is None:
+        return
     await state.update_data(variant=variant)
     await state.set_state(AdminStates.variant_photo_upload)
     await _finalize_step_message(callback, f"Вариант выбран: {variant}")
@@ -2506,3 +3143,100 @@ async def admin_product_owner_show(message: Message, state: FSMContext) -> None:
  
 
 
+@router.callback_query(F.data == "admin:section:broadcast")
+async def admin_section_broadcast(callback: CallbackQuery) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await _clear_inline_keyboard(callback)
+    broadcasts = await db.list_broadcasts()
+    lines = ["Рассылки:"]
+    lines.extend(broadcast_summary(row) for row in broadcasts)
+    if not broadcasts:
+        lines.append("Рассылок еще не было.")
+    await callback.message.answer(
+        "\n".join(lines), reply_markup=broadcast_menu_kb(broadcasts)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin:broadcast:new")
+async def admin_broadcast_new(callback: CallbackQuery, state: FSMContext) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await state.set_state(AdminStates.broadcast_message)
+    await _clear_inline_keyboard(callback)
+    await callback.message.answer(
+        "Отправьте текст рассылки или фото с подписью."
+    )
+    await callback.answer()
+
+
+@router.message(AdminStates.broadcast_message)
+async def admin_broadcast_preview(message: Message, state: FSMContext) -> None:
+    if not await is_admin(message):
+        await message.answer("Доступ запрещен.")
+        await state.clear()
+        return
+    photo_file_id = message.photo[-1].file_id if message.photo else None
+    text = (message.text or message.caption or "").strip() or None
+    if not text and not photo_file_id:
+        await message.answer("Нужен текст или фото с подписью.")
+        return
+    await state.update_data(text=text, photo_file_id=photo_file_id)
+    await state.set_state(AdminStates.broadcast_confirm)
+
+    total = await db.count_reachable_users()
+    if photo_file_id:
+        await message.answer_photo(photo_file_id, caption=text)
+    else:
+        await message.answer(text)
+    await message.answer(
+        "Так сообщение увидят пользователи.", reply_markup=broadcast_confirm_kb(total)
+    )
+
+
+@router.callback_query(AdminStates.broadcast_confirm, F.data == "admin:broadcast:send")
+async def admin_broadcast_send(callback: CallbackQuery, state: FSMContext) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    data = await state.get_data()
+    await state.clear()
+    await _clear_inline_keyboard(callback)
+    broadcast_id = await db.create_broadcast(
+        data.get("text"), data.get("photo_file_id"), callback.from_user.id
+    )
+    broadcaster.notify()
+    row = await db.get_broadcast(broadcast_id)
+    await callback.message.answer(
+        f"Рассылка #{broadcast_id} запущена. Получателей: {row['total']}. "
+        "Итог придет сюда же."
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin:broadcast:cancel")
+async def admin_broadcast_cancel(callback: CallbackQuery, state: FSMContext) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    await state.clear()
+    await _clear_inline_keyboard(callback)
+    await callback.message.answer("Рассылка отменена.")
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin:broadcast:stop:"))
+async def admin_broadcast_stop(callback: CallbackQuery) -> None:
+    if not await is_admin(callback):
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    broadcast_id = int(callback.data.rsplit(":", 1)[1])
+    if not await db.finish_broadcast(broadcast_id, "cancelled"):
+        await callback.answer("Рассылка уже завершена.", show_alert=True)
+        return
+    await _clear_inline_keyboard(callback)
+    await callback.message.answer(f"Рассылка #{broadcast_id} остановлена.")
+    await callback.answer()
@@ -16,7 +16,10 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.config import ADMIN_GROUP_ID, BTN, PAYMENT_DETAILS, SUPPORT_TEXT
 from app.db import database as db
+from app.services.callbacks import ClassCb, VariantCb, catalog_ids
 from app.services.catalog import build_cart_text, format_price
+from app.services.media import send_album, variant_album
+from app.services.outbound import Priority, priority
 
 router = Router()
 
@@ -55,20 +58,23 @@ def areas_kb(areas: list[dict]) -> InlineKeyboardMarkup:
 
 
 def variants_kb(variants: list[dict]) -> InlineKeyboardMarkup:
+    catalog_ids.remember_variants(variants)
     builder = InlineKeyboardBuilder()
     for variant in variants:
-        name = variant["name"]
-        builder.button(text=f"Категория: {name}", callback_data=f"variant:{name}")
+        builder.button(
+            text=f"Категория: {variant['name']}",
+            callback_data=VariantCb(id=int(variant["id"])),
+        )
     builder.button(text=BTN.BACK, callback_data="back:areas")
     builder.adjust(2)
     return builder.as_markup()
 
 def classes_kb(variant: str, classes: list[dict]) -> InlineKeyboardMarkup:
+    catalog_ids.remember_classes(variant, classes)
     builder = InlineKeyboardBuilder()
     for class_row in classes:
-        class_name = class_row["name"]
         builder.button(
-            text=class_name, callback_data=f"class:{variant}:{class_name}"
+            text=class_row["name"], callback_data=ClassCb(id=int(class_row["id"]))
         )
     builder.button(text=BTN.BACK, callback_data="back:variants")
     builder.adjust(2)
@@ -161,29 +167,33 @@ async def pick_city(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("area:"))
-async def pick_area(callback: CallbackQuery) -> None:
-    area_id = int(callback.data.split(":", 1)[1])
-    await db.set_user_area(callback.from_user.id, area_id)
+async def _send_variants_menu(callback: CallbackQuery) -> None:
     photos = await db.get_variant_photos()
     variants = await db.get_variants()
-    for variant in variants:
-        name = variant["name"]
-        photo_id = photos.get(name)
-        if photo_id:
-            await callback.message.answer_photo(
-                photo_id,
-                caption=f"Категория: {name}",
-            )
+    await send_album(
+        callback.bot,
+        callback.message.chat.id,
+        variant_album(variants, photos),
+    )
     await callback.message.answer(
         "Выберите вариант:", reply_markup=variants_kb(variants)
     )
+
+
+@router.callback_query(F.data.startswith("area:"))
+async def pick_area(callback: CallbackQuery) -> None:
+    area_id = int(callback.data.split(":", 1)[1])
+    await db.set_user_area(callback.from_user.id, area_id)
+    await _send_variants_menu(callback)
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("variant:"))
-async def pick_variant(callback: CallbackQuery) -> None:
-    variant = callback.data.split(":", 1)[1]
+@router.callback_query(VariantCb.filter())
+async def pick_variant(callback: CallbackQuery, callback_data: VariantCb) -> None:
+    variant = await catalog_ids.variant(callback_data.id)
+    if variant is None:
+        await callback.answer("Категория не найдена", show_alert=True)
+        return
     classes = await db.get_classes(variant)
     await callback.message.answer(
         "Выберите классификацию:", reply_markup=classes_kb(variant, classes)
@@ -191,9 +201,13 @@ async def pick_variant(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("class:"))
-async def pick_class(callback: CallbackQuery) -> None:
-    _, variant, class_name = callback.data.split(":", 2)
+@router.callback_query(ClassCb.filter())
+async def pick_class(callback: CallbackQuery, callback_data: ClassCb) -> None:
+    found = await catalog_ids.class_(callback_data.id)
+    if found is None:
+        await callback.answer("Классификация не найдена", show_alert=True)
+        return
+    variant, class_name = found
     user = await db.get_user(callback.from_user.id)
     if not user or not user["last_city_id"] or not user["last_area_id"]:
         cities = await db.get_cities()
@@ -243,19 +257,7 @@ async def back_to_areas(callback: CallbackQuery) -> None:
 
 @router.callback_query(F.data == "back:variants")
 async def back_to_variants(callback: CallbackQuery) -> None:
-    photos = await db.get_variant_photos()
-    variants = await db.get_variants()
-    for variant in variants:
-        name = variant["name"]
-        photo_id = photos.get(name)
-        if photo_id:
-            await callback.message.answer_photo(
-                photo_id,
-                caption=f"Категория: {name}",
-            )
-    await callback.message.answer(
-        "Выберите вариант:", reply_markup=variants_kb(variants)
-    )
+    await _send_variants_menu(callback)
     await callback.answer()
 
 
@@ -364,12 +366,13 @@ async def receive_payment_photo(message: Message, state: FSMContext) -> None:
 
     if ADMIN_GROUP_ID:
         try:
-            await message.bot.send_photo(
-                ADMIN_GROUP_ID,
-                photo=photo_id,
-                caption=admin_text,
-                reply_markup=admin_kb,
-            )
+            with priority(Priority.ADMIN):
+                await message.bot.send_photo(
+                    ADMIN_GROUP_ID,
+                    photo=photo_id,
+                    caption=admin_text,
+                    reply_markup=admin_kb,
+                )
         except Exception:
             pass
 
@@ -501,40 +504,41 @@ async def support_message(message: Message, state: FSMContext) -> None:
     sent_ids: list[int] = []
 
     try:
-        if message.photo:
-            media_msg = await message.bot.send_photo(
-                ADMIN_GROUP_ID,
-                photo=message.photo[-1].file_id,
-                caption="Фото от пользователя",
-            )
-            sent_ids.append(media_msg.message_id)
-        if message.document:
-            media_msg = await message.bot.send_document(
+        with priority(Priority.ADMIN):
+            if message.photo:
+                media_msg = await message.bot.send_photo(
+                    ADMIN_GROUP_ID,
+                    photo=message.photo[-1].file_id,
+                    caption="Фото от пользователя",
+                )
+                sent_ids.append(media_msg.message_id)
+            if message.document:
+                media_msg = await message.bot.send_document(
+                    ADMIN_GROUP_ID,
+                    document=message.document.file_id,
+                    caption="Документ от пользователя",
+                )
+                sent_ids.append(media_msg.message_id)
+
+            info_msg = await message.bot.send_message(
                 ADMIN_GROUP_ID,
-                document=message.document.file_id,
-                caption="Документ от пользователя",
-            )
-            sent_ids.append(media_msg.message_id)
-
-        info_msg = await message.bot.send_message(
-            ADMIN_GROUP_ID,
-            info,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text="Закрыть чат",
-                            callback_data="support:close",
-                        ),
-                        InlineKeyboardButton(
-                            text="Закрыть навсегда",
-                            callback_data=f"support:block:{message.from_user.id}",
-                        ),
+                info,
+                reply_markup=InlineKeyboardMarkup(
+                    inline_keyboard=[
+                        [
+                            InlineKeyboardButton(
+                                text="Закрыть чат",
+                                callback_data="support:close",
+                            ),
+                            InlineKeyboardButton(
+                                text="Закрыть навсегда",
+                                callback_data=f"support:block:{message.from_user.id}",
+                            ),
+                        ]
                     ]
-                ]
-            ),
-        )
-        sent_ids.append(info_msg.message_id)
+                ),
+            )
+            sent_ids.append(info_msg.message_id)
     except Exception:
         await message.answer(
             "Не удалось отправить сообщение в поддержку. "
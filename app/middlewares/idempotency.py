@@ -0,0 +1,115 @@
+﻿from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Update
+
+from app.config import IDEMPOTENCY_PAYMENT_WINDOW, IDEMPOTENCY_TAP_WINDOW
+from app.db import database as db
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_PREFIXES = ("pay:confirm:", "pay:reject:")
+
+
+class RecentKeys:
+    def __init__(self, maxsize: int = 50_000) -> None:
+        self.maxsize = maxsize
+        self._seen: OrderedDict[Hashable, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def seen(self, key: Hashable, window: float, now: float) -> bool:
+        stamp = self._seen.get(key)
+        return stamp is not None and now - stamp < window
+
+    def mark(self, key: Hashable, now: float) -> None:
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+
+def payment_key(data: str | None) -> int | None:
+    if not data or not data.startswith(PAYMENT_PREFIXES):
+        return None
+    try:
+        return int(data.rsplit(":", 1)[1])
+    except ValueError:
+        return None
+
+
+# Runs inside the per-user lock (after FSMContextMiddleware), so a second tap
+# only gets here once the first one has finished and can be told apart.
+class IdempotencyMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        tap_window: float = IDEMPOTENCY_TAP_WINDOW,
+        payment_window: float = IDEMPOTENCY_PAYMENT_WINDOW,
+    ) -> None:
+        self.tap_window = tap_window
+        self.payment_window = payment_window
+        self.recent = RecentKeys()
+        self._payments_in_flight: set[int] = set()
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        now = time.monotonic()
+        # Telegram redelivers the same update after a webhook timeout.
+        if self.recent.seen(("update", event.update_id), self.payment_window, now):
+            self.dropped += 1
+            return None
+        self.recent.mark(("update", event.update_id), now)
+
+        query = event.callback_query
+        if query is None:
+            return await handler(event, data)
+
+        tap = ("tap", query.from_user.id, query.data)
+        if self.recent.seen(("callback", query.id), self.payment_window, now) or (
+            self.recent.seen(tap, self.tap_window, now)
+        ):
+            return await self._drop(query, None)
+        self.recent.mark(("callback", query.id), now)
+
+        payment_id = payment_key(query.data)
+        if payment_id is None:
+            try:
+                return await handler(event, data)
+            finally:
+                self.recent.mark(tap, time.monotonic())
+
+        if payment_id in self._payments_in_flight or self.recent.seen(
+            ("payment", payment_id), self.payment_window, now
+        ):
+            return await self._drop(query, "Заявка уже обработана.")
+        self._payments_in_flight.add(payment_id)
+        try:
+            result = await handler(event, data)
+            # The handler may have refused the tap (not an admin, error), so
+            # only lock the payment once it has actually left 'pending'.
+            payment = await db.get_payment(payment_id)
+            if payment is not None and payment["status"] != "pending":
+                self.recent.mark(("payment", payment_id), time.monotonic())
+        finally:
+            self._payments_in_flight.discard(payment_id)
+        return result
+
+    async def _drop(self, query: CallbackQuery, text: str | None) -> None:
+        self.dropped += 1
+        logger.info("Dropped duplicate callback %s from %s", query.data, query.from_user.id)
+        try:
+            # stop the button spinner, nothing else
+            await query.answer(text, show_alert=bool(text))
+        except Exception:
+            pass
@@ -0,0 +1,38 @@
+﻿from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Hashable
+
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+
+
+# Same as aiogram's SimpleEventIsolation (one FIFO lock per chat/user, taken
+# before the FSM state is read), but a lock is dropped once nobody holds or
+# waits for it, so the table does not grow with every user ever seen.
+class UserEventIsolation(BaseEventIsolation):
+    def __init__(self) -> None:
+        self._locks: dict[Hashable, tuple[asyncio.Lock, list[int]]] = {}
+
+    # no __len__: Dispatcher does `events_isolation or ...`, an empty
+    # table would make it fall back to DisabledEventIsolation
+    def stats(self) -> dict[str, int]:
+        return {"locks": len(self._locks)}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = (asyncio.Lock(), [0])
+        lock, users = entry
+        users[0] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users[0] -= 1
+            if users[0] == 0:
+                del self._locks[key]
+
+    async def close(self) -> None:
+        self._locks.clear()
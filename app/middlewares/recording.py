@@ -0,0 +1,163 @@
+﻿from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Replays map admins to 1..N and the admin group to this id.
+REPLAY_ADMIN_GROUP = -1000000000001
+NAME_FIELDS = ("first_name", "last_name", "username", "phone_number", "title")
+# opaque strings that still identify a file or a chat across captures
+HASHED_FIELDS = ("file_id", "file_unique_id", "chat_instance")
+CHAT_TYPES = {"private", "group", "supergroup", "channel"}
+# A crash loses at most this much of the capture.
+FLUSH_EVERY = 50
+FLUSH_INTERVAL = 2.0
+
+
+class Anonymizer:
+    # Keyed hash with a salt that is never written out: ids stay consistent
+    # inside one capture (same user -> same fake id) but cannot be reversed.
+    def __init__(self, admin_ids: list[int], admin_group_id: int) -> None:
+        self._salt = secrets.token_bytes(16)
+        self._fixed = {admin_id: i + 1 for i, admin_id in enumerate(admin_ids)}
+        if admin_group_id:
+            self._fixed[admin_group_id] = REPLAY_ADMIN_GROUP
+
+    def _digest(self, value: Any) -> bytes:
+        return hmac.new(self._salt, str(value).encode(), hashlib.sha256).digest()
+
+    def user_id(self, value: int) -> int:
+        if value in self._fixed:
+            return self._fixed[value]
+        fake = 10**9 + int.from_bytes(self._digest(value)[:5], "big") % (9 * 10**9)
+        # group and channel ids are negative, keep them apart from users
+        return -fake - 10**12 if value < 0 else fake
+
+    def opaque(self, value: str) -> str:
+        return "anon-" + self._digest(value)[:12].hex()
+
+    def update(self, node: Any) -> Any:
+        if isinstance(node, list):
+            return [self.update(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        out = {key: self.update(value) for key, value in node.items()}
+        is_user = "is_bot" in node and not node["is_bot"]
+        if (is_user or node.get("type") in CHAT_TYPES) and isinstance(node.get("id"), int):
+            out["id"] = self.user_id(node["id"])
+            for field in NAME_FIELDS:
+                if field in out:
+                    out[field] = f"{field}-{abs(out['id'])}"
+        for field in HASHED_FIELDS:
+            if isinstance(out.get(field), str):
+                out[field] = self.opaque(out[field])
+        return out
+
+
+# Outermost update middleware, so redeliveries and duplicates are captured
+# as Telegram sent them. One gzipped JSONL file per process and start.
+class UpdateRecorder(BaseMiddleware):
+    def __init__(
+        self,
+        directory: Path | str,
+        admin_ids: list[int],
+        admin_group_id: int,
+        max_bytes: int,
+    ) -> None:
+        self.directory = Path(directory)
+        self.anonymizer = Anonymizer(admin_ids, admin_group_id)
+        self.admins = len(admin_ids)
+        self.admin_group = bool(admin_group_id)
+        self.max_bytes = max_bytes
+        self.recorded = 0
+        self.path: Path | None = None
+        self._raw = None
+        self._file = None
+        self._dirty = False
+        self._flusher: asyncio.Task | None = None
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = self.directory / f"updates-{stamp}-{os.getpid()}.jsonl.gz"
+        self._raw = open(self.path, "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        header = {
+            "capture": 1,
+            "started": time.time(),
+            "admins": self.admins,
+            "admin_group": self.admin_group,
+        }
+        self._file.write((json.dumps(header) + "\n").encode())
+        logger.info("Recording updates to %s", self.path)
+
+    def record(self, event: Update) -> None:
+        if self._file is None:
+            if self.path is not None:
+                return  # size cap reached
+            self._open()
+        raw = event.model_dump(mode="json", exclude_none=True, by_alias=True)
+        line = {"ts": round(time.time(), 3), "update": self.anonymizer.update(raw)}
+        self._file.write((json.dumps(line, ensure_ascii=False) + "\n").encode())
+        self.recorded += 1
+        self._dirty = True
+        if self.recorded % FLUSH_EVERY == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is None or not self._dirty:
+            return
+        self._file.flush()
+        self._dirty = False
+        if self._raw.tell() >= self.max_bytes:
+            logger.warning("Update capture %s hit the size cap, stopped", self.path)
+            self._close_file()
+
+    async def _flush_periodically(self) -> None:
+        # a quiet bot may not reach FLUSH_EVERY for hours
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush update capture %s", self.path)
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+        try:
+            self.record(event)
+        except Exception:
+            logger.exception("Failed to record update %s", event.update_id)
+        return await handler(event, data)
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self._close_file()
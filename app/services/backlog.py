@@ -0,0 +1,96 @@
+﻿from __future__ import annotations
+
+import logging
+import time
+from collections import Counter
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app.services.ordering import KeyedSerializer
+
+logger = logging.getLogger(__name__)
+
+# Callbacks that only render a menu; a later menu tap makes them pointless.
+NAVIGATION_PREFIXES = (
+    "city:",
+    "area:",
+    "v:",
+    "c:",
+    "back:",
+    "pp:",
+    "admin:menu:",
+    "admin:section:",
+    "admin:locations:",
+)
+
+
+def update_key(update: Update) -> int:
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else 0
+
+
+def is_navigation(update: Update) -> bool:
+    query = update.callback_query
+    return query is not None and (query.data or "").startswith(NAVIGATION_PREFIXES)
+
+
+def collapse(updates: list[Update]) -> list[Update]:
+    # Walk backwards: a menu tap is dropped if the same user's next update is
+    # also a menu tap. Messages (payment photos) and actions are always kept.
+    next_is_navigation: dict[int, bool] = {}
+    kept: list[Update] = []
+    for update in reversed(updates):
+        key = update_key(update)
+        navigation = is_navigation(update)
+        if navigation and next_is_navigation.get(key):
+            continue
+        next_is_navigation[key] = navigation
+        kept.append(update)
+    kept.reverse()
+    return kept
+
+
+async def drain_backlog(
+    bot: Bot,
+    dp: Dispatcher,
+    allowed_updates: list[str] | None = None,
+    page_size: int = 100,
+) -> dict[str, int]:
+    stats: Counter[str] = Counter()
+    started = time.monotonic()
+    offset: int | None = None
+    while True:
+        # Asking with a higher offset confirms the previous page, so a page is
+        # only acknowledged after it has been processed.
+        updates = await bot.get_updates(
+            offset=offset, limit=page_size, timeout=0, allowed_updates=allowed_updates
+        )
+        if not updates:
+            break
+        kept = collapse(updates)
+        stats["fetched"] += len(updates)
+        stats["collapsed"] += len(updates) - len(kept)
+
+        serializer = KeyedSerializer()
+        for update in kept:
+            serializer.submit(
+                update_key(update), lambda update=update: dp.feed_update(bot, update)
+            )
+        await serializer.join()
+        stats["processed"] += len(kept)
+        offset = updates[-1].update_id + 1
+
+    if stats["fetched"]:
+        logger.info(
+            "Backlog: %s updates, %s processed, %s stale menu taps skipped in %.1fs",
+            stats["fetched"],
+            stats["processed"],
+            stats["collapsed"],
+            time.monotonic() - started,
+        )
+    return dict(stats)
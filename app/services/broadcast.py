@@ -0,0 +1,135 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from app.config import BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE, OUTBOX_POLL_INTERVAL
+from app.db import database as db
+from app.services.outbound import Priority, priority
+
+logger = logging.getLogger(__name__)
+
+
+def broadcast_summary(row: Any) -> str:
+    return (
+        f"Рассылка #{row['id']} ({row['status']}): "
+        f"доставлено {row['delivered']}, заблокировали бота {row['blocked']}, "
+        f"ошибок {row['failed']}, всего {row['total']}"
+    )
+
+
+# Walks users by tg_id in pages and checkpoints the cursor after every page,
+# so a restart resends at most one page. Runs one broadcast at a time, at the
+# lowest outbound priority.
+class Broadcaster:
+    def __init__(
+        self,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        page_size: int = BROADCAST_PAGE_SIZE,
+        interval: float = OUTBOX_POLL_INTERVAL,
+    ) -> None:
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.interval = interval
+        self._bot: Bot | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="broadcaster")
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                row = await db.get_next_broadcast()
+                if row is not None:
+                    await self.deliver(row)
+                    continue
+            except Exception:
+                logger.exception("Broadcast failed")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def deliver(self, row: Any) -> None:
+        broadcast_id = int(row["id"])
+        cursor = int(row["last_user_id"])
+        semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info("Broadcast %s resumes after user %s", broadcast_id, cursor)
+
+        while True:
+            recipients = await db.get_broadcast_recipients(cursor, self.page_size)
+            if not recipients:
+                break
+            results = await asyncio.gather(
+                *(self._send(semaphore, row, user_id) for user_id in recipients)
+            )
+            cursor = recipients[-1]
+            await db.checkpoint_broadcast(
+                broadcast_id,
+                cursor,
+                delivered=results.count("delivered"),
+                failed=results.count("failed"),
+                blocked_ids=[
+                    user_id
+                    for user_id, result in zip(recipients, results)
+                    if result == "blocked"
+                ],
+            )
+            current = await db.get_broadcast(broadcast_id)
+            if current is None or current["status"] != "running":
+                logger.info("Broadcast %s stopped", broadcast_id)
+                return
+
+        await db.finish_broadcast(broadcast_id)
+        current = await db.get_broadcast(broadcast_id)
+        logger.info(broadcast_summary(current))
+        try:
+            with priority(Priority.ADMIN):
+                await self._bot.send_message(
+                    int(current["created_by"]), broadcast_summary(current)
+                )
+        except Exception:
+            logger.warning("Could not report broadcast %s", broadcast_id)
+
+    async def _send(self, semaphore: asyncio.Semaphore, row: Any, user_id: int) -> str:
+        async with semaphore:
+            try:
+                with priority(Priority.BROADCAST):
+                    if row["photo_file_id"]:
+                        await self._bot.send_photo(
+                            user_id, photo=row["photo_file_id"], caption=row["text"]
+                        )
+                    else:
+                        await self._bot.send_message(user_id, row["text"])
+            except TelegramForbiddenError:
+                return "blocked"
+            except Exception as exc:
+                logger.warning("Broadcast %s to %s failed: %s", row["id"], user_id, exc)
+                return "failed"
+            return "delivered"
+
+
+broadcaster = Broadcaster()
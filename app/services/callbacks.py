@@ -0,0 +1,117 @@
+﻿from __future__ import annotations
+
+import time
+from typing import Iterable, Mapping
+
+from aiogram.filters.callback_data import CallbackData
+
+from app.db import database as db
+from app.services import memory
+
+
+class VariantCb(CallbackData, prefix="v"):
+    id: int
+
+
+class ClassCb(CallbackData, prefix="c"):
+    id: int
+
+
+class AdminVariantCb(CallbackData, prefix="av"):
+    id: int
+
+
+class AdminClassCb(CallbackData, prefix="ac"):
+    id: int
+
+
+class PendingPageCb(CallbackData, prefix="pp"):
+    after: int = 0
+    before: int = 0
+
+
+class HistoryPageCb(CallbackData, prefix="hp"):
+    user: int
+    after: int = 0
+    before: int = 0
+
+
+class LogsCb(CallbackData, prefix="lg"):
+    limit: int = 200
+    level: str = ""
+    minutes: int = 0
+
+
+class SalesCb(CallbackData, prefix="sl"):
+    days: int = 7
+    by: str = "city"
+    city: int = 0
+
+
+# Keyboards register the rows they render, so decoding a tap is a dict
+# lookup; a miss (restart, old keyboard) falls back to one DB read.
+# Renames and deletes bump catalog_version in settings, which every
+# process re-reads at most once per check_interval.
+class CatalogIds:
+    def __init__(self, check_interval: float = 2.0) -> None:
+        self._variants: dict[int, str] = {}
+        self._classes: dict[int, tuple[str, str]] = {}
+        self.check_interval = check_interval
+        self._version: str | None = None
+        self._checked = 0.0
+
+    def __len__(self) -> int:
+        return len(self._variants) + len(self._classes)
+
+    def remember_variants(self, rows: Iterable[Mapping]) -> None:
+        for row in rows:
+            self._variants[int(row["id"])] = str(row["name"])
+
+    def remember_classes(self, variant: str, rows: Iterable[Mapping]) -> None:
+        for row in rows:
+            self._classes[int(row["id"])] = (variant, str(row["name"]))
+
+    def _clear(self) -> None:
+        self._variants.clear()
+        self._classes.clear()
+
+    async def invalidate(self) -> None:
+        self._clear()
+        self._version = await db.bump_catalog_version()
+        self._checked = time.monotonic()
+
+    async def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        version = await db.get_setting("catalog_version")
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    async def variant(self, variant_id: int) -> str | None:
+        await self._sync()
+        name = self._variants.get(variant_id)
+        if name is not None:
+            return name
+        row = await db.get_variant_by_id(variant_id)
+        if not row:
+            return None
+        self._variants[variant_id] = str(row["name"])
+        return self._variants[variant_id]
+
+    async def class_(self, class_id: int) -> tuple[str, str] | None:
+        await self._sync()
+        found = self._classes.get(class_id)
+        if found is not None:
+            return found
+        row = await db.get_class_by_id(class_id)
+        if not row:
+            return None
+        self._classes[class_id] = (str(row["variant_name"]), str(row["name"]))
+        return self._classes[class_id]
+
+
+catalog_ids = CatalogIds()
+memory.track("catalog_ids", lambda: len(catalog_ids))
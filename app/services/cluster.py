@@ -0,0 +1,214 @@
+﻿from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import queue
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app.config import OUTBOUND_GLOBAL_RATE, OUTBOUND_GROUP_RATE
+
+logger = logging.getLogger(__name__)
+
+BATCH_LIMIT = 256
+
+
+def shard_key(update: dict[str, Any]) -> int:
+    for payload in update.values():
+        if not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return 0
+
+
+def share_rates(processes: int) -> None:
+    from app.services.outbound import scheduler
+
+    # Every process has its own scheduler, so they split the flood budget.
+    scheduler.set_rates(
+        OUTBOUND_GLOBAL_RATE / processes, OUTBOUND_GROUP_RATE / processes
+    )
+
+
+# The receiver process only polls (or serves the webhook) and hands every
+# update to the worker that owns its user, so one user's updates are always
+# handled by the same process, in order. FSM state lives in the shop DB and
+# catalog caches follow settings.catalog_version, so workers need nothing else.
+class Cluster:
+    def __init__(
+        self,
+        workers: int,
+        bot_factory: Callable[[], Bot] | None = None,
+        initializer: Callable[[], None] | None = None,
+    ) -> None:
+        self.workers = workers
+        self.bot_factory = bot_factory
+        self.initializer = initializer
+        self._ctx = mp.get_context("spawn")
+        self._queues = [self._ctx.Queue() for _ in range(workers)]
+        self.ready = self._ctx.Array("b", workers, lock=False)
+        self.processed = self._ctx.Array("q", workers, lock=False)
+        self.dispatched = [0] * workers
+        self._processes: list[mp.process.BaseProcess] = []
+
+    def start(self) -> None:
+        share_rates(self.workers + 1)
+        for index, updates in enumerate(self._queues):
+            process = self._ctx.Process(
+                target=worker_main,
+                args=(
+                    index,
+                    self.workers,
+                    updates,
+                    self.ready,
+                    self.processed,
+                    self.bot_factory,
+                    self.initializer,
+                ),
+                name=f"shop-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        logger.info("Started %s worker processes", self.workers)
+
+    async def wait_ready(self, timeout: float = 60) -> None:
+        deadline = time.monotonic() + timeout
+        while not all(self.ready):
+            if time.monotonic() > deadline:
+                raise TimeoutError("cluster workers did not start in time")
+            await asyncio.sleep(0.05)
+
+    def dispatch(self, update: dict[str, Any]) -> int:
+        index = shard_key(update) % self.workers
+        self._queues[index].put(json.dumps(update, ensure_ascii=False))
+        self.dispatched[index] += 1
+        return index
+
+    def stats(self) -> dict[str, list[int]]:
+        return {"dispatched": list(self.dispatched), "processed": list(self.processed)}
+
+    def receiver(self) -> Dispatcher:
+        dp = Dispatcher(disable_fsm=True)
+        dp.update.outer_middleware(self._fan_out)
+        return dp
+
+    async def _fan_out(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> None:
+        self.dispatch(event.model_dump(mode="json", exclude_none=True, by_alias=True))
+
+    async def stop(self, timeout: float = 30) -> None:
+        for updates in self._queues:
+            updates.put(None)
+        await asyncio.to_thread(self._join, timeout)
+
+    def _join(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", process.name)
+                process.terminate()
+                process.join()
+        self._processes.clear()
+
+
+def _take(updates: Any) -> list[str | None]:
+    items = [updates.get()]
+    while len(items) < BATCH_LIMIT:
+        try:
+            items.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+
+def worker_main(
+    index: int,
+    workers: int,
+    updates: Any,
+    ready: Any,
+    processed: Any,
+    bot_factory: Callable[[], Bot] | None,
+    initializer: Callable[[], None] | None,
+) -> None:
+    if initializer is not None:
+        initializer()
+    try:
+        asyncio.run(_serve(index, workers, updates, ready, processed, bot_factory))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(
+    index: int,
+    workers: int,
+    updates: Any,
+    ready: Any,
+    processed: Any,
+    bot_factory: Callable[[], Bot] | None,
+) -> None:
+    from app.bot import create_bot, create_dispatcher
+    from app.config import METRICS_HOST, METRICS_PORT, TRACEMALLOC_FRAMES
+    from app.services import memory
+    from app.services.loop_monitor import loop_monitor
+    from app.services.memory import memory_tracker
+    from app.services.metrics import start_metrics_server
+    from app.services.ordering import KeyedSerializer
+    from app.services.outbound import scheduler
+
+    if TRACEMALLOC_FRAMES:
+        memory_tracker.start(TRACEMALLOC_FRAMES)
+    share_rates(workers + 1)
+    bot = (bot_factory or create_bot)()
+    dp = create_dispatcher()
+    serializer = KeyedSerializer()
+    memory.track("worker_serializer_keys", lambda: len(serializer))
+    loop = asyncio.get_running_loop()
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index)
+
+    async def handle(raw: dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            logger.exception(
+                "Worker %s failed to process update %s", index, raw.get("update_id")
+            )
+        finally:
+            processed[index] += 1
+
+    loop_monitor.start(bot)
+    ready[index] = 1
+    logger.info("Worker %s ready", index)
+    running = True
+    while running:
+        for item in await loop.run_in_executor(None, _take, updates):
+            if item is None:
+                running = False
+                break
+            raw = json.loads(item)
+            serializer.submit(shard_key(raw), lambda raw=raw: handle(raw))
+
+    await serializer.join()
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await bot.session.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await loop_monitor.close()
+    await scheduler.close()
@@ -0,0 +1,177 @@
+﻿from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+
+from app.config import FSM_FLUSH_INTERVAL, FSM_STATE_TTL_HOURS
+from app.db import database as db
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: str | None, data: dict[str, Any], touched: float) -> None:
+        self.state = state
+        self.data = data
+        self.touched = touched
+
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+# Reads and writes hit the in-memory layer; changed keys are written to
+# fsm_states in one transaction every flush_interval seconds and on close.
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        key_builder: KeyBuilder | None = None,
+        ttl: float = FSM_STATE_TTL_HOURS * 3600,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        hot_ttl: float = 900,
+        sweep_interval: float = 300,
+        batch_size: int = 500,
+    ) -> None:
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.hot_ttl = hot_ttl
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self._hot: dict[str, _Entry] = {}
+        self._dirty: set[str] = set()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._last_sweep = time.time()
+
+        self.loads = 0
+        self.flushes = 0
+        self.flushed_keys = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hot_keys": len(self._hot),
+            "dirty_keys": len(self._dirty),
+            "loads": self.loads,
+            "flushes": self.flushes,
+            "flushed_keys": self.flushed_keys,
+        }
+
+    async def _entry(self, key: StorageKey) -> tuple[str, _Entry]:
+        name = self.key_builder.build(key)
+        now = time.time()
+        entry = self._hot.get(name)
+        if entry is None:
+            self.loads += 1
+            row = await db.get_fsm_record(name)
+            loaded = _Entry(None, {}, now)
+            if row and float(row["updated_at"]) >= now - self.ttl:
+                loaded.state = row["state"]
+                loaded.data = json.loads(row["data"])
+            # another update for this key may have loaded it while we waited
+            entry = self._hot.setdefault(name, loaded)
+        elif entry.touched < now - self.ttl and not entry.empty():
+            entry.state = None
+            entry.data = {}
+            self._mark_dirty(name)
+        entry.touched = now
+        return name, entry
+
+    def _mark_dirty(self, name: str) -> None:
+        self._dirty.add(name)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="fsm-storage-flush")
+        elif len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name, entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(name)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        name, entry = await self._entry(key)
+        entry.data = dict(data)
+        self._mark_dirty(name)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, entry = await self._entry(key)
+        return dict(entry.data)
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        names, self._dirty = self._dirty, set()
+        upserts: list[tuple[str, str | None, str, float]] = []
+        deletes: list[str] = []
+        for name in names:
+            entry = self._hot.get(name)
+            if entry is None or entry.empty():
+                deletes.append(name)
+            else:
+                upserts.append(
+                    (name, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.touched)
+                )
+        try:
+            await db.save_fsm_records(upserts, deletes)
+        except Exception:
+            self._dirty |= names
+            raise
+        self.flushes += 1
+        self.flushed_keys += len(names)
+
+    async def sweep(self) -> None:
+        now = time.time()
+        self._last_sweep = now
+        idle = [
+            name
+            for name, entry in self._hot.items()
+            if entry.touched < now - self.hot_ttl and name not in self._dirty
+        ]
+        for name in idle:
+            del self._hot[name]
+        expired = await db.delete_expired_fsm_records(now - self.ttl)
+        if idle or expired:
+            logger.info("FSM sweep: evicted %s idle, expired %s", len(idle), expired)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+                if time.time() - self._last_sweep >= self.sweep_interval:
+                    await self.sweep()
+            except Exception:
+                logger.exception("FSM storage flush failed")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,131 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiohttp import web
+
+from app.config import (
+    HEALTH_DB_CACHE,
+    HEALTH_DB_TIMEOUT,
+    HEALTH_MAX_OUTBOUND_QUEUE,
+    HEALTH_POLL_STALE,
+)
+from app.db import database as db
+from app.services.loop_monitor import loop_monitor
+from app.services.outbound import scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def _age(moment: float | None, now: float) -> float | None:
+    return None if moment is None else round(now - moment, 1)
+
+
+# /healthz answers "is the process alive and its loop responsive" (restart it
+# if not); /readyz answers "can it do its job right now" (DB, Telegram, queue).
+class Health:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        # set by main: "polling" makes a stale getUpdates a readiness failure
+        self.mode = ""
+        self.last_update: float | None = None
+        self.last_poll: float | None = None
+        self._db_checked: float | None = None
+        self._db_result: tuple[bool, dict[str, Any]] = (False, {})
+
+    def mark_update(self) -> None:
+        self.last_update = time.monotonic()
+
+    def mark_poll(self, updates: int) -> None:
+        self.last_poll = time.monotonic()
+        if updates:
+            self.last_update = self.last_poll
+
+    def liveness(self) -> tuple[bool, dict[str, Any]]:
+        stats = loop_monitor.stats()
+        lagging = stats["window_avg_lag_ms"] > loop_monitor.threshold * 1000
+        return loop_monitor.running and not lagging, {
+            "loop_monitor": loop_monitor.running,
+            "loop_lag_ms": stats["window_avg_lag_ms"],
+            "loop_lag_limit_ms": round(loop_monitor.threshold * 1000, 1),
+        }
+
+    async def _check_db(self) -> tuple[bool, dict[str, Any]]:
+        now = time.monotonic()
+        if self._db_checked is None or now - self._db_checked >= HEALTH_DB_CACHE:
+            self._db_result = await self._ping_db()
+            self._db_checked = time.monotonic()
+        ok, checks = self._db_result
+        # readiness() adds its own keys to the dict it gets back
+        return ok, dict(checks)
+
+    async def _ping_db(self) -> tuple[bool, dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(db.ping_db(HEALTH_DB_TIMEOUT), HEALTH_DB_TIMEOUT + 1)
+        except Exception as exc:
+            logger.warning("Readiness: database check failed: %s", exc)
+            return False, {"db": f"{type(exc).__name__}: {exc}"}
+        return True, {"db": "ok", "db_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    async def readiness(self) -> tuple[bool, dict[str, Any]]:
+        now = time.monotonic()
+        ok, checks = await self._check_db()
+        checks["last_update_s"] = _age(self.last_update, now)
+        if self.mode == "polling":
+            # before the first poll, count from startup
+            since_poll = now - (self.last_poll or self.started)
+            checks["last_poll_s"] = round(since_poll, 1)
+            if since_poll > HEALTH_POLL_STALE:
+                ok = False
+        depth = scheduler.stats()["queue_depth"]
+        checks["outbound_queue"] = depth
+        if depth > HEALTH_MAX_OUTBOUND_QUEUE:
+            ok = False
+        return ok, checks
+
+
+health = Health()
+
+
+class PollingWatch(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        result = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            # the chain hands back the decoded result: a list of updates
+            health.mark_poll(len(result or ()))
+        return result
+
+
+def _reply(ok: bool, checks: dict[str, Any]) -> web.Response:
+    return web.json_response(
+        {"status": "ok" if ok else "fail", **checks}, status=200 if ok else 503
+    )
+
+
+async def healthz_view(request: web.Request) -> web.Response:
+    return _reply(*health.liveness())
+
+
+async def readyz_view(request: web.Request) -> web.Response:
+    return _reply(*await health.readiness())
+
+
+def add_routes(app: web.Application) -> None:
+    app.router.add_get("/healthz", healthz_view)
+    app.router.add_get("/readyz", readyz_view)
@@ -0,0 +1,285 @@
+﻿from __future__ import annotations
+
+import asyncio
+import atexit
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sys
+from datetime import date, datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Any, Iterator
+
+from app.config import (
+    LOG_BACKUP_COUNT,
+    LOG_COMPRESS,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_MAX_MB,
+    LOG_PATH,
+)
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(process)d | %(name)s | %(message)s"
+# ((created, level, logger), lines of one record)
+LogEntry = tuple[tuple[datetime, str, str], list[str]]
+_TEXT_HEADER = re.compile(r"^\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d")
+
+# attributes every LogRecord has; anything else came from `extra=`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listeners: list[QueueListener] = []
+_handlers: list[logging.Handler] = []
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "process": record.process,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key not in entry:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    # Keep the traceback out of the message so JSON lines get it as "exc".
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gz_name(name: str) -> str:
+    return name + ".gz"
+
+
+def _gz_rotate(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+# Rolls over when the file reaches max_bytes or the day changes, whichever
+# comes first; bot.log.1 is always the newest finished segment.
+class DailyRotatingFileHandler(RotatingFileHandler):
+    def __init__(
+        self, filename: Path, max_bytes: int, backup_count: int, compress: bool
+    ) -> None:
+        super().__init__(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        if compress:
+            self.namer = _gz_name
+            self.rotator = _gz_rotate
+        try:
+            self._day = date.fromtimestamp(os.path.getmtime(filename))
+        except OSError:
+            self._day = date.today()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if date.today() != self._day and os.path.exists(self.baseFilename):
+            return os.path.getsize(self.baseFilename) > 0
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._day = date.today()
+
+
+def _build_handlers() -> list[logging.Handler]:
+    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    file_handler = DailyRotatingFileHandler(
+        LOG_PATH, int(LOG_MAX_MB * 1024 * 1024), LOG_BACKUP_COUNT, LOG_COMPRESS
+    )
+    stream_handler = logging.StreamHandler(sys.stderr)
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    return [file_handler, stream_handler]
+
+
+def setup_logging(log_queue: Any | None = None) -> None:
+    # Handlers on the event loop thread only enqueue; files are written,
+    # rotated and gzipped by the listener thread. Worker processes pass
+    # the queue from listen_for_workers() and never touch the files.
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if log_queue is None:
+        log_queue = queue.SimpleQueue()
+        _handlers[:] = _build_handlers()
+        _start_listener(log_queue)
+        atexit.register(stop_logging)
+    root.addHandler(_QueueHandler(log_queue))
+
+
+def _start_listener(log_queue: Any) -> None:
+    listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def listen_for_workers() -> Any:
+    import multiprocessing as mp
+
+    log_queue = mp.get_context("spawn").Queue()
+    _start_listener(log_queue)
+    return log_queue
+
+
+def stop_logging() -> None:
+    while _listeners:
+        _listeners.pop().stop()
+    for handler in _handlers:
+        handler.close()
+
+
+def current_segment() -> Path | None:
+    # The live file right after a rollover can be empty; fall back to the
+    # newest finished segment so the admin always gets something.
+    for name in (LOG_PATH.name, LOG_PATH.name + ".1", LOG_PATH.name + ".1.gz"):
+        path = LOG_PATH.with_name(name)
+        if path.exists() and path.stat().st_size > 0:
+            return path
+    return None
+
+
+def log_segments() -> list[Path]:
+    # newest first: bot.log, bot.log.1(.gz), bot.log.2(.gz), ...
+    paths = [LOG_PATH]
+    for index in range(1, LOG_BACKUP_COUNT + 1):
+        for name in (f"{LOG_PATH.name}.{index}", f"{LOG_PATH.name}.{index}.gz"):
+            paths.append(LOG_PATH.with_name(name))
+    return [path for path in paths if path.exists()]
+
+
+def _reverse_lines(path: Path, block_size: int = 64 * 1024) -> Iterator[str]:
+    if path.suffix == ".gz":
+        # finished segments are capped at LOG_MAX_MB, reading one whole is fine
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as fh:
+            yield from reversed(fh.read().splitlines())
+        return
+    with open(path, "rb") as fh:
+        position = fh.seek(0, os.SEEK_END)
+        tail = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            fh.seek(position)
+            lines = (fh.read(step) + tail).split(b"\n")
+            # the first piece may be cut mid-line, finish it with the next block
+            tail = lines.pop(0)
+            for raw in reversed(lines):
+                yield raw.decode("utf-8", "replace").rstrip("\r")
+        if tail:
+            yield tail.decode("utf-8", "replace").rstrip("\r")
+
+
+def _parse_header(line: str) -> tuple[datetime, str, str] | None:
+    try:
+        if line.startswith("{"):
+            entry = json.loads(line)
+            return (
+                datetime.fromisoformat(str(entry["ts"])[:19]),
+                str(entry.get("level", "")),
+                str(entry.get("logger", "")),
+            )
+        if not _TEXT_HEADER.match(line):
+            return None
+        parts = line.split(" | ", 4)
+        if len(parts) < 4:
+            return None
+        return datetime.fromisoformat(parts[0][:19]), parts[1], parts[3]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _reverse_records(path: Path) -> Iterator[LogEntry]:
+    # Traceback lines follow their header line, so collect them until the
+    # header shows up above them.
+    continuation: list[str] = []
+    for line in _reverse_lines(path):
+        if not line:
+            continue
+        header = _parse_header(line)
+        if header is None:
+            continuation.append(line)
+            continue
+        yield header, [line, *reversed(continuation)]
+        continuation = []
+
+
+def _newest_records() -> Iterator[LogEntry]:
+    for path in log_segments():
+        yield from _reverse_records(path)
+
+
+def _level_no(name: str) -> int:
+    value = logging.getLevelName(name.upper())
+    return value if isinstance(value, int) else 0
+
+
+def tail_log(
+    limit: int = 200,
+    level: str | None = None,
+    logger: str | None = None,
+    since: datetime | None = None,
+) -> list[str]:
+    # Last `limit` records at `level` or above, from loggers starting with
+    # `logger`, not older than `since`; oldest first.
+    min_level = _level_no(level) if level else 0
+    picked: list[list[str]] = []
+    for (created, record_level, name), lines in _newest_records():
+        if since is not None and created < since:
+            break
+        if min_level and _level_no(record_level) < min_level:
+            continue
+        if logger and not name.startswith(logger):
+            continue
+        picked.append(lines)
+        if len(picked) >= limit:
+            break
+    return [line for record in reversed(picked) for line in record]
+
+
+def _excerpt(
+    limit: int, level: str | None, logger: str | None, since: datetime | None
+) -> tuple[int, bytes]:
+    lines = tail_log(limit, level, logger, since)
+    if not lines:
+        return 0, b""
+    return len(lines), gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+async def log_excerpt(
+    limit: int = 200,
+    level: str | None = None,
+    logger: str | None = None,
+    since: datetime | None = None,
+) -> tuple[int, bytes]:
+    # scanning and gzip are blocking, keep them off the event loop
+    return await asyncio.to_thread(_excerpt, limit, level, logger, since)
@@ -0,0 +1,199 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import Any
+
+from aiogram import Bot
+
+from app.config import (
+    ADMIN_GROUP_ID,
+    ADMIN_IDS,
+    LOOP_LAG_ALERT_COOLDOWN,
+    LOOP_LAG_ALERT_SECONDS,
+    LOOP_LAG_INTERVAL,
+    LOOP_LAG_THRESHOLD_MS,
+    LOOP_SLOW_CALLBACK_MS,
+)
+from app.services import metrics
+from app.services.outbound import Priority, priority
+
+logger = logging.getLogger(__name__)
+
+LAG_SECONDS = metrics.registry.histogram(
+    "shop_loop_lag_seconds", "How late the event loop woke up a sleeping task."
+)
+LAG_SPIKES = metrics.registry.counter(
+    "shop_loop_lag_spikes_total",
+    "Lag samples over the threshold, by handler running at the time.",
+    ("handler",),
+)
+SLOW_CALLBACKS = metrics.registry.counter(
+    "shop_slow_callbacks_total", "Callbacks asyncio debug mode reported as slow."
+)
+
+
+class _SlowCallbackHandler(logging.Handler):
+    # asyncio debug mode logs "Executing <Task ...> took 0.512 seconds"
+    def __init__(self, monitor: LoopMonitor) -> None:
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if isinstance(record.msg, str) and record.msg.startswith("Executing %s took"):
+            SLOW_CALLBACKS.inc()
+            self.monitor.slow_callbacks.append((time.time(), record.getMessage()))
+
+
+# A task that sleeps `interval` and measures how late it wakes up: anything
+# over a millisecond or so is time some callback held the loop. Handlers
+# that were running or finished during a late tick get the blame.
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = LOOP_LAG_INTERVAL,
+        threshold_ms: float = LOOP_LAG_THRESHOLD_MS,
+        alert_seconds: float = LOOP_LAG_ALERT_SECONDS,
+        alert_cooldown: float = LOOP_LAG_ALERT_COOLDOWN,
+        slow_callback_ms: float = LOOP_SLOW_CALLBACK_MS,
+    ) -> None:
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.alert_seconds = alert_seconds
+        self.alert_cooldown = alert_cooldown
+        self.slow_callback_ms = slow_callback_ms
+        self.max_lag = 0.0
+        self.spikes: deque[tuple[float, float, list[str]]] = deque(maxlen=200)
+        self.slow_callbacks: deque[tuple[float, str]] = deque(maxlen=50)
+        self._window: deque[tuple[float, float]] = deque()
+        self._last_alert = float("-inf")
+        self._last_logged = float("-inf")
+        self._bot: Bot | None = None
+        self._task: asyncio.Task | None = None
+        self._alert_task: asyncio.Task | None = None
+        self._slow_handler: _SlowCallbackHandler | None = None
+
+    def start(self, bot: Bot | None = None) -> None:
+        self._bot = bot
+        if self.slow_callback_ms:
+            loop = asyncio.get_running_loop()
+            loop.slow_callback_duration = self.slow_callback_ms / 1000
+            loop.set_debug(True)
+            self._slow_handler = _SlowCallbackHandler(self)
+            logging.getLogger("asyncio").addHandler(self._slow_handler)
+        self._task = asyncio.create_task(self._run(), name="loop-monitor")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def close(self) -> None:
+        if self._slow_handler is not None:
+            logging.getLogger("asyncio").removeHandler(self._slow_handler)
+            self._slow_handler = None
+        for task in (self._task, self._alert_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._alert_task = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "window_avg_lag_ms": round(self.window_average() * 1000, 1),
+            "spikes": len(self.spikes),
+            "slow_callbacks": len(self.slow_callbacks),
+        }
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.record(max(0.0, now - started - self.interval), started, now)
+
+    def _culprits(self, since: float) -> list[str]:
+        names = set(metrics.active_handlers)
+        names.update(
+            name for finished, name in metrics.finished_handlers if finished >= since
+        )
+        return sorted(names)
+
+    def window_average(self) -> float:
+        if not self._window:
+            return 0.0
+        return sum(lag for _, lag in self._window) / len(self._window)
+
+    def record(self, lag: float, started: float, now: float) -> None:
+        LAG_SECONDS.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        self._window.append((now, lag))
+        while now - self._window[0][0] > self.alert_seconds:
+            self._window.popleft()
+
+        if lag >= self.threshold:
+            culprits = self._culprits(started) or ["unknown"]
+            for name in culprits:
+                LAG_SPIKES.inc(name)
+            self.spikes.append((now, lag, culprits))
+            if now - self._last_logged >= 10:
+                self._last_logged = now
+                logger.warning(
+                    "Event loop blocked for %.0f ms, running: %s",
+                    lag * 1000,
+                    ", ".join(culprits),
+                )
+
+        sustained = now - self._window[0][0] >= self.alert_seconds * 0.9
+        if (
+            sustained
+            and self.window_average() >= self.threshold
+            and now - self._last_alert >= self.alert_cooldown
+            and self._bot is not None
+        ):
+            self._last_alert = now
+            self._alert_task = asyncio.create_task(self._alert(self.alert_text(now)))
+
+    def alert_text(self, now: float) -> str:
+        window = [spike for spike in self.spikes if now - spike[0] <= self.alert_seconds]
+        blamed: Counter[str] = Counter(name for _, _, names in window for name in names)
+        lines = [
+            "Бот тормозит: средняя задержка цикла событий "
+            f"{self.window_average() * 1000:.0f} мс за последние "
+            f"{self.alert_seconds:.0f} с, максимум "
+            f"{max((lag for _, lag, _ in window), default=0) * 1000:.0f} мс.",
+        ]
+        if blamed:
+            lines.append("Во время задержек выполнялись:")
+            lines.extend(f"• {name} — {count}" for name, count in blamed.most_common(5))
+        return "\n".join(lines)
+
+    async def _alert(self, text: str) -> None:
+        targets = [ADMIN_GROUP_ID] if ADMIN_GROUP_ID else list(ADMIN_IDS)
+        with priority(Priority.ADMIN):
+            for chat_id in targets:
+                try:
+                    await self._bot.send_message(chat_id, text)
+                except Exception:
+                    logger.exception("Failed to send loop lag alert to %s", chat_id)
+
+
+loop_monitor = LoopMonitor()
+
+
+@metrics.registry.collector
+def loop_lag_stats() -> list[metrics.Family]:
+    return [
+        (
+            "shop_loop_lag_window_avg_seconds",
+            "gauge",
+            "Average event loop lag over the alert window.",
+            [({}, loop_monitor.window_average())],
+        )
+    ]
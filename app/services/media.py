@@ -0,0 +1,58 @@
+﻿from __future__ import annotations
+
+from functools import lru_cache
+from typing import Iterable, Mapping, Sequence
+
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto, Message
+
+from app.services import memory
+
+MEDIA_GROUP_LIMIT = 10
+
+Album = tuple[tuple[InputMediaPhoto, ...], ...]
+
+
+def chunk_media(
+    media: Sequence[InputMediaPhoto], size: int = MEDIA_GROUP_LIMIT
+) -> Album:
+    return tuple(tuple(media[i : i + size]) for i in range(0, len(media), size))
+
+
+@lru_cache(maxsize=64)
+def _variant_album(entries: tuple[tuple[str, str], ...]) -> Album:
+    media = [
+        InputMediaPhoto(media=photo_id, caption=f"Категория: {name}")
+        for name, photo_id in entries
+    ]
+    return chunk_media(media)
+
+
+def variant_album(variants: Iterable[Mapping], photos: Mapping[str, str]) -> Album:
+    entries = tuple(
+        (str(variant["name"]), photos[variant["name"]])
+        for variant in variants
+        if photos.get(variant["name"])
+    )
+    return _variant_album(entries)
+
+
+memory.track("variant_albums", lambda: _variant_album.cache_info().currsize)
+
+
+async def send_album(
+    bot: Bot, chat_id: int, album: Album, **kwargs
+) -> list[Message]:
+    sent: list[Message] = []
+    for chunk in album:
+        if len(chunk) == 1:
+            # sendMediaGroup needs at least two items
+            item = chunk[0]
+            sent.append(
+                await bot.send_photo(
+                    chat_id, photo=item.media, caption=item.caption, **kwargs
+                )
+            )
+            continue
+        sent.extend(await bot.send_media_group(chat_id, media=list(chunk), **kwargs))
+    return sent
@@ -0,0 +1,144 @@
+﻿from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from app.config import BASE_DIR
+from app.services import metrics
+
+_STDLIB = Path(os.__file__).parent
+_sizes: dict[str, Callable[[], int]] = {}
+
+
+def track(name: str, size: Callable[[], int]) -> None:
+    # Every long-lived in-process cache, queue or table registers here, so
+    # /mem and the metrics endpoint can tell which one is growing.
+    _sizes[name] = size
+
+
+def sizes() -> dict[str, int]:
+    result = {}
+    for name, size in sorted(_sizes.items()):
+        try:
+            result[name] = int(size())
+        except Exception:
+            result[name] = -1
+    return result
+
+
+def rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak, not current; kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _short_path(filename: str) -> str:
+    path = Path(filename)
+    for root in (BASE_DIR, _STDLIB):
+        try:
+            return str(path.relative_to(root))
+        except ValueError:
+            pass
+    parts = path.parts
+    if "site-packages" in parts:
+        return "/".join(parts[parts.index("site-packages") + 1 :])
+    return filename
+
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class MemoryTracker:
+    def __init__(self) -> None:
+        self._baseline: tracemalloc.Snapshot | None = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = self._snapshot()
+
+    def stop(self) -> None:
+        self._baseline = None
+        tracemalloc.stop()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    def _growth(self, limit: int) -> list[tuple[str, int, int]]:
+        snapshot = self._snapshot()
+        if self._baseline is None:
+            self._baseline = snapshot
+        grown = [
+            stat
+            for stat in snapshot.compare_to(self._baseline, "lineno")
+            if stat.size_diff > 0
+        ]
+        grown.sort(key=lambda stat: stat.size_diff, reverse=True)
+        return [
+            (
+                f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                stat.size_diff,
+                stat.count_diff,
+            )
+            for stat in grown[:limit]
+        ]
+
+    def rebase(self) -> None:
+        self._baseline = self._snapshot()
+
+    async def top_growth(self, limit: int = 15) -> list[tuple[str, int, int]]:
+        # snapshots walk every live allocation: seconds on a big heap
+        return await asyncio.to_thread(self._growth, limit)
+
+
+memory_tracker = MemoryTracker()
+
+
+def _metrics_series() -> int:
+    return sum(
+        len(metric.values if isinstance(metric, metrics.Counter) else metric.series)
+        for metric in metrics.registry.metrics
+    )
+
+
+track("metrics_series", _metrics_series)
+
+
+@metrics.registry.collector
+def memory_stats() -> list[metrics.Family]:
+    families: list[metrics.Family] = [
+        (
+            "shop_cache_entries",
+            "gauge",
+            "Entries in in-process caches and queues.",
+            [({"name": name}, value) for name, value in sizes().items()],
+        )
+    ]
+    rss = rss_bytes()
+    if rss is not None:
+        families.append(
+            ("shop_process_rss_bytes", "gauge", "Resident set size.", [({}, rss)])
+        )
+    return families
@@ -0,0 +1,282 @@
+﻿from __future__ import annotations
+
+import bisect
+import functools
+import inspect
+import logging
+import time
+from collections import Counter as Tally, defaultdict, deque
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (name, type, help, [(labels, value), ...])
+Family = tuple[str, str, str, list[tuple[dict[str, str], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: defaultdict[tuple, float] = defaultdict(float)
+
+    def inc(self, *labels: Any, amount: float = 1.0) -> None:
+        self.values[tuple(str(label) for label in labels)] += amount
+
+    def render(self) -> Iterable[str]:
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # per series: bucket counts (last one is +Inf), sum
+        self.series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: Any) -> None:
+        key = tuple(str(label) for label in labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> Iterable[str]:
+        for key, (counts, total) in sorted(self.series.items()):
+            running = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                running += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {running}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(total[0])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {running}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Counter | Histogram] = []
+        self.collectors: list[Callable[[], Any]] = []
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func: Callable[[], Any]) -> Callable[[], Any]:
+        # func returns a list of Family tuples, may be async
+        self.collectors.append(func)
+        return func
+
+    async def collect(self) -> list[Family]:
+        families: list[Family] = []
+        for func in self.collectors:
+            try:
+                result = func()
+                if inspect.isawaitable(result):
+                    result = await result
+                families.extend(result)
+            except Exception:
+                logger.exception("Metrics collector %s failed", func.__name__)
+        return families
+
+    async def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for name, kind, help, samples in await self.collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+UPDATES = registry.counter("shop_updates_total", "Updates processed.", ("type",))
+UPDATE_SECONDS = registry.histogram(
+    "shop_update_duration_seconds", "Time to process one update.", ("type",)
+)
+HANDLER_SECONDS = registry.histogram(
+    "shop_handler_duration_seconds", "Handler run time.", ("router", "handler")
+)
+HANDLER_ERRORS = registry.counter(
+    "shop_handler_errors_total", "Handlers that raised.", ("router", "handler")
+)
+API_SECONDS = registry.histogram(
+    "shop_telegram_request_duration_seconds", "Telegram Bot API call time.", ("method",)
+)
+API_ERRORS = registry.counter(
+    "shop_telegram_errors_total", "Failed Telegram Bot API calls.", ("method", "error")
+)
+DB_SECONDS = registry.histogram(
+    "shop_db_query_duration_seconds", "Time spent in app.db.database calls.", ("query",)
+)
+DB_ERRORS = registry.counter(
+    "shop_db_errors_total", "app.db.database calls that raised.", ("query",)
+)
+
+# What handlers were doing, for blaming event loop stalls (see loop_monitor).
+active_handlers: Tally[str] = Tally()
+finished_handlers: deque[tuple[float, str]] = deque(maxlen=256)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        kind = event.event_type
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATES.inc(kind)
+            UPDATE_SECONDS.observe(time.perf_counter() - started, kind)
+
+
+# Inner middleware: only after filters pass is it known which handler runs.
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        labels = (callback.__module__.rsplit(".", 1)[-1], callback.__name__)
+        name = ".".join(labels)
+        active_handlers[name] += 1
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(*labels)
+            raise
+        finally:
+            finished = time.perf_counter()
+            HANDLER_SECONDS.observe(finished - started, *labels)
+            active_handlers[name] -= 1
+            if not active_handlers[name]:
+                del active_handlers[name]
+            finished_handlers.append((finished, name))
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as exc:
+            API_ERRORS.inc(name, type(exc).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def _timed(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(func.__name__)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, func.__name__)
+
+    return wrapper
+
+
+def instrument_module(module: ModuleType) -> int:
+    # Swap public coroutines for timed wrappers in place; callers use
+    # `db.func(...)`, so they pick the wrappers up without changes.
+    count = 0
+    for name, func in list(vars(module).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+        if func.__module__ != module.__name__ or hasattr(func, "__wrapped__"):
+            continue
+        setattr(module, name, _timed(func))
+        count += 1
+    return count
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(
+        text=await registry.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    from app.services.health import add_routes
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics on http://%s:%s/metrics", host, port)
+    return runner
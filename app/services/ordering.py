@@ -0,0 +1,48 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+# Runs jobs with the same key one after another, in submission order,
+# while jobs for different keys run concurrently.
+class KeyedSerializer:
+    def __init__(self, limit: int = 0) -> None:
+        self._tails: dict[Hashable, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+    def __len__(self) -> int:
+        return len(self._tails)
+
+    def submit(
+        self, key: Hashable, job: Callable[[], Awaitable[Any]]
+    ) -> asyncio.Task:
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(previous, job))
+        self._tails[key] = task
+        task.add_done_callback(lambda done, key=key: self._release(key, done))
+        return task
+
+    def _release(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Job for %s failed", key, exc_info=task.exception())
+
+    async def _run(
+        self, previous: asyncio.Task | None, job: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        if previous is not None:
+            # failures of the previous job are its own business
+            await asyncio.wait({previous})
+        if self._semaphore is None:
+            return await job()
+        async with self._semaphore:
+            return await job()
+
+    async def join(self) -> None:
+        while self._tails:
+            await asyncio.gather(*self._tails.values(), return_exceptions=True)
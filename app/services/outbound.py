@@ -0,0 +1,326 @@
+﻿from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from app.config import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_MAX_RETRIES,
+)
+from app.services import memory
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_METHODS = (
+    "send",
+    "copyMessage",
+    "forwardMessage",
+    "editMessage",
+)
+
+
+class Priority(IntEnum):
+    DELIVERY = 0
+    ADMIN = 1
+    CATALOG = 2
+    BROADCAST = 3
+
+
+_priority: ContextVar[Priority] = ContextVar(
+    "outbound_priority", default=Priority.CATALOG
+)
+
+
+@contextmanager
+def priority(level: Priority) -> Iterator[None]:
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def delay(self, cost: float, now: float) -> float:
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+    def pause(self, seconds: float, now: float) -> None:
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class OutboundScheduler:
+    def __init__(self, global_rate: float, group_rate_per_minute: float) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate_per_minute = group_rate_per_minute
+        self._groups: dict[int, TokenBucket] = {}
+        self._private_paused: dict[int, float] = {}
+        self._waiters: list[tuple[int, int, int | None, int, float, asyncio.Future]] = []
+        # Waiters of saturated chats sit out here, so the heap never needs a
+        # full re-sort; _deferred_ready holds (time the chat frees up, chat_id).
+        self._deferred: dict[int, list[tuple]] = {}
+        self._deferred_ready: list[tuple[float, int]] = []
+        self._seq = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+        self.granted: Counter[str] = Counter()
+        self.wait_seconds: Counter[str] = Counter()
+        self.max_wait: dict[str, float] = {}
+        self.retry_after = 0
+
+    def set_rates(self, global_rate: float, group_rate_per_minute: float) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate_per_minute = group_rate_per_minute
+        self._groups.clear()
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="outbound-scheduler")
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _pending(self) -> Iterator[tuple]:
+        for entry in itertools.chain(self._waiters, *self._deferred.values()):
+            if not entry[5].done():
+                yield entry
+
+    def queue_depth(self) -> int:
+        return sum(1 for _ in self._pending())
+
+    def stats(self) -> dict[str, Any]:
+        depth: Counter[str] = Counter(
+            Priority(entry[0]).name.lower() for entry in self._pending()
+        )
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": dict(depth),
+            "granted": dict(self.granted),
+            "wait_seconds_total": dict(self.wait_seconds),
+            "wait_seconds_max": dict(self.max_wait),
+            "retry_after": self.retry_after,
+        }
+
+    async def acquire(
+        self, chat_id: int | None, cost: int = 1, level: Priority | None = None
+    ) -> None:
+        self._ensure_started()
+        level = _priority.get() if level is None else level
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters,
+            (int(level), next(self._seq), chat_id, cost, time.monotonic(), future),
+        )
+        self._wakeup.set()
+        await future
+
+    def on_retry_after(self, chat_id: int | None, seconds: float) -> None:
+        self.retry_after += 1
+        now = time.monotonic()
+        if chat_id is None:
+            self.global_bucket.pause(seconds, now)
+        elif chat_id < 0:
+            self._group_bucket(chat_id).pause(seconds, now)
+        else:
+            self._private_paused[chat_id] = now + seconds
+
+    def _group_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._groups.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(
+                self.group_rate_per_minute / 60, self.group_rate_per_minute
+            )
+            self._groups[chat_id] = bucket
+        return bucket
+
+    def _chat_delay(self, chat_id: int | None, cost: int, now: float) -> float:
+        if chat_id is None:
+            return 0.0
+        if chat_id < 0:
+            return self._group_bucket(chat_id).delay(cost, now)
+        paused_until = self._private_paused.get(chat_id)
+        if paused_until is None:
+            return 0.0
+        if paused_until <= now:
+            del self._private_paused[chat_id]
+            return 0.0
+        return paused_until - now
+
+    async def _sleep(self, seconds: float) -> None:
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def _grant(self, entry: tuple, now: float) -> None:
+        level, _, chat_id, cost, enqueued, future = entry
+        self.global_bucket.take(cost, now)
+        if chat_id is not None and chat_id < 0:
+            self._group_bucket(chat_id).take(cost, now)
+        name = Priority(level).name.lower()
+        waited = now - enqueued
+        self.granted[name] += 1
+        self.wait_seconds[name] += waited
+        self.max_wait[name] = max(self.max_wait.get(name, 0.0), waited)
+        future.set_result(None)
+
+    def _prune(self, now: float) -> None:
+        for chat_id in [c for c, b in self._groups.items() if b.idle(now)]:
+            del self._groups[chat_id]
+
+    def _defer(self, entry: tuple, delay: float, now: float) -> None:
+        chat_id = entry[2]
+        waiting = self._deferred.get(chat_id)
+        if waiting is None:
+            waiting = self._deferred[chat_id] = []
+            heapq.heappush(self._deferred_ready, (now + delay, chat_id))
+        waiting.append(entry)
+
+    def _release_deferred(self, now: float) -> None:
+        while self._deferred_ready and self._deferred_ready[0][0] <= now:
+            _, chat_id = heapq.heappop(self._deferred_ready)
+            waiting = self._deferred[chat_id]
+            delay = self._chat_delay(chat_id, waiting[0][3], now)
+            if delay > 0:
+                # paused again by a retry_after meanwhile
+                heapq.heappush(self._deferred_ready, (now + delay, chat_id))
+                continue
+            del self._deferred[chat_id]
+            for entry in waiting:
+                heapq.heappush(self._waiters, entry)
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._release_deferred(now)
+            while self._waiters and self._waiters[0][5].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters and not self._deferred:
+                self._prune(now)
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            sleep_for: float | None = None
+            if self._waiters:
+                entry = self._waiters[0]
+                chat_delay = self._chat_delay(entry[2], entry[3], now)
+                if chat_delay > 0:
+                    # this chat is saturated, let other chats go first
+                    self._defer(heapq.heappop(self._waiters), chat_delay, now)
+                    continue
+                global_delay = self.global_bucket.delay(entry[3], now)
+                if global_delay <= 0:
+                    self._grant(heapq.heappop(self._waiters), now)
+                    continue
+                # keep strict priority on the shared global budget
+                sleep_for = global_delay
+            if self._deferred_ready:
+                ready_in = self._deferred_ready[0][0] - now
+                sleep_for = ready_in if sleep_for is None else min(sleep_for, ready_in)
+            await self._sleep(sleep_for)
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    def __init__(
+        self, scheduler: OutboundScheduler, max_retries: int = OUTBOUND_MAX_RETRIES
+    ) -> None:
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        if not name.startswith(THROTTLED_METHODS):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            chat_id = None
+        cost = len(method.media) if name == "sendMediaGroup" else 1
+
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(chat_id, cost)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(
+                    "%s to %s hit flood control, retry in %ss (attempt %s)",
+                    name,
+                    chat_id,
+                    exc.retry_after,
+                    attempt,
+                )
+                self.scheduler.on_retry_after(chat_id, exc.retry_after)
+
+
+scheduler = OutboundScheduler(OUTBOUND_GLOBAL_RATE, OUTBOUND_GROUP_RATE)
+memory.track(
+    "outbound_waiters",
+    lambda: len(scheduler._waiters) + sum(map(len, scheduler._deferred.values())),
+)
+memory.track("outbound_group_buckets", lambda: len(scheduler._groups))
+memory.track("outbound_paused_chats", lambda: len(scheduler._private_paused))
@@ -0,0 +1,143 @@
+﻿from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+
+from app.config import OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_POLL_INTERVAL
+from app.db import database as db
+from app.services.outbound import Priority, priority
+
+logger = logging.getLogger(__name__)
+
+# Retrying these cannot help: the user blocked the bot or the payload is bad.
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+
+def retry_delay(attempts: int) -> int:
+    return min(600, 5 * 2 ** max(0, attempts - 1))
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        interval: float = OUTBOX_POLL_INTERVAL,
+    ) -> None:
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self._bot: Bot | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox-worker")
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.drain_once()
+            except Exception:
+                logger.exception("Outbox drain failed")
+                processed = 0
+            if processed >= self.batch_size:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        rows = await db.get_due_outbox(self.batch_size)
+        groups: dict[str, list] = {}
+        for row in rows:
+            groups.setdefault(row["group_key"], []).append(row)
+        await asyncio.gather(*(self._deliver_group(group) for group in groups.values()))
+        return len(rows)
+
+    async def _deliver_group(self, rows: list) -> None:
+        sent: list[int] = []
+        with priority(Priority.DELIVERY):
+            for row in rows:
+                attempts = int(row["attempts"]) + 1
+                try:
+                    await self._send(row)
+                except PERMANENT_ERRORS as exc:
+                    await db.mark_outbox_sent(sent)
+                    logger.warning(
+                        "Outbox %s failed permanently: %s", row["idempotency_key"], exc
+                    )
+                    await db.mark_outbox_failed(
+                        int(row["id"]), str(row["group_key"]), attempts, str(exc)
+                    )
+                    return
+                except Exception as exc:
+                    await db.mark_outbox_sent(sent)
+                    if attempts >= self.max_attempts:
+                        logger.error(
+                            "Outbox %s gave up after %s attempts: %s",
+                            row["idempotency_key"],
+                            attempts,
+                            exc,
+                        )
+                        await db.mark_outbox_failed(
+                            int(row["id"]), str(row["group_key"]), attempts, str(exc)
+                        )
+                        return
+                    delay = retry_delay(attempts)
+                    logger.warning(
+                        "Outbox %s failed (attempt %s), retry in %ss: %s",
+                        row["idempotency_key"],
+                        attempts,
+                        delay,
+                        exc,
+                    )
+                    await db.reschedule_outbox(
+                        int(row["id"]), str(row["group_key"]), attempts, delay, str(exc)
+                    )
+                    return
+                sent.append(int(row["id"]))
+        await db.mark_outbox_sent(sent)
+
+    async def _send(self, row: Any) -> None:
+        payload = json.loads(row["payload"])
+        markup = payload.get("reply_markup")
+        if markup is not None:
+            markup = InlineKeyboardMarkup.model_validate(markup)
+        chat_id = int(row["chat_id"])
+        if row["kind"] == "photo":
+            await self._bot.send_photo(
+                chat_id,
+                photo=payload["photo"],
+                caption=payload.get("caption"),
+                reply_markup=markup,
+            )
+        else:
+            await self._bot.send_message(chat_id, payload["text"], reply_markup=markup)
+
+
+outbox = OutboxWorker()
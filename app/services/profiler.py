@@ -0,0 +1,105 @@
+﻿from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+
+# Frames the loop sits in while it waits for I/O.
+IDLE_FRAMES = {
+    "selectors:EpollSelector.select",
+    "selectors:KqueueSelector.select",
+    "selectors:PollSelector.select",
+    "selectors:SelectSelector.select",
+    # Python < 3.11 has no co_qualname, only the bare function name
+    "selectors:select",
+}
+
+
+def frame_label(frame: FrameType) -> str:
+    module = frame.f_globals.get("__name__") or frame.f_code.co_filename
+    name = getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+    return f"{module}:{name}"
+
+
+def collapse_stack(frame: FrameType | None) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    if labels and labels[0] in IDLE_FRAMES:
+        return "(idle)"
+    return ";".join(reversed(labels))
+
+
+class ProfileResult:
+    def __init__(self, stacks: Counter[str], seconds: float) -> None:
+        self.stacks = stacks
+        self.seconds = seconds
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    @property
+    def idle(self) -> int:
+        return self.stacks.get("(idle)", 0)
+
+    def collapsed(self) -> bytes:
+        # Brendan Gregg's folded format: "a;b;c count", one stack per line;
+        # flamegraph.pl and speedscope.app read it as is.
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def top_functions(self, limit: int = 10) -> list[tuple[str, int]]:
+        own: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            if stack != "(idle)":
+                own[stack.rsplit(";", 1)[-1]] += count
+        return own.most_common(limit)
+
+    def top_app_frames(self, limit: int = 10) -> list[tuple[str, int]]:
+        # innermost frame of our own code: shows which handler/service was busy
+        busy: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            ours = [label for label in stack.split(";") if label.startswith("app.")]
+            if ours:
+                busy[ours[-1]] += count
+        return busy.most_common(limit)
+
+
+# Samples the event loop thread from a helper thread, so the loop itself
+# does no profiling work; the cost is one sys._current_frames() call per
+# interval while a profile runs, nothing otherwise.
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def _sample(self, thread_id: int, seconds: float) -> Counter[str]:
+        stacks: Counter[str] = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stacks[collapse_stack(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return stacks
+
+    async def profile(self, seconds: float) -> ProfileResult:
+        async with self._lock:
+            thread_id = threading.get_ident()
+            started = time.monotonic()
+            stacks = await asyncio.to_thread(self._sample, thread_id, seconds)
+            return ProfileResult(stacks, time.monotonic() - started)
+
+
+profiler = SamplingProfiler()
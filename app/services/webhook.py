@@ -0,0 +1,115 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from app.config import (
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+    WEBHOOK_URL,
+)
+
+from app.services.health import add_routes, health
+
+logger = logging.getLogger(__name__)
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    def __init__(self, *args: Any, drain_timeout: float, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    async def handle(self, request: web.Request) -> web.Response:
+        health.mark_update()
+        return await super().handle(request)
+
+    async def close(self) -> None:
+        # Updates were acked to Telegram already, finish them before the session goes.
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logger.info("Waiting for %s in-flight updates", len(tasks))
+            _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            if pending:
+                logger.warning("%s updates still running at shutdown", len(pending))
+        await super().close()
+
+
+async def health_view(request: web.Request) -> web.Response:
+    # Old static address: send monitors to the real liveness check.
+    raise web.HTTPPermanentRedirect("/healthz")
+
+
+def build_app(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = WEBHOOK_PATH,
+    secret: str = WEBHOOK_SECRET,
+    drain_timeout: float = WEBHOOK_SHUTDOWN_TIMEOUT,
+    **data: Any,
+) -> web.Application:
+    app = web.Application()
+    DrainingRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret or None,
+        drain_timeout=drain_timeout,
+        **data,
+    ).register(app, path=path)
+    app.router.add_get("/health", health_view)
+    add_routes(app)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str = WEBHOOK_HOST,
+    port: int = WEBHOOK_PORT,
+    path: str = WEBHOOK_PATH,
+    url: str = WEBHOOK_URL,
+    secret: str = WEBHOOK_SECRET,
+    allowed_updates: list[str] | None = None,
+) -> None:
+    app = build_app(dp, bot, path=path, secret=secret)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: Ctrl+C cancels the loop instead, cleanup still runs below.
+            pass
+
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Webhook server listening on %s:%s%s", host, port, path)
+        if url:
+            await bot.set_webhook(
+                url + path,
+                secret_token=secret or None,
+                allowed_updates=(
+                    dp.resolve_used_update_types()
+                    if allowed_updates is None
+                    else allowed_updates
+                ),
+            )
+            logger.info("Webhook registered at %s%s", url, path)
+        else:
+            logger.warning("WEBHOOK_URL is empty, webhook is not registered with Telegram")
+        await stop.wait()
+    finally:
+        logger.info("Shutting down webhook server")
+        await runner.cleanup()
@@ -1,40 +1,91 @@
 ﻿from __future__ import annotations
 
 import asyncio
-import logging
+from functools import partial
 
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-
-from app.config import BOT_TOKEN, LOG_PATH
+from app.bot import create_bot, create_dispatcher, used_update_types
+from app.config import (
+    BOT_MODE,
+    BOT_TOKEN,
+    METRICS_HOST,
+    METRICS_PORT,
+    SKIP_PENDING_UPDATES,
+    TRACEMALLOC_FRAMES,
+    WORKERS,
+)
 from app.db.database import init_db
-from app.handlers import admin, user
+from app.services.backlog import drain_backlog
+from app.services.broadcast import broadcaster
+from app.services import metrics
+from app.services.cluster import Cluster
+from app.services.health import health
+from app.services.logs import listen_for_workers, setup_logging
+from app.services.loop_monitor import loop_monitor
+from app.services.memory import memory_tracker
+from app.services.outbound import scheduler
+from app.services.outbox import outbox
+from app.services.webhook import run_webhook
 
 
 async def main() -> None:
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN is missing in .env")
 
-    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        handlers=[
-            logging.FileHandler(LOG_PATH, encoding="utf-8"),
-            logging.StreamHandler(),
-        ],
-    )
-
+    setup_logging()
+    if TRACEMALLOC_FRAMES:
+        memory_tracker.start(TRACEMALLOC_FRAMES)
     await init_db()
 
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    bot = create_bot()
+    cluster = None
+    if WORKERS > 1:
+        cluster = Cluster(
+            WORKERS, initializer=partial(setup_logging, listen_for_workers())
+        )
+        cluster.start()
+        await cluster.wait_ready()
+        dp = cluster.receiver()
 
-    dp.include_router(user.router)
-    dp.include_router(admin.router)
+        @metrics.registry.collector
+        def cluster_stats() -> list[metrics.Family]:
+            stats = cluster.stats()
+            return [
+                (
+                    f"shop_cluster_{name}_total",
+                    "counter",
+                    f"Updates {name} per worker.",
+                    [({"worker": str(idx)}, value) for idx, value in enumerate(values)],
+                )
+                for name, values in stats.items()
+            ]
+    else:
+        dp = create_dispatcher()
+    allowed_updates = used_update_types()
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    health.mode = BOT_MODE
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+    loop_monitor.start(bot)
+    outbox.start(bot)
+    broadcaster.start(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot, allowed_updates=allowed_updates)
+        else:
+            await bot.delete_webhook(drop_pending_updates=SKIP_PENDING_UPDATES)
+            if not SKIP_PENDING_UPDATES:
+                await drain_backlog(bot, dp, allowed_updates)
+            await dp.start_polling(bot, allowed_updates=allowed_updates)
+    finally:
+        if cluster is not None:
+            await cluster.stop()
+        await broadcaster.close()
+        await outbox.close()
+        await loop_monitor.close()
+        await scheduler.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from harness import catalog_updates, make_bot, use_db
+
+
+def bench_bot():
+    # Runs inside each worker process.
+    return make_bot(latency=float(os.environ.get("BENCH_LATENCY_MS", "0")) / 1000)
+
+
+async def run(workers: int, updates: list[dict]) -> dict[str, float]:
+    from app.services.cluster import Cluster
+
+    cluster = Cluster(workers, bot_factory=bench_bot)
+    cluster.start()
+    await cluster.wait_ready()
+
+    started = time.perf_counter()
+    for raw in updates:
+        cluster.dispatch(raw)
+    while sum(cluster.processed) < len(updates):
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+
+    stats = cluster.stats()
+    await cluster.stop()
+    return {
+        "elapsed": elapsed,
+        "rps": len(updates) / elapsed,
+        "spread": max(stats["processed"]) / max(1, min(stats["processed"])),
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure update throughput with 1..N worker processes."
+    )
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    use_db(Path(tmp.name) / "bench.db")
+    os.environ["BENCH_LATENCY_MS"] = str(args.latency_ms)
+
+    from app.config import BTN
+    from app.db import database as db
+
+    await db.init_db()
+    cities = await db.get_cities()
+    updates = catalog_updates(int(cities[0]["id"]), args.users, args.updates, BTN.CATALOG)
+
+    print(
+        f"updates={len(updates)} users={args.users} cpu cores={os.cpu_count()} "
+        f"simulated latency={args.latency_ms:.0f}ms"
+    )
+    print(f"{'workers':>7} {'seconds':>8} {'upd/s':>8} {'speedup':>8} {'max/min shard':>14}")
+    baseline = None
+    for workers in [int(n) for n in args.workers.split(",")]:
+        row = await run(workers, updates)
+        baseline = baseline or row["rps"]
+        print(
+            f"{workers:>7} {row['elapsed']:>8.2f} {row['rps']:>8.1f} "
+            f"{row['rps'] / baseline:>7.2f}x {row['spread']:>14.2f}"
+        )
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
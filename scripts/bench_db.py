@@ -0,0 +1,415 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from harness import BASE_DIR, percentile, use_db
+
+SCRIPTS = Path(__file__).resolve().parent
+BENCH_USER = 9_000_000_000
+
+
+def summarize(timings: list[float], **extra: Any) -> dict[str, Any]:
+    total = sum(timings)
+    return {
+        "n": len(timings),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "ops": round(len(timings) / total, 1) if total else 0.0,
+        **extra,
+    }
+
+
+async def repeat(
+    call: Callable[[int], Awaitable[Any]], rounds: int, budget: float
+) -> list[float]:
+    # Slow queries on big databases stop at the time budget, but run at least 3 times.
+    timings: list[float] = []
+    deadline = time.perf_counter() + budget
+    for i in range(rounds):
+        started = time.perf_counter()
+        await call(i)
+        timings.append(time.perf_counter() - started)
+        if i >= 2 and started > deadline:
+            break
+    return timings
+
+
+def sample_inputs(path: Path, count: int, stock: int, seed: int) -> dict[str, list]:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0]
+    # Random products give popular filter combinations more often, as real traffic does.
+    combos = []
+    for _ in range(count * 4):
+        row = conn.execute(
+            "SELECT city_id, area_id, variant, class FROM products WHERE id = ?",
+            (rng.randint(1, max(1, max_id)),),
+        ).fetchone()
+        if row:
+            combos.append(row)
+        if len(combos) >= count:
+            break
+    in_stock = [
+        row[0]
+        for row in conn.execute(
+            """
+            SELECT id FROM products
+            WHERE is_active = 1 AND COALESCE(stock, 0) >= 1
+            ORDER BY random() LIMIT ?
+            """,
+            (stock,),
+        )
+    ]
+    heavy = [
+        row[0]
+        for row in conn.execute(
+            """
+            SELECT user_id FROM orders WHERE status = 'paid'
+            GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT ?
+            """,
+            (max(1, count // 10),),
+        )
+    ]
+    buyers = [
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT user_id FROM orders ORDER BY random() LIMIT ?", (count,)
+        )
+    ]
+    pending = [
+        row[0]
+        for row in conn.execute(
+            "SELECT id FROM payments WHERE status = 'pending' ORDER BY random() LIMIT ?",
+            (count,),
+        )
+    ]
+    rows = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("products", "users", "orders", "payments")
+    }
+    conn.close()
+    return {
+        "combos": combos or [(1, 1, "", "")],
+        "in_stock": in_stock,
+        "users": heavy + buyers or [BENCH_USER],
+        "pending": pending or [0],
+        "rows": rows,
+    }
+
+
+async def checkout_storm(
+    users: list[int], products: list[int]
+) -> dict[str, Any]:
+    from app.db import database as db
+
+    for user_id, product_id in zip(users, products):
+        await db.add_to_cart(user_id, product_id)
+
+    outcomes = {"ok": 0, "out_of_stock": 0, "failed": 0}
+    timings: list[float] = []
+
+    async def checkout(user_id: int) -> None:
+        started = time.perf_counter()
+        try:
+            result = await db.create_order_from_cart(
+                user_id=user_id, payment_photo_id="bench"
+            )
+        except Exception:
+            # "database is locked" once writers wait longer than the busy timeout
+            outcomes["failed"] += 1
+        else:
+            outcomes["out_of_stock" if result and "error" in result else "ok"] += 1
+        timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(checkout(user_id) for user_id in users))
+    wall = time.perf_counter() - started
+    return summarize(timings, wall_ms=round(wall * 1000, 1), **outcomes)
+
+
+async def run_suite(path: Path, args: argparse.Namespace) -> dict[str, Any]:
+    from app.db import database as db
+
+    # cart, checkout, both storms: every add needs its own unsold product
+    inputs = sample_inputs(
+        path, args.rounds, 2 * args.rounds + args.concurrency + 1, args.seed
+    )
+    combos, users, pending = inputs["combos"], inputs["users"], inputs["pending"]
+    stock = iter(inputs["in_stock"])
+    budget = args.budget
+    results: dict[str, Any] = {}
+
+    async def filtered(i: int) -> None:
+        city_id, area_id, variant, class_name = combos[i % len(combos)]
+        await db.get_products_filtered(
+            city_id=city_id, area_id=area_id, variant=variant, class_name=class_name
+        )
+
+    results["get_products_filtered"] = summarize(
+        await repeat(filtered, args.rounds, budget)
+    )
+
+    cart_products = [next(stock, 0) for _ in range(args.rounds)]
+    results["add_to_cart"] = summarize(
+        await repeat(
+            lambda i: db.add_to_cart(BENCH_USER + i, cart_products[i]),
+            args.rounds,
+            budget,
+        )
+    )
+    for i in range(args.rounds):
+        await db.clear_cart(BENCH_USER + i)
+
+    # The cart is filled outside the timed call, only the checkout transaction counts.
+    checkout_timings: list[float] = []
+    for i in range(args.rounds):
+        user_id = BENCH_USER + args.rounds + i
+        await db.add_to_cart(user_id, next(stock, 0))
+        started = time.perf_counter()
+        await db.create_order_from_cart(user_id=user_id, payment_photo_id="bench")
+        checkout_timings.append(time.perf_counter() - started)
+        if i >= 2 and sum(checkout_timings) > budget:
+            break
+    results["create_order_from_cart"] = summarize(checkout_timings)
+
+    results["get_stats"] = summarize(
+        await repeat(lambda i: db.get_stats(), args.rounds, budget)
+    )
+    results["get_sales_report"] = summarize(
+        await repeat(lambda i: db.get_sales_report("", "area"), args.rounds, budget)
+    )
+    results["get_payments_report"] = summarize(
+        await repeat(lambda i: db.get_payments_report(), args.rounds, budget)
+    )
+    results["list_pending_payments_page"] = summarize(
+        await repeat(lambda i: db.list_pending_payments_page(), args.rounds, budget)
+    )
+    results["list_pending_payments_page_deep"] = summarize(
+        await repeat(
+            lambda i: db.list_pending_payments_page(after_id=pending[i % len(pending)]),
+            args.rounds,
+            budget,
+        )
+    )
+    results["get_user_purchase_history"] = summarize(
+        await repeat(
+            lambda i: db.get_user_purchase_history(users[i % len(users)]),
+            args.rounds,
+            budget,
+        )
+    )
+
+    base = BENCH_USER + 10 * args.rounds
+    crowd = [base + i for i in range(args.concurrency)]
+    distinct = [next(stock, 0) for _ in crowd]
+    results["checkout_distinct"] = await checkout_storm(crowd, distinct)
+    crowd = [base + args.concurrency + i for i in range(args.concurrency)]
+    hot = next(stock, 0)
+    results["checkout_hot_product"] = await checkout_storm(crowd, [hot] * len(crowd))
+    return {"rows": inputs["rows"], "benchmarks": results}
+
+
+def run_one(source: Path, args: argparse.Namespace) -> dict[str, Any]:
+    # Writes go to a copy, the source database stays reusable.
+    tmp = tempfile.TemporaryDirectory()
+    work = Path(tmp.name) / "bench.db"
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(work)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    use_db(work)
+    try:
+        return asyncio.run(run_suite(work, args))
+    finally:
+        tmp.cleanup()
+
+
+def ensure_db(preset: str, args: argparse.Namespace) -> Path:
+    path = args.cache / f"{preset}-seed{args.seed}-{args.until}.db"
+    if not path.exists():
+        print(f"generating {path.name} ...", flush=True)
+        subprocess.run(
+            [
+                sys.executable, str(SCRIPTS / "gen_shop_db.py"), "--out", str(path),
+                "--preset", preset, "--seed", str(args.seed), "--until", args.until,
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+    return path
+
+
+def run_size(path: Path, args: argparse.Namespace) -> dict[str, Any]:
+    # app.config reads DB_PATH once per process, so every run is its own child.
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "result.json"
+        for _ in range(args.repeat):
+            subprocess.run(
+                [
+                    sys.executable, __file__, "--db", str(path), "--result", str(out),
+                    "--rounds", str(args.rounds), "--concurrency", str(args.concurrency),
+                    "--budget", str(args.budget), "--seed", str(args.seed),
+                ],
+                check=True,
+            )
+            runs.append(json.loads(out.read_text(encoding="utf-8")))
+    return median_run(runs)
+
+
+def median_run(runs: list[dict[str, Any]]) -> dict[str, Any]:
+    # A single run swings by tens of percent; the median of a few is stable.
+    benchmarks = {}
+    for name, first in runs[0]["benchmarks"].items():
+        benchmarks[name] = {
+            key: statistics.median(run["benchmarks"][name][key] for run in runs)
+            for key in first
+        }
+    return {"rows": runs[0]["rows"], "repeat": len(runs), "benchmarks": benchmarks}
+
+
+def print_results(label: str, result: dict[str, Any]) -> None:
+    rows = ", ".join(f"{table}={count:,}" for table, count in result["rows"].items())
+    print(f"\n[{label}] {rows}")
+    print(f"{'benchmark':<32} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9}  notes")
+    for name, stats in result["benchmarks"].items():
+        notes = ""
+        if "wall_ms" in stats:
+            notes = (
+                f"wall {stats['wall_ms']} ms, ok={stats['ok']} "
+                f"out_of_stock={stats['out_of_stock']} failed={stats['failed']}"
+            )
+        print(
+            f"{name:<32} {stats['n']:>5} {stats['p50_ms']:>9.2f} "
+            f"{stats['p95_ms']:>9.2f} {stats['ops']:>9.0f}  {notes}"
+        )
+
+
+def compare(
+    current: dict[str, Any],
+    baseline: dict[str, Any],
+    threshold: float,
+    min_ms: float,
+) -> list[str]:
+    regressions = []
+    print(f"\nagainst baseline from {baseline.get('created', '?')}, threshold {threshold:g}%")
+    for label, result in current["sizes"].items():
+        old = baseline.get("sizes", {}).get(label)
+        if not old:
+            print(f"[{label}] not in baseline, skipped")
+            continue
+        for name, stats in result["benchmarks"].items():
+            before = old["benchmarks"].get(name)
+            if not before:
+                continue
+            # Storm latencies follow SQLite's busy-wait back-off and swing 2-3x
+            # between identical runs; only their outcomes are compared.
+            timed = ("p50_ms", "p95_ms") if "wall_ms" not in stats else ()
+            for key in timed:
+                if not before[key]:
+                    continue
+                change = (stats[key] / before[key] - 1) * 100
+                # sub-millisecond jitter is not a regression
+                if change > threshold and stats[key] - before[key] >= min_ms:
+                    line = (
+                        f"[{label}] {name} {key}: {before[key]:.2f} -> "
+                        f"{stats[key]:.2f} (+{change:.0f}%)"
+                    )
+                    regressions.append(line)
+                    print("REGRESSION " + line)
+            if before.get("failed", 0) < stats.get("failed", 0):
+                line = f"[{label}] {name} failed: {before['failed']} -> {stats['failed']}"
+                regressions.append(line)
+                print("REGRESSION " + line)
+            if before.get("ok", 0) > stats.get("ok", 0):
+                line = f"[{label}] {name} ok: {before['ok']} -> {stats['ok']}"
+                regressions.append(line)
+                print("REGRESSION " + line)
+    if not regressions:
+        print("no regressions")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark database.py queries on generated shop databases."
+    )
+    parser.add_argument(
+        "--sizes", default="small,medium", help="gen_shop_db.py presets, comma separated"
+    )
+    parser.add_argument("--db", type=Path, help="benchmark this database file instead")
+    parser.add_argument("--cache", type=Path, default=BASE_DIR / "data" / "bench")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--until", default="2026-01-31", help="passed to gen_shop_db.py, keeps data identical"
+    )
+    parser.add_argument("--rounds", type=int, default=200, help="calls per benchmark")
+    parser.add_argument("--budget", type=float, default=5.0, help="seconds per benchmark")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per size, the median is reported"
+    )
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent checkouts")
+    parser.add_argument("--save", type=Path, help="write results as a JSON baseline")
+    parser.add_argument("--compare", type=Path, help="baseline JSON to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=50.0, help="allowed slowdown, percent"
+    )
+    parser.add_argument(
+        "--min-ms", type=float, default=2.0, help="ignore slowdowns smaller than this"
+    )
+    parser.add_argument("--result", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.result:
+        args.result.write_text(json.dumps(run_one(args.db, args)), encoding="utf-8")
+        return 0
+
+    current: dict[str, Any] = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seed": args.seed,
+        "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "sizes": {},
+    }
+    if args.db:
+        targets = {args.db.stem: args.db}
+    else:
+        args.cache.mkdir(parents=True, exist_ok=True)
+        targets = {
+            preset: ensure_db(preset, args)
+            for preset in filter(None, (s.strip() for s in args.sizes.split(",")))
+        }
+    for label, path in targets.items():
+        result = run_size(path, args)
+        current["sizes"][label] = result
+        print_results(label, result)
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(
+            json.dumps(current, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        print(f"\nsaved {args.save}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        if compare(current, baseline, args.threshold, args.min_ms):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from harness import BOT_ID, percentile, use_db
+
+STEPS = ["photo", "city", "area", "variant", "class", "title", "description", "price"]
+
+
+async def wizard_steps(storage, users: int, rounds: int) -> list[float]:
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+
+    timings: list[float] = []
+    for _ in range(rounds):
+        for user_id in range(1, users + 1):
+            ctx = FSMContext(
+                storage, StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+            )
+            for step in STEPS:
+                # What one wizard update does: read state and data, store a field, advance.
+                started = time.perf_counter()
+                await ctx.get_state()
+                await ctx.get_data()
+                await ctx.update_data({step: f"value-{user_id}"})
+                await ctx.set_state(f"AdminStates:{step}")
+                timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def survivors(storage, users: int) -> int:
+    from aiogram.fsm.storage.base import StorageKey
+
+    count = 0
+    for user_id in range(1, users + 1):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        if await storage.get_state(key):
+            count += 1
+    return count
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare FSM storage overhead.")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    use_db(Path(tmp.name) / "bench.db")
+
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from app.db import database as db
+    from app.services.fsm_storage import SQLiteStorage
+
+    await db.init_db()
+
+    results = {}
+    memory = MemoryStorage()
+    results["memory"] = await wizard_steps(memory, args.users, args.rounds)
+    await memory.close()
+
+    sqlite = SQLiteStorage()
+    results["sqlite"] = await wizard_steps(sqlite, args.users, args.rounds)
+    await sqlite.close()
+    stats = sqlite.stats()
+
+    # A fresh instance behaves like the bot after a restart: every key is a cold read.
+    restarted = SQLiteStorage()
+    started = time.perf_counter()
+    restored = await survivors(restarted, args.users)
+    cold_ms = (time.perf_counter() - started) * 1000
+    await restarted.close()
+
+    steps = args.users * args.rounds * len(STEPS)
+    print(f"users={args.users} rounds={args.rounds} wizard steps={steps}")
+    print(f"{'storage':<8} {'mean us':>8} {'p95 us':>8} {'p99 us':>8} {'steps/s':>10}")
+    for name, timings in results.items():
+        total = sum(timings)
+        print(
+            f"{name:<8} {total / len(timings) * 1e6:>8.1f} "
+            f"{percentile(timings, 95) * 1e6:>8.1f} {percentile(timings, 99) * 1e6:>8.1f} "
+            f"{len(timings) / total:>10.0f}"
+        )
+    print(
+        f"sqlite flushes={stats['flushes']} keys written={stats['flushed_keys']} "
+        f"db loads={stats['loads']}"
+    )
+    print(
+        f"after restart: {restored}/{args.users} states restored, "
+        f"cold read {cold_ms / max(1, args.users):.2f} ms/key"
+    )
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
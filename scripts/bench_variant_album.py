@@ -0,0 +1,117 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from harness import UpdateFactory, make_bot, percentile, use_db
+
+
+def build_legacy_router():
+    from aiogram import F, Router
+    from aiogram.types import CallbackQuery
+
+    from app.db import database as db
+    from app.handlers.user import variants_kb
+
+    router = Router()
+
+    # Previous behaviour of pick_area: one sendPhoto per variant.
+    @router.callback_query(F.data.startswith("area:"))
+    async def legacy_pick_area(callback: CallbackQuery) -> None:
+        area_id = int(callback.data.split(":", 1)[1])
+        await db.set_user_area(callback.from_user.id, area_id)
+        photos = await db.get_variant_photos()
+        variants = await db.get_variants()
+        for variant in variants:
+            photo_id = photos.get(variant["name"])
+            if photo_id:
+                await callback.message.answer_photo(
+                    photo_id, caption=f"Категория: {variant['name']}"
+                )
+        await callback.message.answer(
+            "Выберите вариант:", reply_markup=variants_kb(variants)
+        )
+        await callback.answer()
+
+    return router
+
+
+async def run_mode(router, taps: int, latency: float) -> dict[str, float]:
+    from aiogram import Dispatcher
+
+    from app.db import database as db
+
+    bot = make_bot(latency=latency)
+    dp = Dispatcher()
+    dp.include_router(router)
+    factory = UpdateFactory()
+    user_id = 1001
+    await db.upsert_user(user_id, "bench", "Bench")
+    cities = await db.get_cities()
+    areas = await db.get_areas_by_city(int(cities[0]["id"]))
+    area_id = int(areas[0]["id"])
+
+    timings: list[float] = []
+    for _ in range(taps):
+        update = factory.callback(user_id, f"area:{area_id}")
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        timings.append(time.perf_counter() - started)
+
+    calls = bot.session.calls
+    return {
+        "calls_per_tap": bot.session.total_calls / taps,
+        "send_photo": calls["sendPhoto"] / taps,
+        "send_media_group": calls["sendMediaGroup"] / taps,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "p95_ms": percentile(timings, 95) * 1000,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare per-photo and media-group variant menus."
+    )
+    parser.add_argument("--variants", type=int, default=12)
+    parser.add_argument("--taps", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    use_db(Path(tmp.name) / "bench.db")
+
+    from app.db import database as db
+    from app.handlers import user
+
+    await db.init_db()
+    existing = {row["name"] for row in await db.get_variants()}
+    for idx in range(args.variants - len(existing)):
+        await db.add_variant(f"Bench {idx + 1}", sort_order=100 + idx)
+    for row in await db.get_variants():
+        await db.set_variant_photo(row["name"], f"photo-{row['name']}")
+
+    latency = args.latency_ms / 1000
+    results = {
+        "per-photo": await run_mode(build_legacy_router(), args.taps, latency),
+        "media-group": await run_mode(user.router, args.taps, latency),
+    }
+
+    print(
+        f"variants={args.variants} taps={args.taps} "
+        f"simulated latency={args.latency_ms:.0f}ms"
+    )
+    print(f"{'mode':<12} {'calls/tap':>9} {'photo':>6} {'album':>6} {'mean ms':>8} {'p95 ms':>8}")
+    for mode, row in results.items():
+        print(
+            f"{mode:<12} {row['calls_per_tap']:>9.1f} {row['send_photo']:>6.1f} "
+            f"{row['send_media_group']:>6.1f} {row['mean_ms']:>8.1f} {row['p95_ms']:>8.1f}"
+        )
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,177 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from harness import catalog_updates, make_bot, percentile, use_db
+
+SECRET = "bench-secret"
+PATH = "/webhook"
+
+
+async def recorded_updates(path: str | None, users: int, count: int) -> list[dict[str, Any]]:
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            return [json.loads(line) for line in fh if line.strip()][:count]
+
+    from app.config import BTN
+    from app.db import database as db
+
+    cities = await db.get_cities()
+    return catalog_updates(int(cities[0]["id"]), users, count, BTN.CATALOG)
+
+
+def with_fresh_ids(updates: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # The idempotency middleware drops update and callback ids it has seen,
+    # so the second mode needs ids the first one did not use.
+    offset = max(int(raw["update_id"]) for raw in updates)
+    fresh = []
+    for raw in updates:
+        raw = {**raw, "update_id": int(raw["update_id"]) + offset}
+        if "callback_query" in raw:
+            query = raw["callback_query"]
+            raw["callback_query"] = {**query, "id": f"{query['id']}-{offset}"}
+        fresh.append(raw)
+    return fresh
+
+
+class Done:
+    def __init__(self) -> None:
+        self.target = 0
+        self.count = 0
+        self.event = asyncio.Event()
+
+    def reset(self, target: int) -> None:
+        self.target = target
+        self.count = 0
+        self.event.clear()
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            self.count += 1
+            if self.count >= self.target:
+                self.event.set()
+
+
+async def run_polling(
+    dp, done: Done, updates: list[dict[str, Any]], latency: float
+) -> dict[str, float]:
+    bot = make_bot(latency=latency)
+    bot.session.pending_updates = list(updates)
+    done.reset(len(updates))
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    await done.event.wait()
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    return {"elapsed": elapsed, "rps": len(updates) / elapsed}
+
+
+async def run_webhook(
+    dp, done: Done, updates: list[dict[str, Any]], latency: float, concurrency: int
+) -> dict[str, float]:
+    from aiohttp import ClientSession, web
+
+    from app.services.webhook import build_app
+
+    bot = make_bot(latency=latency)
+    app = build_app(dp, bot, path=PATH, secret=SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}{PATH}"
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for raw in updates:
+        queue.put_nowait(raw)
+    acks: list[float] = []
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async with ClientSession() as http:
+        async with http.post(url, json={}, headers={}) as resp:
+            assert resp.status == 401, "secret token is not enforced"
+
+        async def client() -> None:
+            while not queue.empty():
+                raw = queue.get_nowait()
+                sent = time.perf_counter()
+                async with http.post(url, json=raw, headers=headers) as resp:
+                    await resp.read()
+                acks.append(time.perf_counter() - sent)
+
+        done.reset(len(updates))
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        await done.event.wait()
+        elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    return {
+        "elapsed": elapsed,
+        "rps": len(updates) / elapsed,
+        "ack_p50_ms": percentile(acks, 50) * 1000,
+        "ack_p95_ms": percentile(acks, 95) * 1000,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded updates through webhook and polling."
+    )
+    parser.add_argument("--updates", type=int, default=600)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--recorded", help="JSONL file with raw Update objects")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    use_db(Path(tmp.name) / "bench.db")
+    # Simulated users re-tap the same button within milliseconds; a human
+    # cannot, so the double-tap filter would only eat the benchmark load.
+    os.environ.setdefault("IDEMPOTENCY_TAP_WINDOW", "0")
+
+    from app.db import database as db
+    from app.bot import create_dispatcher
+
+    await db.init_db()
+    updates = await recorded_updates(args.recorded, args.users, args.updates)
+
+    # The outbound scheduler is left out: it would cap both modes at the flood limit.
+    dp = create_dispatcher()
+    done = Done()
+    dp.update.outer_middleware(done)
+
+    latency = args.latency_ms / 1000
+    results = {
+        "webhook": await run_webhook(dp, done, updates, latency, args.concurrency),
+        "polling": await run_polling(dp, done, with_fresh_ids(updates), latency),
+    }
+
+    print(
+        f"updates={len(updates)} users={args.users} concurrency={args.concurrency} "
+        f"simulated latency={args.latency_ms:.0f}ms"
+    )
+    print(f"{'mode':<8} {'seconds':>8} {'upd/s':>8} {'ack p50':>8} {'ack p95':>8}")
+    for mode, row in results.items():
+        # polling has no per-update ack
+        p50 = f"{row['ack_p50_ms']:.1f}" if "ack_p50_ms" in row else "-"
+        p95 = f"{row['ack_p95_ms']:.1f}" if "ack_p95_ms" in row else "-"
+        print(f"{mode:<8} {row['elapsed']:>8.2f} {row['rps']:>8.1f} {p50:>8} {p95:>8}")
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
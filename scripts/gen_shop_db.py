@@ -0,0 +1,440 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import math
+import random
+import sqlite3
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from harness import use_db
+
+# Roughly 10k, 1M and 10M rows in total (order_items included).
+PRESETS: dict[str, dict[str, int]] = {
+    "small": {
+        "cities": 10, "areas": 60, "variants": 6, "classes": 30,
+        "products": 3_000, "users": 2_000, "orders": 2_000, "payments": 2_000,
+        "reviews": 400, "support_threads": 200,
+    },
+    "medium": {
+        "cities": 50, "areas": 500, "variants": 12, "classes": 120,
+        "products": 300_000, "users": 150_000, "orders": 200_000, "payments": 200_000,
+        "reviews": 40_000, "support_threads": 20_000,
+    },
+    "large": {
+        "cities": 200, "areas": 3_000, "variants": 20, "classes": 400,
+        "products": 3_000_000, "users": 1_500_000, "orders": 2_000_000,
+        "payments": 2_000_000, "reviews": 400_000, "support_threads": 200_000,
+    },
+}
+
+FIRST_NAMES = ["Алексей", "Мария", "Иван", "Анна", "Дмитрий", "Ольга", "Сергей"]
+REVIEW_TEXTS = [
+    "Всё отлично, спасибо!",
+    "Быстро и без проблем.",
+    "Товар соответствует описанию.",
+    "Долго ждал подтверждения, но всё пришло.",
+    "Рекомендую.",
+]
+ADMIN_GROUP_ID = -1001234567890
+FIRST_USER_ID = 1_000_000
+
+
+class Zipf:
+    # P(k) ~ 1 / (k + 1) ** skew: a few hot cities, popular classes, heavy buyers
+    def __init__(self, size: int, skew: float, rng: random.Random) -> None:
+        weights = [1 / (k + 1) ** skew for k in range(size)]
+        self.cum = list(itertools.accumulate(weights))
+        self.total = self.cum[-1]
+        self.rng = rng
+
+    def __call__(self) -> int:
+        return bisect_left(self.cum, self.rng.random() * self.total)
+
+
+def permutation(size: int, rng: random.Random) -> Iterator[int]:
+    # (a * i + b) mod size with gcd(a, size) == 1 visits every index once,
+    # in scrambled order, without a list of `size` ints in memory
+    step = rng.randrange(1, size) if size > 1 else 1
+    while math.gcd(step, size) != 1:
+        step += 1
+    offset = rng.randrange(size)
+    for index in range(size):
+        yield (step * index + offset) % size
+
+
+def timestamp(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def batches(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class Generator:
+    def __init__(
+        self, conn: sqlite3.Connection, sizes: dict[str, int], args: Any
+    ) -> None:
+        self.conn = conn
+        self.sizes = sizes
+        self.batch = args.batch
+        self.rng = random.Random(args.seed)
+        self.until = datetime.combine(args.until, datetime.min.time())
+        self.days = args.days
+        self.counts: dict[str, int] = {}
+        self.area_ids: list[list[int]] = []
+        self.classes: list[tuple[str, str]] = []
+        self.prices = array("i")
+        self.paid_orders = array("i")
+        self.order_users = array("q")
+        self.purchases = array("i", bytes(4 * sizes["users"]))
+
+    def insert(self, table: str, columns: str, rows: Iterable[tuple]) -> None:
+        marks = ", ".join("?" for _ in columns.split(","))
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({marks})"
+        total = 0
+        for chunk in batches(rows, self.batch):
+            self.conn.executemany(sql, chunk)
+            total += len(chunk)
+        self.conn.commit()
+        self.counts[table] = self.counts.get(table, 0) + total
+
+    def moment(self) -> datetime:
+        # more activity in recent days: the shop is growing
+        back = self.days * (1 - math.sqrt(self.rng.random()))
+        return self.until - timedelta(days=back)
+
+    def catalog(self) -> None:
+        sizes = self.sizes
+        self.insert(
+            "cities",
+            "id, name",
+            ((i + 1, f"Город {i + 1}") for i in range(sizes["cities"])),
+        )
+        city_pick = Zipf(sizes["cities"], 1.1, self.rng)
+        areas = []
+        self.area_ids = [[] for _ in range(sizes["cities"])]
+        for area_id in range(1, sizes["areas"] + 1):
+            # every city gets one area, the rest go mostly to hot cities
+            city = area_id - 1 if area_id <= sizes["cities"] else city_pick()
+            self.area_ids[city].append(area_id)
+            areas.append((area_id, city + 1, f"Район {area_id}"))
+        self.insert("areas", "id, city_id, name", areas)
+
+        variants = [f"Категория {i + 1}" for i in range(sizes["variants"])]
+        self.insert(
+            "variants", "name, sort_order", ((v, i) for i, v in enumerate(variants))
+        )
+        self.insert(
+            "variant_photos",
+            "variant, photo_file_id",
+            ((v, f"gen-variant-photo-{i}") for i, v in enumerate(variants)),
+        )
+        classes = []
+        for class_id in range(1, sizes["classes"] + 1):
+            variant = variants[(class_id - 1) % len(variants)]
+            classes.append((class_id, variant, f"Класс {class_id}", class_id))
+            self.classes.append((variant, f"Класс {class_id}"))
+        self.insert("classes", "id, variant_name, name, sort_order", classes)
+
+    def products(self) -> None:
+        city_pick = Zipf(self.sizes["cities"], 1.1, self.rng)
+        class_pick = Zipf(self.sizes["classes"], 1.0, self.rng)
+        rng = self.rng
+
+        def rows() -> Iterator[tuple]:
+            for product_id in range(1, self.sizes["products"] + 1):
+                city = city_pick()
+                variant, class_name = self.classes[class_pick()]
+                # log-normal-ish prices: most cheap, a long expensive tail
+                price = max(50, int(rng.lognormvariate(6.5, 0.8)) // 10 * 10)
+                self.prices.append(price)
+                yield (
+                    product_id,
+                    city + 1,
+                    rng.choice(self.area_ids[city]),
+                    variant,
+                    class_name,
+                    f"{class_name} №{product_id}",
+                    "Сгенерированный товар для нагрузочных тестов.",
+                    price,
+                    f"gen-photo-{product_id}",
+                    1,
+                    1,
+                )
+
+        self.insert(
+            "products",
+            "id, city_id, area_id, variant, class, title, description, price, "
+            "photo_file_id, stock, is_active",
+            rows(),
+        )
+
+    def orders(self) -> None:
+        sizes = self.sizes
+        rng = self.rng
+        user_pick = Zipf(sizes["users"], 0.8, rng)
+        products = permutation(sizes["products"], rng)
+        order_rows: list[tuple] = []
+        item_rows: list[tuple] = []
+        payment_rows: list[tuple] = []
+        sold_rows: list[tuple] = []
+        item_id = 0
+        recent = self.until - timedelta(days=3)
+
+        def flush() -> None:
+            self.conn.executemany(
+                "INSERT INTO orders (id, user_id, total, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                order_rows,
+            )
+            self.conn.executemany(
+                "INSERT INTO order_items (id, order_id, product_id, quantity, price) "
+                "VALUES (?, ?, ?, 1, ?)",
+                item_rows,
+            )
+            self.conn.executemany(
+                "INSERT INTO payments (order_id, user_id, total, status, photo_file_id, "
+                "created_at, processed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                payment_rows,
+            )
+            self.conn.executemany(
+                "UPDATE products SET stock = 0, sold_to_user_id = ?, sold_order_id = ?, "
+                "sold_at = ? WHERE id = ?",
+                sold_rows,
+            )
+            self.conn.commit()
+            for name, rows in (
+                ("orders", order_rows),
+                ("order_items", item_rows),
+                ("payments", payment_rows),
+            ):
+                self.counts[name] = self.counts.get(name, 0) + len(rows)
+                rows.clear()
+            sold_rows.clear()
+
+        for order_id in range(1, sizes["orders"] + 1):
+            user = user_pick()
+            user_id = FIRST_USER_ID + user
+            created = self.moment()
+            roll = rng.random()
+            has_payment = order_id <= sizes["payments"]
+            if not has_payment:
+                status = "pending_review"
+            elif roll < 0.85 or (roll >= 0.95 and created < recent):
+                # only recent orders can still be waiting for review
+                status = "paid"
+            elif roll < 0.95:
+                status = "rejected"
+            else:
+                status = "pending_review"
+            total = 0
+            for _ in range(1 if rng.random() < 0.85 else 2):
+                product_id = next(products, None)
+                if product_id is None:
+                    raise SystemExit("Not enough products for orders, raise --products")
+                price = self.prices[product_id]
+                total += price
+                item_id += 1
+                item_rows.append((item_id, order_id, product_id + 1, price))
+                if status != "rejected":
+                    sold_rows.append(
+                        (user_id, order_id, timestamp(created), product_id + 1)
+                    )
+            order_rows.append((order_id, user_id, total, status, timestamp(created)))
+            self.order_users.append(user_id)
+            if has_payment:
+                processed = created + timedelta(minutes=rng.randint(2, 600))
+                payment_status = {"paid": "confirmed", "rejected": "rejected"}.get(
+                    status, "pending"
+                )
+                payment_rows.append(
+                    (
+                        order_id,
+                        user_id,
+                        total,
+                        payment_status,
+                        f"gen-receipt-{order_id}",
+                        timestamp(created),
+                        None if payment_status == "pending" else timestamp(processed),
+                    )
+                )
+            if status == "paid":
+                self.paid_orders.append(order_id)
+                self.purchases[user] += 1
+            if len(order_rows) >= self.batch:
+                flush()
+        flush()
+
+    def users(self) -> None:
+        rng = self.rng
+        city_pick = Zipf(self.sizes["cities"], 1.1, rng)
+
+        def rows() -> Iterator[tuple]:
+            for index in range(self.sizes["users"]):
+                city = city_pick()
+                yield (
+                    FIRST_USER_ID + index,
+                    f"user{index}" if rng.random() < 0.7 else None,
+                    rng.choice(FIRST_NAMES),
+                    self.purchases[index],
+                    city + 1,
+                    rng.choice(self.area_ids[city]),
+                    1 if rng.random() < 0.03 else 0,
+                    timestamp(self.moment()),
+                )
+
+        self.insert(
+            "users",
+            "tg_id, username, first_name, purchases_count, last_city_id, "
+            "last_area_id, bot_blocked, created_at",
+            rows(),
+        )
+
+    def reviews(self) -> None:
+        rng = self.rng
+        paid = self.paid_orders
+        if not paid:
+            return
+        count = min(self.sizes["reviews"], len(paid))
+        rows = (
+            (
+                self.order_users[order_id - 1],
+                order_id,
+                rng.choice(REVIEW_TEXTS),
+                timestamp(self.moment()),
+            )
+            for order_id in (paid[rng.randrange(len(paid))] for _ in range(count))
+        )
+        self.insert("reviews", "user_id, order_id, text, created_at", rows)
+
+    def support_threads(self) -> None:
+        user_pick = Zipf(self.sizes["users"], 0.8, self.rng)
+        rows = (
+            (
+                FIRST_USER_ID + user_pick(),
+                ADMIN_GROUP_ID,
+                message_id,
+                timestamp(self.moment()),
+            )
+            for message_id in range(1, self.sizes["support_threads"] + 1)
+        )
+        self.insert(
+            "support_threads",
+            "user_tg_id, admin_group_id, admin_message_id, created_at",
+            rows,
+        )
+
+
+async def create_schema() -> None:
+    from app.db import database as db
+
+    await db.init_db()
+
+
+async def rebuild_rollups() -> int:
+    from app.db import database as db
+
+    # rows are inserted already paid, so the order status triggers and
+    # confirm_payment never ran
+    await db.rebuild_purchase_summaries()
+    return await db.rebuild_sales_daily()
+
+
+def clear_seed_data(conn: sqlite3.Connection) -> None:
+    # init_db seeds a tiny demo catalog; start from empty tables instead
+    for table in (
+        "order_items", "payments", "orders", "cart_items", "reviews", "products",
+        "areas", "cities", "classes", "variant_photos", "variants", "users",
+        "support_threads",
+    ):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute("DELETE FROM payment_status_counts")
+    conn.execute("DELETE FROM sales_daily")
+    conn.execute("DELETE FROM sales_daily_orders")
+    conn.execute("DELETE FROM sqlite_sequence")
+    conn.commit()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate a large synthetic shop database for benchmarks."
+    )
+    parser.add_argument("--out", type=Path, required=True, help="new .db file")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--until",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="last day of generated activity (YYYY-MM-DD); fix it for identical output",
+    )
+    parser.add_argument("--days", type=int, default=365, help="history length")
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--force", action="store_true", help="overwrite --out")
+    for name in PRESETS["small"]:
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=int, help="overrides the preset"
+        )
+    args = parser.parse_args()
+
+    sizes = dict(PRESETS[args.preset])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+    sizes["payments"] = min(sizes["payments"], sizes["orders"])
+    sizes["areas"] = max(sizes["areas"], sizes["cities"])
+    if min(sizes["cities"], sizes["variants"], sizes["classes"], sizes["users"]) < 1:
+        parser.error("cities, variants, classes and users must be at least 1")
+
+    if args.out.exists():
+        if not args.force:
+            parser.error(f"{args.out} exists, pass --force to overwrite")
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{args.out}{suffix}").unlink(missing_ok=True)
+
+    use_db(args.out)
+    asyncio.run(create_schema())
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.out)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -200000")
+    clear_seed_data(conn)
+
+    generator = Generator(conn, sizes, args)
+    steps = ("catalog", "products", "orders", "users", "reviews", "support_threads")
+    for step in steps:
+        step_started = time.perf_counter()
+        getattr(generator, step)()
+        print(f"{step:<16} {time.perf_counter() - step_started:>8.1f}s", flush=True)
+    conn.commit()
+    step_started = time.perf_counter()
+    generator.counts["sales_daily"] = asyncio.run(rebuild_rollups())
+    print(f"{'sales_daily':<16} {time.perf_counter() - step_started:>8.1f}s", flush=True)
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+    total = sum(generator.counts.values())
+    print(f"seed={args.seed} until={args.until} preset={args.preset}")
+    for table, count in generator.counts.items():
+        print(f"{table:<16} {count:>12,}")
+    print(
+        f"{'total':<16} {total:>12,} rows in {time.perf_counter() - started:.1f}s, "
+        f"{args.out.stat().st_size / 1024 / 1024:.1f} MB"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
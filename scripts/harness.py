@@ -0,0 +1,216 @@
+﻿from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncGenerator
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import (
+    CallbackQuery,
+    Chat,
+    ChatMemberOwner,
+    Message,
+    PhotoSize,
+    Update,
+    User,
+)
+
+BOT_TOKEN = "123456789:BENCHMARK-TOKEN"
+BOT_ID = 123456789
+
+
+def use_db(path: Path | str) -> Path:
+    # Must run before anything under app/ is imported: config reads DB_PATH once.
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.environ["DB_PATH"] = str(path)
+    os.environ.setdefault("BOT_TOKEN", BOT_TOKEN)
+    return path
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def observations(histogram: Any) -> int:
+    # calls seen by an app.services.metrics.Histogram, all label sets together
+    return sum(sum(counts) for counts, _ in histogram.series.values())
+
+
+def _chat(chat_id: int) -> Chat:
+    return Chat(id=chat_id, type="private" if chat_id > 0 else "supergroup")
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.pending_updates: list[dict[str, Any]] = []
+        self._message_ids = itertools.count(1)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset(self) -> None:
+        self.calls.clear()
+
+    async def close(self) -> None:
+        return None
+
+    async def make_request(self, bot: Bot, method, timeout: int | None = None) -> Any:
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(bot, method)
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: dict[str, Any] | None = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    def _message(self, bot: Bot, chat_id: int, **fields: Any) -> Message:
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=_chat(int(chat_id)),
+            **fields,
+        ).as_(bot)
+
+    def respond(self, bot: Bot, method) -> Any:
+        name = method.__api_method__
+        if name == "getMe":
+            return User(id=bot.id, is_bot=True, first_name="bench", username="bench_bot")
+        if name == "getChatMember":
+            return ChatMemberOwner(
+                user=User(id=method.user_id, is_bot=False, first_name="admin"),
+                is_anonymous=False,
+            )
+        if name == "getUpdates":
+            # offset acknowledges everything before it, like the real API
+            offset = int(method.offset or 0)
+            self.pending_updates = [
+                raw for raw in self.pending_updates if int(raw["update_id"]) >= offset
+            ]
+            batch = self.pending_updates[: method.limit or 100]
+            return [Update.model_validate(raw, context={"bot": bot}) for raw in batch]
+        if name == "sendMediaGroup":
+            return [self._message(bot, method.chat_id) for _ in method.media]
+        if name.startswith("send") or name in {"copyMessage", "forwardMessage"}:
+            return self._message(bot, method.chat_id)
+        return True
+
+
+def make_bot(latency: float = 0.0) -> Bot:
+    return Bot(token=BOT_TOKEN, session=FakeSession(latency=latency))
+
+
+class UpdateFactory:
+    def __init__(self, bot_id: int = BOT_ID) -> None:
+        self.bot_id = bot_id
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> User:
+        return User(
+            id=user_id,
+            is_bot=False,
+            first_name=f"user{user_id}",
+            username=f"user{user_id}",
+        )
+
+    def message(
+        self,
+        user_id: int,
+        text: str | None = None,
+        *,
+        chat_id: int | None = None,
+        photo_id: str | None = None,
+        reply_to: int | None = None,
+    ) -> Update:
+        chat_id = user_id if chat_id is None else chat_id
+        fields: dict[str, Any] = {}
+        if text is not None:
+            fields["text"] = text
+        if photo_id is not None:
+            fields["photo"] = [
+                PhotoSize(
+                    file_id=photo_id, file_unique_id=photo_id, width=800, height=600
+                )
+            ]
+        if reply_to is not None:
+            fields["reply_to_message"] = Message(
+                message_id=reply_to, date=datetime.now(), chat=_chat(chat_id)
+            )
+        return Update(
+            update_id=next(self._update_ids),
+            message=Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=_chat(chat_id),
+                from_user=self._user(user_id),
+                **fields,
+            ),
+        )
+
+    def callback(
+        self, user_id: int, data: str, *, chat_id: int | None = None
+    ) -> Update:
+        chat_id = user_id if chat_id is None else chat_id
+        return Update(
+            update_id=next(self._update_ids),
+            callback_query=CallbackQuery(
+                id=str(next(self._callback_ids)),
+                from_user=self._user(user_id),
+                chat_instance=str(chat_id),
+                data=data,
+                message=Message(
+                    message_id=next(self._message_ids),
+                    date=datetime.now(),
+                    chat=_chat(chat_id),
+                    from_user=User(id=self.bot_id, is_bot=True, first_name="bench"),
+                    text="menu",
+                ),
+            ),
+        )
+
+
+def catalog_updates(
+    city_id: int, users: int, count: int, catalog_text: str
+) -> list[dict[str, Any]]:
+    # Typical browsing: open catalog, pick a city, go back. Raw JSON like Telegram sends.
+    factory = UpdateFactory()
+    updates = []
+    for idx in range(count):
+        user_id = 2000 + idx % users
+        step = idx // users % 3
+        if step == 0:
+            update = factory.message(user_id, catalog_text)
+        elif step == 1:
+            update = factory.callback(user_id, f"city:{city_id}")
+        else:
+            update = factory.callback(user_id, "back:cities")
+        updates.append(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+    return updates
@@ -0,0 +1,241 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+from aiogram import Bot
+
+from harness import (
+    BOT_TOKEN,
+    FakeSession,
+    UpdateFactory,
+    observations,
+    percentile,
+    use_db,
+)
+
+SCRIPTS = Path(__file__).resolve().parent
+ADMIN_GROUP = -1009999999999
+FIRST_USER = 5_000_000_000
+
+
+class LoadSession(FakeSession):
+    # Catches the payment request posted to the admin group, the way admins see it.
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__(latency)
+        self.requests: asyncio.Queue[str | None] = asyncio.Queue()
+
+    def respond(self, bot: Bot, method) -> Any:
+        if method.__api_method__ == "sendPhoto" and method.reply_markup is not None:
+            for row in method.reply_markup.inline_keyboard:
+                for button in row:
+                    if (button.callback_data or "").startswith("pay:confirm:"):
+                        self.requests.put_nowait(button.callback_data)
+        return super().respond(bot, method)
+
+
+def prepare_db(work: Path, args: argparse.Namespace) -> None:
+    if args.db:
+        src = sqlite3.connect(args.db)
+        dst = sqlite3.connect(work)
+        src.backup(dst)
+        src.close()
+        dst.close()
+        return
+    subprocess.run(
+        [
+            sys.executable, str(SCRIPTS / "gen_shop_db.py"), "--out", str(work),
+            "--preset", "small", "--seed", str(args.seed), "--until", "2026-01-31",
+            "--products", str(max(3_000, args.users * 5)),
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def plan_purchases(path: Path, users: int, seed: int) -> list[dict[str, Any]]:
+    # One unsold product per shopper, so every checkout can succeed.
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        """
+        SELECT p.id, p.city_id, p.area_id, v.id, c.id
+        FROM products p
+        JOIN variants v ON v.name = p.variant
+        JOIN classes c ON c.variant_name = p.variant AND c.name = p.class
+        WHERE p.is_active = 1 AND COALESCE(p.stock, 0) >= 1
+        ORDER BY random()
+        LIMIT ?
+        """,
+        (users,),
+    ).fetchall()
+    conn.close()
+    if len(rows) < users:
+        raise SystemExit(f"only {len(rows)} products in stock for {users} users")
+    random.Random(seed).shuffle(rows)
+    keys = ("product", "city", "area", "variant", "class")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def flow(factory: UpdateFactory, user_id: int, plan: dict[str, Any], btn) -> list:
+    return [
+        ("start", factory.message(user_id, "/start")),
+        ("catalog", factory.message(user_id, btn.CATALOG)),
+        ("city", factory.callback(user_id, f"city:{plan['city']}")),
+        ("area", factory.callback(user_id, f"area:{plan['area']}")),
+        ("variant", factory.callback(user_id, f"v:{plan['variant']}")),
+        ("class", factory.callback(user_id, f"c:{plan['class']}")),
+        ("add", factory.callback(user_id, f"add:{plan['product']}")),
+        ("cart", factory.message(user_id, btn.CART)),
+        ("checkout", factory.callback(user_id, "cart:checkout")),
+        ("pay_submit", factory.callback(user_id, "pay:submit")),
+        ("photo", factory.message(user_id, photo_id=f"load-photo-{user_id}")),
+    ]
+
+
+async def run(args: argparse.Namespace, work: Path) -> dict[str, Any]:
+    from app.bot import create_dispatcher
+    from app.config import BTN
+    from app.services import metrics
+
+    plans = plan_purchases(work, args.users, args.seed)
+    dp = create_dispatcher()
+    session = LoadSession(latency=args.latency_ms / 1000)
+    bot = Bot(token=BOT_TOKEN, session=session)
+    factory = UpdateFactory()
+    rng = random.Random(args.seed)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+
+    async def feed(step: str, update) -> None:
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as exc:
+            errors[f"{step}: {type(exc).__name__}: {exc}"] += 1
+        latencies[step].append(time.perf_counter() - started)
+
+    async def shopper(index: int, plan: dict[str, Any]) -> None:
+        if args.ramp:
+            await asyncio.sleep(args.ramp * index / args.users)
+        user_id = FIRST_USER + index
+        for step, update in flow(factory, user_id, plan, BTN):
+            if args.think_ms:
+                await asyncio.sleep(rng.uniform(0, args.think_ms) / 1000)
+            await feed(step, update)
+
+    async def admin(admin_id: int) -> None:
+        while (data := await session.requests.get()) is not None:
+            await feed("confirm", factory.callback(admin_id, data, chat_id=ADMIN_GROUP))
+
+    db_before = observations(metrics.DB_SECONDS)
+    started = time.perf_counter()
+    admins = [asyncio.create_task(admin(i + 1)) for i in range(args.admins)]
+    await asyncio.gather(*(shopper(i, plan) for i, plan in enumerate(plans)))
+    for _ in admins:
+        session.requests.put_nowait(None)
+    await asyncio.gather(*admins)
+    elapsed = time.perf_counter() - started
+    db_calls = observations(metrics.DB_SECONDS) - db_before
+    await dp.fsm.close()
+
+    conn = sqlite3.connect(work)
+    orders = dict(
+        conn.execute(
+            "SELECT status, COUNT(*) FROM orders WHERE user_id >= ? GROUP BY status",
+            (FIRST_USER,),
+        ).fetchall()
+    )
+    conn.close()
+
+    timings = [value for values in latencies.values() for value in values]
+    updates = len(timings)
+    return {
+        "users": args.users,
+        "admins": args.admins,
+        "updates": updates,
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_s": round(updates / elapsed, 1),
+        "p50_ms": round(percentile(timings, 50) * 1000, 2),
+        "p95_ms": round(percentile(timings, 95) * 1000, 2),
+        "p99_ms": round(percentile(timings, 99) * 1000, 2),
+        "api_calls_per_update": round(session.total_calls / max(1, updates), 2),
+        "db_calls_per_update": round(db_calls / max(1, updates), 2),
+        "api_calls": dict(session.calls.most_common()),
+        "orders": orders,
+        "errors": dict(errors),
+        "steps": {
+            step: {
+                "n": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+            }
+            for step, values in latencies.items()
+        },
+    }
+
+
+def report(result: dict[str, Any]) -> None:
+    print(
+        f"users={result['users']} admins={result['admins']} "
+        f"updates={result['updates']} in {result['elapsed_s']}s "
+        f"-> {result['updates_per_s']} updates/s"
+    )
+    print(
+        f"latency p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+        f"p99={result['p99_ms']}ms"
+    )
+    print(
+        f"per update: {result['api_calls_per_update']} API calls, "
+        f"{result['db_calls_per_update']} DB calls"
+    )
+    print(f"{'step':<12} {'n':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for step, stats in result["steps"].items():
+        print(f"{step:<12} {stats['n']:>6} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f}")
+    print("API calls:", ", ".join(f"{k}={v}" for k, v in result["api_calls"].items()))
+    print("orders:", ", ".join(f"{k}={v}" for k, v in result["orders"].items()) or "-")
+    if result["errors"]:
+        print("errors:", ", ".join(f"{k}={v}" for k, v in result["errors"].items()))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Drive the dispatcher with simulated shoppers and admins."
+    )
+    parser.add_argument("--users", type=int, default=1000, help="concurrent shoppers")
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--db", type=Path, help="start from a copy of this database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fake API latency")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="max pause between steps")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to start all users")
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    work = use_db(Path(tmp.name) / "load.db")
+    # Fixed admins and group: the test must not depend on the real .env.
+    os.environ["ADMIN_IDS"] = ",".join(str(i + 1) for i in range(args.admins))
+    os.environ["ADMIN_GROUP_ID"] = str(ADMIN_GROUP)
+    prepare_db(work, args)
+
+    result = asyncio.run(run(args, work))
+    report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    tmp.cleanup()
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,208 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from harness import make_bot, observations, percentile, use_db
+
+
+def capture_files(paths: list[Path]) -> list[Path]:
+    files: list[Path] = []
+    for path in paths:
+        files.extend(sorted(path.glob("*.jsonl.gz")) if path.is_dir() else [path])
+    return files
+
+
+def load_capture(files: list[Path]) -> tuple[dict[str, Any], list[tuple[float, dict]]]:
+    # Workers write one file each; merged by arrival time they give the whole stream.
+    header = {"admins": 0, "admin_group": False}
+    updates: list[tuple[float, dict]] = []
+    for path in files:
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            try:
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        break  # capture cut off by a crash
+                    if "capture" in item:
+                        header["admins"] = max(header["admins"], item.get("admins", 0))
+                        header["admin_group"] |= bool(item.get("admin_group"))
+                        continue
+                    updates.append((float(item["ts"]), item["update"]))
+            except (EOFError, gzip.BadGzipFile):
+                # never closed (crash, SIGKILL): keep what was flushed
+                pass
+    updates.sort(key=lambda pair: pair[0])
+    return header, updates
+
+
+def update_kind(raw: dict[str, Any]) -> str:
+    return next((key for key in raw if key != "update_id"), "unknown")
+
+
+async def replay(
+    updates: list[tuple[float, dict]], args: argparse.Namespace
+) -> dict[str, Any]:
+    from app.bot import create_dispatcher
+    from app.db import database as db
+    from app.middlewares.idempotency import IdempotencyMiddleware
+    from app.services import metrics
+    from app.services.cluster import shard_key
+    from app.services.ordering import KeyedSerializer
+
+    if not args.db:
+        await db.init_db()
+    dp = create_dispatcher()
+    bot = make_bot(latency=args.latency_ms / 1000)
+    # Same ordering guarantee as in production: one user's updates run in order.
+    serializer = KeyedSerializer()
+    latencies: dict[str, list[float]] = {}
+    errors: Counter[str] = Counter()
+    late: list[float] = []
+
+    async def handle(raw: dict[str, Any], submitted: float) -> None:
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception as exc:
+            errors[f"{type(exc).__name__}: {exc}"] += 1
+        latencies.setdefault(update_kind(raw), []).append(time.perf_counter() - submitted)
+
+    db_before = observations(metrics.DB_SECONDS)
+    first = updates[0][0]
+    started = time.perf_counter()
+    for ts, raw in updates:
+        if not args.fast:
+            due = started + (ts - first) / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                late.append(-delay)
+        submitted = time.perf_counter()
+        serializer.submit(
+            shard_key(raw), lambda raw=raw, submitted=submitted: handle(raw, submitted)
+        )
+    await serializer.join()
+    elapsed = time.perf_counter() - started
+    db_calls = observations(metrics.DB_SECONDS) - db_before
+    dropped = sum(
+        m.dropped for m in dp.update.outer_middleware if isinstance(m, IdempotencyMiddleware)
+    )
+    await dp.fsm.close()
+
+    timings = [value for values in latencies.values() for value in values]
+    count = len(timings)
+    span = updates[-1][0] - first
+    return {
+        "updates": count,
+        "capture_span_s": round(span, 1),
+        "elapsed_s": round(elapsed, 2),
+        "mode": "fast" if args.fast else f"x{args.speed:g}",
+        "updates_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(timings, 50) * 1000, 2),
+        "p95_ms": round(percentile(timings, 95) * 1000, 2),
+        "p99_ms": round(percentile(timings, 99) * 1000, 2),
+        # timed mode only: how far the replay fell behind the original schedule
+        "max_behind_ms": round(max(late, default=0.0) * 1000, 1),
+        "api_calls_per_update": round(bot.session.total_calls / max(1, count), 2),
+        "db_calls_per_update": round(db_calls / max(1, count), 2),
+        "duplicates_dropped": dropped,
+        "errors": dict(errors),
+        "kinds": {
+            kind: {
+                "n": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+            }
+            for kind, values in latencies.items()
+        },
+    }
+
+
+def report(result: dict[str, Any]) -> None:
+    print(
+        f"updates={result['updates']} captured over {result['capture_span_s']}s, "
+        f"replayed {result['mode']} in {result['elapsed_s']}s "
+        f"-> {result['updates_per_s']} updates/s"
+    )
+    print(
+        f"latency p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+        f"p99={result['p99_ms']}ms, max behind schedule {result['max_behind_ms']}ms"
+    )
+    print(
+        f"per update: {result['api_calls_per_update']} API calls, "
+        f"{result['db_calls_per_update']} DB calls; "
+        f"duplicates dropped {result['duplicates_dropped']}"
+    )
+    print(f"{'update':<16} {'n':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for kind, stats in result["kinds"].items():
+        print(f"{kind:<16} {stats['n']:>6} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f}")
+    if result["errors"]:
+        print("errors:", ", ".join(f"{k}={v}" for k, v in result["errors"].items()))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded update capture through the dispatcher."
+    )
+    parser.add_argument(
+        "captures", nargs="+", type=Path, help=".jsonl.gz files or capture directories"
+    )
+    speed = parser.add_mutually_exclusive_group()
+    speed.add_argument("--speed", type=float, default=1.0, help="1 = original pace")
+    speed.add_argument("--fast", action="store_true", help="as fast as possible")
+    parser.add_argument("--db", type=Path, help="replay against a copy of this database")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fake API latency")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N")
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    files = capture_files(args.captures)
+    if not files:
+        parser.error("no capture files found")
+    header, updates = load_capture(files)
+    if args.limit:
+        updates = updates[: args.limit]
+    if not updates:
+        parser.error("capture is empty")
+
+    tmp = tempfile.TemporaryDirectory()
+    work = use_db(Path(tmp.name) / "replay.db")
+    if args.db:
+        src = sqlite3.connect(args.db)
+        dst = sqlite3.connect(work)
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+    from app.middlewares.recording import REPLAY_ADMIN_GROUP
+
+    # Recorded admins are 1..N and the admin group has a fixed id; never re-record.
+    os.environ["ADMIN_IDS"] = ",".join(str(i + 1) for i in range(header["admins"]))
+    os.environ["ADMIN_GROUP_ID"] = str(REPLAY_ADMIN_GROUP if header["admin_group"] else 0)
+    os.environ["RECORD_UPDATES_DIR"] = ""
+
+    result = asyncio.run(replay(updates, args))
+    report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,19 @@
 ﻿from __future__ import annotations
 
+import argparse
 import os
 import sys
 import sqlite3
+import time
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from app.db import database as db
+
 ENV_PATH = BASE_DIR / ".env"
 DB_PATH = BASE_DIR / "data" / "shop.db"
 LOG_PATH = BASE_DIR / "logs" / "bot.log"
@@ -21,6 +28,8 @@ REQUIRED_TABLES = {
     "order_items",
     "payments",
     "reviews",
+    "sales_daily",
+    "sales_daily_orders",
     "support_threads",
     "variant_photos",
     "variants",
@@ -28,6 +37,54 @@ REQUIRED_TABLES = {
     "settings",
 }
 
+EXPECTED_INDEXES = {
+    "idx_outbox_status_due": "outbox",
+    "idx_fsm_states_updated": "fsm_states",
+    "idx_payments_status_created": "payments",
+    "idx_orders_user_status": "orders",
+    "idx_order_items_order": "order_items",
+    "idx_users_last_paid": "users",
+    "idx_products_catalog": "products",
+}
+
+# Hot queries, taken from database.py so the check cannot drift from the app:
+# (title, SQL, index the plan must use or None, latency budget in ms).
+# Parameters come from _sample_params.
+KEY_QUERIES = [
+    ("Catalog filter", db.PRODUCTS_FILTERED_SQL, "idx_products_catalog", 20),
+    ("Cart", db.CART_ITEMS_SQL, "sqlite_autoindex_cart_items_1", 10),
+    (
+        "Pending payments page",
+        db.PENDING_PAYMENTS_PAGE_SQL.format(where="", order=""),
+        "idx_payments_status_created",
+        10,
+    ),
+    ("Outbox due", db.DUE_OUTBOX_SQL, "idx_outbox_status_due", 10),
+    ("FSM expiry", f"SELECT key {db.EXPIRED_FSM_SQL}", "idx_fsm_states_updated", 20),
+    ("Stats", db.ORDERS_BY_STATUS_SQL, None, 200),
+    ("Sales report", db.sales_report_sql("city"), "PRIMARY KEY", 50),
+    (
+        "Purchase history",
+        db.PAID_ORDER_IDS_PAGE_SQL.format(where="", order="DESC"),
+        "idx_orders_user_status",
+        10,
+    ),
+    ("Paid users", db.PAID_USERS_SQL, "idx_users_last_paid", 10),
+    ("Payments report", db.PAYMENTS_REPORT_SQL, None, 3000),
+]
+
+ORPHAN_CHECKS = {
+    "cart_items without product": (
+        "SELECT COUNT(*) FROM cart_items WHERE product_id NOT IN (SELECT id FROM products)"
+    ),
+    "order_items without order": (
+        "SELECT COUNT(*) FROM order_items WHERE order_id NOT IN (SELECT id FROM orders)"
+    ),
+    "order_items without product": (
+        "SELECT COUNT(*) FROM order_items WHERE product_id NOT IN (SELECT id FROM products)"
+    ),
+}
+
 
 def _print(title: str, ok: bool, detail: str = "") -> None:
     status = "OK" if ok else "FAIL"
@@ -37,6 +94,14 @@ def _print(title: str, ok: bool, detail: str = "") -> None:
     print(line)
 
 
+def _info(title: str, detail: str) -> None:
+    print(f"[INFO] {title} - {detail}")
+
+
+def _mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
 def _load_env(path: Path) -> None:
     if not path.exists():
         return
@@ -154,7 +219,154 @@ def check_db() -> bool:
     return ok
 
 
+def _sample_params(conn: sqlite3.Connection) -> dict:
+    params = {
+        "city_id": 0,
+        "area_id": 0,
+        "variant": "",
+        "class_name": "",
+        "user_id": 0,
+        "status": "paid",
+        "since": (datetime.now(timezone.utc).date() - timedelta(days=29)).isoformat(),
+        # one size for every LIMIT; the app's pages are smaller
+        "limit": 50,
+    }
+    row = conn.execute(
+        """
+        SELECT city_id, area_id, variant, class FROM products
+        WHERE is_active = 1 AND COALESCE(stock, 0) >= 1
+        ORDER BY id DESC LIMIT 1
+        """
+    ).fetchone()
+    if row:
+        params.update(city_id=row[0], area_id=row[1], variant=row[2], class_name=row[3])
+    # the heaviest buyer is the worst case for history
+    row = conn.execute(
+        """
+        SELECT user_id FROM orders WHERE status = 'paid'
+        GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        """
+    ).fetchone()
+    if row:
+        params["user_id"] = row[0]
+    params["before"] = time.time() - 72 * 3600
+    return params
+
+
+def check_files(args: argparse.Namespace) -> bool:
+    ok = True
+    limits = (
+        ("DB size", DB_PATH, args.max_db_mb),
+        ("WAL size", Path(f"{DB_PATH}-wal"), args.max_wal_mb),
+    )
+    for title, path, limit in limits:
+        size = path.stat().st_size if path.exists() else 0
+        fits = size <= limit * 1024 * 1024
+        _print(title, fits, f"{_mb(size)} (limit {limit:g} MB)")
+        ok = ok and fits
+    logs = [p for p in LOG_PATH.parent.glob(LOG_PATH.name + "*") if p.is_file()]
+    size = sum(p.stat().st_size for p in logs)
+    fits = size <= args.max_log_mb * 1024 * 1024
+    _print("Log files", fits, f"{_mb(size)} in {len(logs)} files (limit {args.max_log_mb:g} MB)")
+    return ok and fits
+
+
+def check_perf(args: argparse.Namespace) -> bool:
+    if not DB_PATH.exists():
+        _print("DB file", False, "not found")
+        return False
+
+    ok = check_files(args)
+    # read-only: the check must not change what it measures
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        _print("Journal mode", mode == "wal", mode)
+        ok = ok and mode == "wal"
+
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        share = free / pages if pages else 0.0
+        fragmented = share > args.max_free
+        _print(
+            "Free pages",
+            not fragmented,
+            f"{share:.0%} of {pages}" + (", run VACUUM" if fragmented else ""),
+        )
+        ok = ok and not fragmented
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        _info("Page size / auto_vacuum", f"{page_size} / {auto_vacuum}")
+        analyzed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if not analyzed:
+            _info("Planner statistics", "ANALYZE was never run")
+
+        indexes = {
+            row[0]
+            for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        for name, table in EXPECTED_INDEXES.items():
+            _print(f"Index {name}", name in indexes, f"on {table}")
+            ok = ok and name in indexes
+
+        for title, count_sql in ORPHAN_CHECKS.items():
+            orphans = conn.execute(count_sql).fetchone()[0]
+            _print(f"Orphans: {title}", orphans == 0, f"count={orphans}")
+            ok = ok and orphans == 0
+
+        params = _sample_params(conn)
+        for title, sql, index, budget in KEY_QUERIES:
+            plan = " / ".join(
+                row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+            )
+            if index is not None:
+                uses = index in plan
+                _print(f"Plan: {title}", uses, plan if not uses else f"uses {index}")
+                ok = ok and uses
+            elif "SCAN " in plan:
+                _info(f"Plan: {title}", plan)
+
+            timings = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            median = sorted(timings)[len(timings) // 2]
+            limit = budget * args.budget_scale
+            _print(f"Latency: {title}", median <= limit, f"{median:.1f} ms (budget {limit:g} ms)")
+            ok = ok and median <= limit
+    except Exception as exc:
+        _print("Perf checks", False, str(exc))
+        return False
+    finally:
+        conn.close()
+    return ok
+
+
 def main() -> int:
+    global DB_PATH
+
+    parser = argparse.ArgumentParser(description="Check bot configuration and database.")
+    parser.add_argument("--db", type=Path, help=f"database file (default {DB_PATH})")
+    parser.add_argument(
+        "--perf", action="store_true", help="also check indexes, plans, sizes and latency"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per query")
+    parser.add_argument(
+        "--budget-scale", type=float, default=1.0, help="multiply every latency budget"
+    )
+    parser.add_argument("--max-db-mb", type=float, default=4096)
+    parser.add_argument("--max-wal-mb", type=float, default=64)
+    parser.add_argument("--max-log-mb", type=float, default=200)
+    parser.add_argument(
+        "--max-free", type=float, default=0.25, help="allowed share of free pages"
+    )
+    args = parser.parse_args()
+    if args.db:
+        DB_PATH = args.db.resolve()
+
     print("Bot Self-Check")
     print(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
@@ -165,6 +377,10 @@ def main() -> int:
         ok = False
     if not check_db():
         ok = False
+    if args.perf:
+        print("- performance")
+        if not check_perf(args):
+            ok = False
 
     print("-")
     if ok: